@@ -18,6 +18,8 @@ from app.middlewares.token_validator import access_control
 from app.middlewares.trusted_hosts import TrustedHostMiddleware
 from app.routers import auth, index, services, user_services, users, websocket
 from app.shared import Shared
+from app.utils.api.duckduckgo import close_async_ddgs
+from app.utils.api.session_pool import session_pool
 from app.utils.chat.managers.cache import CacheManager
 from app.utils.js_initializer import js_url_initializer
 from app.utils.logger import ApiLogger
@@ -38,7 +40,9 @@ async def on_startup():
     - Checks if the MySQL database connection is initiated and logs the status.
     - Raises a ConnectionError if the Redis cache connection is not established.
     - Checks if the Redis cache connection is initiated and logs the status.
+    - Builds the per-user chat room index in Redis, if not built yet.
     - Attempts to import and set uvloop as the event loop policy, if available, and logs the result.
+    - Opens pooled sessions of completion APIs.
     - Starts Llama CPP server monitoring if the Llama CPP completion URL is provided.
     """
     ApiLogger.ccritical("⚙️ Booting up...")
@@ -51,6 +55,7 @@ async def on_startup():
     if cache.redis is None:
         raise ConnectionError("Redis is not connected yet!")
     if cache.is_initiated and await cache.redis.ping():
+        await CacheManager.migrate_chat_room_index()
         await CacheManager.delete_user(f"testaccount@{config.host_main}")
         ApiLogger.ccritical("Redis CACHE connected!")
     else:
@@ -65,6 +70,10 @@ async def on_startup():
     except ImportError:
         ApiLogger.ccritical("uvloop not installed!")
 
+    session_pool.open(
+        api_bases=("https://api.openai.com/v1", config.llama_completion_url)
+    )
+
     if config.llama_completion_url:
         # Start Llama CPP server monitoring
         ApiLogger.ccritical("Llama CPP server monitoring started!")
@@ -89,6 +98,7 @@ async def on_shutdown():
     - Terminates and joins the process, if available.
     - Joins the thread, if available.
     - Closes the database and cache connections.
+    - Closes pooled sessions of completion APIs and web search.
     - Logs a message indicating the closure of DB and CACHE connections.
     """
     ApiLogger.ccritical("⚙️ Shutting down...")
@@ -116,6 +126,8 @@ async def on_shutdown():
 
     await db.close()
     await cache.close()
+    await session_pool.close()
+    await close_async_ddgs()
     ApiLogger.ccritical("DB & CACHE connection closed!")
 
 
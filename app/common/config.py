@@ -166,6 +166,14 @@ class Config(metaclass=SingletonMetaClass):
     ] = "http://localhost:8002/v1/completions"
     llama_embedding_url: Optional[str] = "http://localhost:8002/v1/embeddings"
     llama_server_port: Optional[int] = 8002
+    llama_server_completion_concurrency: int = 1
+    llama_server_embedding_concurrency: int = 1
+    llama_server_max_queue_size: int = 32
+    llama_server_memory_budget_mb: Optional[float] = None
+    llama_server_max_resident_models: Optional[int] = None  # 1 if no memory budget is set
+    llama_server_eviction_policy: str = "lru"
+    llama_server_pinned_models: list[str] = field(default_factory=list)
+    llama_server_load_timeout: float = 60.0  # seconds to wait for models in use to be evicted
 
     def __post_init__(self):
         self.is_llama_available: bool = False
@@ -301,10 +309,68 @@ class ChatConfig:
     query_context_token_limit: int = 2048
     scrolling_chunk_size_when_browsing: int = 1024
     scrolling_overlap_when_browsing: int = 256
+    browsing_max_links_in_parallel: int = (
+        3  # number of links to click at once when browsing
+    )
+    browsing_max_fetches: int = 8  # number of pages to fetch at once
+    browsing_max_fetches_per_host: int = 2  # number of pages to fetch at once per host
+    browsing_scoring_batch_size: int = (
+        4  # number of scrollable contents to score at once per page
+    )
+    web_cache_size: int = (
+        256  # number of search results and web pages to keep in memory
+    )
+    web_cache_ttl: float = 600.0  # seconds before cached web pages are stale
+    web_cache_stale_ttl: float = (
+        86400.0  # seconds to keep stale web pages for revalidation
+    )
+    web_cache_use_redis: bool = True  # share the web cache through redis
+    embedding_cache_size: int = (
+        4096  # number of embedded texts to keep in memory
+    )
+    embedding_cache_ttl: int = (
+        604800  # seconds to keep embedded texts in redis, 0 to keep them forever
+    )
+    embedding_cache_use_redis: bool = True  # share the embedding cache through redis
+    ingestion_batch_size: int = 64  # number of chunks to embed and upsert at once
+    ingestion_embedding_concurrency: int = (
+        4  # number of batches to embed at once when embedding a file
+    )
+    ingestion_upsert_concurrency: int = (
+        2  # number of batches to upsert at once when embedding a file
+    )
+    ingestion_queue_size: int = (
+        8  # number of batches waiting between stages when embedding a file
+    )
     vectorstore_n_results_limit: int = 10
+    vectorstore_collections_ttl: float = (
+        30.0  # seconds to trust the cached names of vectorstore collections
+    )
+    vectorstore_missing_collections_ttl: float = (
+        5.0  # seconds to trust that a collection doesn't exist, 0 to always check
+    )
     global_prefix: Optional[str] = GLOBAL_PREFIX  # prefix for global chat
     global_suffix: Optional[str] = GLOBAL_SUFFIX  # suffix for global chat
     local_embedding_model: Optional[str] = LOCAL_EMBEDDING_MODEL
+    message_history_compression_threshold: Optional[int] = (
+        1024  # compress cached message histories longer than this many bytes
+    )
+    tokenization_cache_size: int = (
+        4096  # number of encoded texts to keep in the tokenization cache
+    )
+    api_connection_limit: int = 0  # max connections of completion API sessions, 0 for unlimited
+    api_connection_limit_per_host: int = 0  # max connections per API host, 0 for unlimited
+    api_connect_timeout: float = (
+        60.0  # seconds to wait for a free connection and to connect
+    )
+    api_dns_cache_ttl: int = 300  # seconds to cache DNS lookups of API hosts
+    api_keepalive_timeout: float = 60.0  # seconds to keep idle connections
+    stream_flush_interval: float = (
+        0.03  # seconds to coalesce streamed text before sending a frame
+    )
+    stream_flush_size: int = (
+        512  # send a frame at once when this many bytes are coalesced
+    )
 
 
 config = Config.get()
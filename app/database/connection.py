@@ -24,9 +24,15 @@ from sqlalchemy.ext.asyncio import (
 )
 from sqlalchemy_utils import create_database, database_exists
 
-from app.common.config import Config, SingletonMetaClass, logging_config
+from app.common.config import (
+    ChatConfig,
+    Config,
+    SingletonMetaClass,
+    logging_config,
+)
 from app.errors.api_exceptions import Responses_500
 from app.shared import Shared
+from app.utils.langchain.cached_embeddings import CachedEmbeddings
 from app.utils.langchain.qdrant_vectorstore import Qdrant
 from app.utils.logger import CustomLogger
 
@@ -405,7 +411,14 @@ class CacheFactory(metaclass=SingletonMetaClass):
                 prefer_grpc=True,
             ),
             collection_name=config.shared_vectorestore_name,
-            embeddings=Shared().embeddings,
+            embeddings=CachedEmbeddings(
+                Shared().embeddings,
+                redis_getter=(
+                    (lambda: self._redis)
+                    if ChatConfig.embedding_cache_use_redis
+                    else None
+                ),
+            ),
         )
         self.is_initiated = True
 
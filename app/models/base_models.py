@@ -382,6 +382,13 @@ class TextGenerationSettings(BaseModel):
         default=False,
         description="If True, the EOS token is banned from being generated.",
     )
+    session_id: Optional[str] = Field(
+        default=None,
+        description=(
+            "The ID of the session, e.g. user and chat room, which this generation belongs to. "
+            "Used to reuse the evaluated prompt prefix of the previous turn of the same session."
+        ),
+    )
 
 
 class CreateEmbeddingRequest(BaseModel):
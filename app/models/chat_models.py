@@ -3,7 +3,7 @@ from datetime import datetime
 from enum import Enum
 from functools import wraps
 from inspect import iscoroutinefunction
-from typing import Any, Awaitable, Callable, Tuple
+from typing import Any, Awaitable, Callable, Iterable, SupportsIndex, Tuple
 from uuid import uuid4
 
 from orjson import dumps as orjson_dumps
@@ -44,6 +44,95 @@ class UserChatProfile:
     frequency_penalty: float = 1.1
 
 
+class MessageHistoryList(list[MessageHistory]):
+    """A list of message histories, keeping prefix sums of their tokens.
+    Appending and popping from the end are O(1), and so are
+    the total tokens and the tokens of the last N messages.
+    Other mutations rebuild the prefix sums.
+    If tokens of a message are changed in place, call `recalculate_tokens`."""
+
+    def __init__(self, iterable: Iterable[MessageHistory] = ()) -> None:
+        super().__init__(iterable)
+        self.recalculate_tokens()
+
+    def __reduce__(self) -> tuple:
+        return (self.__class__, (list(self),))
+
+    def recalculate_tokens(self) -> None:
+        cumulative_tokens: list[int] = [0]
+        for message_history in self:
+            cumulative_tokens.append(
+                cumulative_tokens[-1] + message_history.tokens
+            )
+        self._cumulative_tokens = cumulative_tokens
+
+    @property
+    def tokens(self) -> int:
+        return self._cumulative_tokens[-1]
+
+    def tokens_of_last(self, n: int) -> int:
+        """Returns the total tokens of the last `n` messages."""
+        if n <= 0:
+            return 0
+        return (
+            self._cumulative_tokens[-1]
+            - self._cumulative_tokens[max(len(self) - n, 0)]
+        )
+
+    def append(self, message_history: MessageHistory) -> None:
+        super().append(message_history)
+        self._cumulative_tokens.append(
+            self._cumulative_tokens[-1] + message_history.tokens
+        )
+
+    def pop(self, index: SupportsIndex = -1) -> MessageHistory:
+        message_history: MessageHistory = super().pop(index)
+        if index in (-1, len(self)):
+            self._cumulative_tokens.pop()
+        else:
+            self.recalculate_tokens()
+        return message_history
+
+    def extend(self, iterable: Iterable[MessageHistory]) -> None:
+        for message_history in iterable:
+            self.append(message_history)
+
+    def __iadd__(self, iterable: Iterable[MessageHistory]) -> "MessageHistoryList":  # type: ignore
+        self.extend(iterable)
+        return self
+
+    def clear(self) -> None:
+        super().clear()
+        self._cumulative_tokens = [0]
+
+    def _rebuild_after(method_name: str) -> Callable:  # type: ignore
+        def method(self: "MessageHistoryList", *args: Any, **kwargs: Any) -> Any:
+            result = getattr(super(MessageHistoryList, self), method_name)(
+                *args, **kwargs
+            )
+            self.recalculate_tokens()
+            return result
+
+        method.__name__ = method_name
+        return method
+
+    insert = _rebuild_after("insert")
+    remove = _rebuild_after("remove")
+    sort = _rebuild_after("sort")
+    reverse = _rebuild_after("reverse")
+    __setitem__ = _rebuild_after("__setitem__")
+    __delitem__ = _rebuild_after("__delitem__")
+    __imul__ = _rebuild_after("__imul__")
+    del _rebuild_after
+
+
+_MESSAGE_HISTORY_FIELDS: tuple[str, ...] = (
+    "user_message_histories",
+    "ai_message_histories",
+    "system_message_histories",
+)
+
+
 @dataclass
 class UserChatContext:
     user_chat_profile: UserChatProfile
@@ -54,17 +143,26 @@ class UserChatContext:
         default_factory=list
     )
 
+    def __setattr__(self, name: str, value: Any) -> None:
+        # Message histories are always kept as `MessageHistoryList`,
+        # so that their tokens are accounted incrementally.
+        if name in _MESSAGE_HISTORY_FIELDS and not isinstance(
+            value, MessageHistoryList
+        ):
+            value = MessageHistoryList(value)
+        super().__setattr__(name, value)
+
     @property
     def user_message_tokens(self) -> int:
-        return sum([m.tokens for m in self.user_message_histories])
+        return self.user_message_histories.tokens  # type: ignore
 
     @property
     def ai_message_tokens(self) -> int:
-        return sum([m.tokens for m in self.ai_message_histories])
+        return self.ai_message_histories.tokens  # type: ignore
 
     @property
     def system_message_tokens(self) -> int:
-        return sum([m.tokens for m in self.system_message_histories])
+        return self.system_message_histories.tokens  # type: ignore
 
     @classmethod
     def parse_stringified_json(cls, stred_json: str) -> "UserChatContext":
@@ -105,12 +203,15 @@ class UserChatContext:
 
     def tokenize(self, message: str) -> list[int]:
         try:
-            return self.llm_model.value.tokenizer.encode(message)
+            return self.llm_model.value.tokenizer.encode_with_cache(message)
         except Exception:
             return []
 
     def get_tokens_of(self, message: str) -> int:
-        return len(self.tokenize(message))
+        try:
+            return self.llm_model.value.tokenizer.tokens_of(message)
+        except Exception:
+            return 0
 
     @property
     def left_tokens(self) -> int:
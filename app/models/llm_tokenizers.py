@@ -1,9 +1,13 @@
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from hashlib import blake2b
 from pathlib import Path
+from threading import Lock
 from typing import TYPE_CHECKING, Any, Optional, Union
 
 from tiktoken import Encoding, encoding_for_model, get_encoding
 
+from app.common.config import ChatConfig
 from app.utils.chat.text_generations.path import resolve_model_path_to_posix
 from app.utils.logger import ApiLogger
 
@@ -13,8 +17,62 @@ if TYPE_CHECKING:
     from repositories.exllama.tokenizer import ExLlamaTokenizer
 
 
+class TokenizationCache:
+    """A bounded LRU cache of encoded tokens, shared by all tokenizers.
+    Keys are the model name of the tokenizer and the hash of the content,
+    so that the same text is encoded only once per tokenizer model."""
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self.hits: int = 0
+        self.misses: int = 0
+        self._data: OrderedDict[tuple[str, bytes], tuple[int, ...]] = OrderedDict()
+        self._lock: Lock = Lock()
+
+    @staticmethod
+    def make_key(model_name: str, message: str) -> tuple[str, bytes]:
+        return (
+            model_name,
+            blake2b(message.encode("utf-8"), digest_size=16).digest(),
+        )
+
+    def get(self, key: tuple[str, bytes]) -> Optional[tuple[int, ...]]:
+        with self._lock:
+            tokens = self._data.get(key)
+            if tokens is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return tokens
+
+    def put(self, key: tuple[str, bytes], tokens: tuple[int, ...]) -> None:
+        with self._lock:
+            self._data[key] = tokens
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def hit_rate(self) -> float:
+        total: int = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
 class BaseTokenizer(ABC):
     _fallback_tokenizer: Optional[Encoding] = None
+    cache: TokenizationCache = TokenizationCache(
+        maxsize=ChatConfig.tokenization_cache_size
+    )
 
     @classmethod
     @property
@@ -42,8 +100,17 @@ class BaseTokenizer(ABC):
     def decode(self, tokens: list[int]) -> str:
         ...
 
+    def encode_with_cache(self, message: str) -> list[int]:
+        """Encode the message, reusing the result of the same message if cached."""
+        key = self.cache.make_key(self.model_name, message)
+        tokens = self.cache.get(key)
+        if tokens is None:
+            tokens = tuple(self.encode(message))
+            self.cache.put(key, tokens)
+        return list(tokens)
+
     def tokens_of(self, message: str) -> int:
-        return len(self.encode(message))
+        return len(self.encode_with_cache(message))
 
     def split_text_on_tokens(
         self, text: str, tokens_per_chunk: int, chunk_overlap: int
@@ -63,7 +130,7 @@ class BaseTokenizer(ABC):
 
     def get_chunk_of(self, text: str, tokens: int) -> str:
         """Split incoming text and return chunks."""
-        input_ids = self.encode(text)
+        input_ids = self.encode_with_cache(text)
         return self.decode(input_ids[: min(tokens, len(input_ids))])
 
 
@@ -178,7 +178,9 @@ class LlamaCppModel(LLMModel):
     lora_path: Optional[
         str
     ] = None  # The path to the Llama LoRA. If None, no LoRa is loaded.
-    cache_type: Optional[Literal["disk", "ram"]] = "ram"
+    cache_type: Optional[
+        Literal["disk", "ram", "session"]
+    ] = "session"  # "session" keeps one state per user and chat room.
     cache_size: Optional[int] = (
         2 << 30
     )  # The size of the cache in bytes. Only used if cache is True.
@@ -2,17 +2,31 @@
 Use same format as OpenAI API"""
 
 
-from collections import deque
+from collections import Counter
+from contextlib import AsyncExitStack, asynccontextmanager
+from dataclasses import asdict
 from functools import partial
-from typing import TYPE_CHECKING, AsyncGenerator, Iterator, Optional, Union
+from pathlib import Path
+from time import monotonic
+from typing import (
+    TYPE_CHECKING,
+    AsyncIterator,
+    Callable,
+    Iterator,
+    Literal,
+    Optional,
+    TypeVar,
+    Union,
+)
 
 import anyio
 from anyio.streams.memory import MemoryObjectSendStream
-from fastapi import APIRouter, Depends, Request
+from fastapi import APIRouter, Request
 from orjson import dumps
 from pydantic import create_model_from_typeddict
 from sse_starlette.sse import EventSourceResponse
-from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 
 from app.models.base_models import (
     CreateChatCompletionRequest,
@@ -27,12 +41,20 @@ from app.models.completion_models import (
     Embedding,
     ModelList,
 )
+from app.common.config import config
+from app.utils.chat.text_generations.path import resolve_model_path_to_posix
+from app.utils.chat.text_generations.pool import (
+    GeneratorPool,
+    GeneratorPoolFullError,
+)
+from app.utils.chat.text_generations.scheduler import RequestScheduler
+from app.utils.concurrency import SyncToAsyncIterator
 from app.utils.errors import RouteErrorHandler
 from app.utils.logger import ApiLogger
 from app.utils.module_reloader import ModuleReloader
-from app.utils.system import free_memory_of_first_item_from_container
 
 logger = ApiLogger("||v1||")
+T = TypeVar("T")
 
 
 # Importing llama.cpp
@@ -103,9 +125,29 @@ OPENAI_REPLACEMENT_MODELS: dict[str, str] = {
     "gpt-4": "pygmalion_13b",
 }
 router = APIRouter(route_class=RouteErrorHandler)
-semaphore = anyio.create_semaphore(1)
-completion_generators: deque["BaseCompletionGenerator"] = deque(maxlen=1)
-embedding_generators: deque["BaseEmbeddingGenerator"] = deque(maxlen=1)
+scheduler = RequestScheduler(
+    concurrency={
+        "completion": config.llama_server_completion_concurrency,
+        "embedding": config.llama_server_embedding_concurrency,
+    },
+    max_queue_size=config.llama_server_max_queue_size,
+)
+# Generators in use are not evicted, counted by the key of the generator
+generators_in_use: Counter[str] = Counter()
+generator_pool: GeneratorPool[
+    Union["BaseCompletionGenerator", "BaseEmbeddingGenerator"]
+] = GeneratorPool(
+    memory_budget_mb=config.llama_server_memory_budget_mb,
+    max_items=config.llama_server_max_resident_models,
+    policy=config.llama_server_eviction_policy,  # type: ignore
+    pinned=[
+        f"{kind}:{model_name}"
+        for model_name in config.llama_server_pinned_models
+        for kind in ("completion", "embedding")
+    ],
+    can_evict=lambda key: not generators_in_use[key],
+    logger=logger,
+)
 
 
 class DynamicLLMS:
@@ -145,20 +187,84 @@ class DynamicLLMS:
         return isinstance(llm_model, llms.ExllamaModel)
 
 
-async def get_semaphore() -> AsyncGenerator[anyio.Semaphore, None]:
-    """Get a semaphore for the endpoint. This is to prevent multiple requests from
-    creating multiple completion generators at the same time."""
-    async with semaphore:
-        yield semaphore
+def get_generator_key(
+    kind: Literal["completion", "embedding"], model: str
+) -> str:
+    """The key of the generator in the pool, e.g. `completion:llama_7b`."""
+    return f"{kind}:{OPENAI_REPLACEMENT_MODELS.get(model, model)}"
+
+
+def get_lane_name(kind: Literal["completion", "embedding"], model: str) -> str:
+    """Each model has its own lane, e.g. `completion:llama_7b`.
+    Without a memory budget, the models of a kind share one lane, e.g. `completion`,
+    so that they are not loaded at once."""
+    if config.llama_server_memory_budget_mb is None:
+        return kind
+    return get_generator_key(kind, model)
+
+
+def estimate_memory_mb(llm_model: "LLMModel") -> float:
+    """Estimate the memory usage of a model not loaded before, by the size of its files."""
+    try:
+        path = Path(
+            resolve_model_path_to_posix(
+                llm_model.model_path,  # type: ignore
+                default_relative_directory="llama_models/ggml"
+                if DynamicLLMS.check_is_llama_cpp_model(llm_model)
+                else "llama_models/gptq",
+            )
+        )
+        files = [path] if path.is_file() else list(path.glob("*"))
+        return sum(f.stat().st_size for f in files if f.is_file()) / 2**20
+    except Exception:
+        return 0.0
+
+
+async def get_or_load_generator(
+    key: str, loader: Callable[[], T], estimated_memory_mb: float = 0.0
+) -> T:
+    """Get the generator from the pool, or load it.
+    If the generators to evict are in use, wait for them to finish,
+    and raise `GeneratorPoolFullError` after `llama_server_load_timeout` seconds."""
+    deadline: float = monotonic() + config.llama_server_load_timeout
+    while True:
+        try:
+            return generator_pool.get_or_load(
+                key, loader=loader, estimated_memory_mb=estimated_memory_mb
+            )
+        except GeneratorPoolFullError:
+            if monotonic() >= deadline:
+                raise
+            await anyio.sleep(0.1)
+
+
+@asynccontextmanager
+async def acquire_generator(
+    kind: Literal["completion", "embedding"], model: str
+) -> AsyncIterator[float]:
+    """Wait for a slot of the lane of the model, and yield the seconds waited.
+    The generator of the model is marked as in use until released, so that it is not evicted."""
+    lane_name: str = get_lane_name(kind, model)
+    key: str = get_generator_key(kind, model)
+    async with scheduler.acquire(lane_name) as wait_time:
+        if wait_time > 0.1:
+            logger.info(f"🦙 Waited {wait_time:.2f}s in the queue of {lane_name}")
+        generators_in_use[key] += 1
+        try:
+            yield wait_time
+        finally:
+            generators_in_use[key] -= 1
+            if generators_in_use[key] <= 0:
+                del generators_in_use[key]
 
 
-def get_completion_generator(
+async def get_completion_generator(
     body: CreateCompletionRequest
     | CreateChatCompletionRequest
     | CreateEmbeddingRequest,
 ) -> "BaseCompletionGenerator":
-    """Get a completion generator for the given model. If the model is not cached, create a new one.
-    If the cache is full, delete the oldest completion generator."""
+    """Get a completion generator for the given model. If the model is not resident, load it.
+    If the pool is over budget, evict other generators which are not in use."""
     try:
         # Check if the model is an OpenAI model
         if body.model in OPENAI_REPLACEMENT_MODELS:
@@ -170,98 +276,68 @@ def get_completion_generator(
         DynamicLLMS.reload()
         llm_model = DynamicLLMS.llm_models.get_value(body.model)
 
-        # Check if the model is cached. If so, return the cached completion generator
-        for completion_generator in completion_generators:
-            if completion_generator.llm_model.name == llm_model.name:
-                return completion_generator
-
-        # Before creating a new completion generator, deallocate embeddings to free up memory
-        if embedding_generators:
-            free_memory_of_first_item_from_container(
-                embedding_generators,
-                min_free_memory_mb=512,
-                logger=logger,
-            )
-
-        # Before creating a new completion generator, check memory usage
-        if completion_generators.maxlen == len(completion_generators):
-            free_memory_of_first_item_from_container(
-                completion_generators,
-                min_free_memory_mb=256,
-                logger=logger,
-            )
-
-        # Create a new completion generator
-        if DynamicLLMS.check_is_llama_cpp_model(llm_model):
-            assert not isinstance(
-                LlamaCppCompletionGenerator, str
-            ), LlamaCppCompletionGenerator
-            to_return = LlamaCppCompletionGenerator.from_pretrained(llm_model)
-        elif DynamicLLMS.check_is_exllama_model(llm_model):
-            assert not isinstance(
-                ExllamaCompletionGenerator, str
-            ), ExllamaCompletionGenerator
-            to_return = ExllamaCompletionGenerator.from_pretrained(llm_model)
-        else:
+        def load() -> "BaseCompletionGenerator":
+            if DynamicLLMS.check_is_llama_cpp_model(llm_model):
+                assert not isinstance(
+                    LlamaCppCompletionGenerator, str
+                ), LlamaCppCompletionGenerator
+                return LlamaCppCompletionGenerator.from_pretrained(llm_model)
+            elif DynamicLLMS.check_is_exllama_model(llm_model):
+                assert not isinstance(
+                    ExllamaCompletionGenerator, str
+                ), ExllamaCompletionGenerator
+                return ExllamaCompletionGenerator.from_pretrained(llm_model)
             raise AssertionError(f"Model {body.model} not implemented")
 
-        # Add the new completion generator to the deque cache
-        completion_generators.append(to_return)
-        return to_return
-    except (AssertionError, OSError, MemoryError) as e:
+        return await get_or_load_generator(
+            get_generator_key("completion", body.model),
+            loader=load,
+            estimated_memory_mb=estimate_memory_mb(llm_model),
+        )
+    except (
+        AssertionError,
+        OSError,
+        MemoryError,
+        GeneratorPoolFullError,
+    ) as e:
         raise e
     except Exception as e:
         logger.exception(f"Exception in get_completion_generator: {e}")
         raise AssertionError(f"Could not find a model: {body.model}")
 
 
-def get_embedding_generator(
+async def get_embedding_generator(
     body: CreateEmbeddingRequest,
 ) -> "BaseEmbeddingGenerator":
-    """Get an embedding generator for the given model. If the model is not cached, create a new one.
-    If the cache is full, delete the oldest completion generator."""
+    """Get an embedding generator for the given model. If the model is not resident, load it.
+    If the pool is over budget, evict other generators which are not in use."""
     try:
         body.model = body.model.lower()
-        for embedding_generator in embedding_generators:
-            if embedding_generator.model_name == body.model:
-                return embedding_generator
-
-        # Before creating a new completion generator, check memory usage
-        if embedding_generators.maxlen == len(embedding_generators):
-            free_memory_of_first_item_from_container(
-                embedding_generators,
-                min_free_memory_mb=256,
-                logger=logger,
-            )
-        # Before creating a new completion generator, deallocate embeddings to free up memory
-        if completion_generators:
-            free_memory_of_first_item_from_container(
-                completion_generators,
-                min_free_memory_mb=512,
-                logger=logger,
-            )
 
-        if "sentence" in body.model and "encoder" in body.model:
-            # Create a new sentence encoder embedding
-            assert not isinstance(
-                SentenceEncoderEmbeddingGenerator, str
-            ), SentenceEncoderEmbeddingGenerator
-            to_return = SentenceEncoderEmbeddingGenerator.from_pretrained(
-                body.model
-            )
-        else:
+        def load() -> "BaseEmbeddingGenerator":
+            if "sentence" in body.model and "encoder" in body.model:
+                # Create a new sentence encoder embedding
+                assert not isinstance(
+                    SentenceEncoderEmbeddingGenerator, str
+                ), SentenceEncoderEmbeddingGenerator
+                return SentenceEncoderEmbeddingGenerator.from_pretrained(
+                    body.model
+                )
             # Create a new transformer embedding
             assert not isinstance(
                 TransformerEmbeddingGenerator, str
             ), LlamaCppCompletionGenerator
-            to_return = TransformerEmbeddingGenerator.from_pretrained(
-                body.model
-            )
+            return TransformerEmbeddingGenerator.from_pretrained(body.model)
 
-        # Add the new completion generator to the deque cache
-        embedding_generators.append(to_return)
-        return to_return
-    except (AssertionError, OSError, MemoryError) as e:
+        return await get_or_load_generator(
+            get_generator_key("embedding", body.model), loader=load
+        )
+    except (
+        AssertionError,
+        OSError,
+        MemoryError,
+        GeneratorPoolFullError,
+    ) as e:
         raise e
     except Exception as e:
         logger.exception(f"Exception in get_embedding_generator: {e}")
@@ -274,9 +350,10 @@ async def get_event_publisher(
     iterator: Iterator,
     is_chat_completion: Optional[bool] = None,
 ):
+    async_iterator = SyncToAsyncIterator(iterator)
     async with inner_send_chan:
         try:
-            async for chunk in iterate_in_threadpool(iterator):
+            async for chunk in async_iterator:
                 if is_chat_completion is True:
                     print(
                         chunk["choices"][0]["delta"].get("content", ""),
@@ -300,6 +377,7 @@ async def get_event_publisher(
                 )
                 raise e
         finally:
+            async_iterator.close()
             logger.info("\n[🦙 I'm done talking]")
 
 
@@ -310,45 +388,51 @@ async def get_event_publisher(
 async def create_chat_completion(
     request: Request,
     body: CreateChatCompletionRequest,
-    semaphore: anyio.Semaphore = Depends(get_semaphore),
 ) -> Union[ChatCompletion, EventSourceResponse]:
     logger.info(f"🦙 Chat Completion Settings: {body}\n\n")
-    completion_generator = get_completion_generator(body)
-    logger.info("\n[🦙 I'm talking now]")
-    if body.stream:
-        _iterator: Iterator[
-            ChatCompletionChunk
-        ] = completion_generator.generate_chat_completion_with_streaming(
-            messages=body.messages,
-            settings=body,
-        )
-        # EAFP: It's easier to ask for forgiveness than permission
-        first_response = await run_in_threadpool(next, _iterator)
-
-        def iterator() -> Iterator[ChatCompletionChunk]:
-            yield first_response
-            yield from _iterator
-
-        send_chan, recv_chan = anyio.create_memory_object_stream(10)
-        return EventSourceResponse(
-            recv_chan,
-            data_sender_callable=partial(
-                get_event_publisher,
-                request=request,
-                inner_send_chan=send_chan,
-                iterator=iterator(),
-                is_chat_completion=True,
-            ),
-        )
-    else:
-        chat_completion: ChatCompletion = await run_in_threadpool(
-            completion_generator.generate_chat_completion,
-            messages=body.messages,
-            settings=body,
+    async with AsyncExitStack() as stack:
+        # Wait for a slot of the lane of the validated model
+        await stack.enter_async_context(
+            acquire_generator("completion", body.model)
         )
-        print(chat_completion["choices"][0]["message"]["content"])
-        logger.info("\n[🦙 I'm done talking!]")
-        return chat_completion
+        completion_generator = await get_completion_generator(body)
+        logger.info("\n[🦙 I'm talking now]")
+        if body.stream:
+            _iterator: Iterator[
+                ChatCompletionChunk
+            ] = completion_generator.generate_chat_completion_with_streaming(
+                messages=body.messages,
+                settings=body,
+            )
+            # EAFP: It's easier to ask for forgiveness than permission
+            first_response = await run_in_threadpool(next, _iterator)
+
+            def iterator() -> Iterator[ChatCompletionChunk]:
+                yield first_response
+                yield from _iterator
+
+            send_chan, recv_chan = anyio.create_memory_object_stream(10)
+            # The slot is held until the streaming is finished
+            return EventSourceResponse(
+                recv_chan,
+                background=BackgroundTask(stack.pop_all().aclose),
+                data_sender_callable=partial(
+                    get_event_publisher,
+                    request=request,
+                    inner_send_chan=send_chan,
+                    iterator=iterator(),
+                    is_chat_completion=True,
+                ),
+            )
+        else:
+            chat_completion: ChatCompletion = await run_in_threadpool(
+                completion_generator.generate_chat_completion,
+                messages=body.messages,
+                settings=body,
+            )
+            print(chat_completion["choices"][0]["message"]["content"])
+            logger.info("\n[🦙 I'm done talking!]")
+            return chat_completion
 
 
 @router.post(
@@ -358,45 +442,51 @@ async def create_chat_completion(
 async def create_completion(
     request: Request,
     body: CreateCompletionRequest,
-    semaphore: anyio.Semaphore = Depends(get_semaphore),
 ) -> Union[Completion, EventSourceResponse]:
     logger.info(f"🦙 Text Completion Settings: {body}\n\n")
-    completion_generator = get_completion_generator(body)
-    logger.info("\n[🦙 I'm talking now]")
-    if body.stream:
-        _iterator: Iterator[
-            CompletionChunk
-        ] = completion_generator.generate_completion_with_streaming(
-            prompt=body.prompt,
-            settings=body,
-        )
-        # EAFP: It's easier to ask for forgiveness than permission
-        first_response = await run_in_threadpool(next, _iterator)
-
-        def iterator() -> Iterator[CompletionChunk]:
-            yield first_response
-            yield from _iterator
-
-        send_chan, recv_chan = anyio.create_memory_object_stream(10)
-        return EventSourceResponse(
-            recv_chan,
-            data_sender_callable=partial(
-                get_event_publisher,
-                request=request,
-                inner_send_chan=send_chan,
-                iterator=iterator(),
-                is_chat_completion=False,
-            ),
-        )
-    else:
-        completion: Completion = await run_in_threadpool(
-            completion_generator.generate_completion,
-            prompt=body.prompt,
-            settings=body,
+    async with AsyncExitStack() as stack:
+        # Wait for a slot of the lane of the validated model
+        await stack.enter_async_context(
+            acquire_generator("completion", body.model)
         )
-        print(completion["choices"][0]["text"])
-        logger.info("\n[🦙 I'm done talking!]")
-        return completion
+        completion_generator = await get_completion_generator(body)
+        logger.info("\n[🦙 I'm talking now]")
+        if body.stream:
+            _iterator: Iterator[
+                CompletionChunk
+            ] = completion_generator.generate_completion_with_streaming(
+                prompt=body.prompt,
+                settings=body,
+            )
+            # EAFP: It's easier to ask for forgiveness than permission
+            first_response = await run_in_threadpool(next, _iterator)
+
+            def iterator() -> Iterator[CompletionChunk]:
+                yield first_response
+                yield from _iterator
+
+            send_chan, recv_chan = anyio.create_memory_object_stream(10)
+            # The slot is held until the streaming is finished
+            return EventSourceResponse(
+                recv_chan,
+                background=BackgroundTask(stack.pop_all().aclose),
+                data_sender_callable=partial(
+                    get_event_publisher,
+                    request=request,
+                    inner_send_chan=send_chan,
+                    iterator=iterator(),
+                    is_chat_completion=False,
+                ),
+            )
+        else:
+            completion: Completion = await run_in_threadpool(
+                completion_generator.generate_completion,
+                prompt=body.prompt,
+                settings=body,
+            )
+            print(completion["choices"][0]["text"])
+            logger.info("\n[🦙 I'm done talking!]")
+            return completion
 
 
 @router.post(
@@ -405,7 +495,6 @@ async def create_completion(
 )
 async def create_embedding(
     body: CreateEmbeddingRequest,
-    semaphore: anyio.Semaphore = Depends(get_semaphore),
 ) -> Embedding:
     assert body.model is not None, "Model is required"
     try:
@@ -421,15 +510,18 @@ async def create_embedding(
         #     "hkunlp/instructor-large",
         #     "intfloat/e5-base-v2",
         #     "intfloat/e5-large",
-        embedding_generator: "BaseEmbeddingGenerator" = (
-            get_embedding_generator(body)
-        )
-        embeddings: list[list[float]] = await run_in_threadpool(
-            embedding_generator.generate_embeddings,
-            texts=body.input if isinstance(body.input, list) else [body.input],
-            context_length=512,
-            batch=1000,
-        )
+        async with acquire_generator("embedding", body.model.lower()):
+            embedding_generator: "BaseEmbeddingGenerator" = (
+                await get_embedding_generator(body)
+            )
+            embeddings: list[list[float]] = await run_in_threadpool(
+                embedding_generator.generate_embeddings,
+                texts=body.input
+                if isinstance(body.input, list)
+                else [body.input],
+                context_length=512,
+                batch=1000,
+            )
 
         return {
             "object": "list",
@@ -456,16 +548,30 @@ async def create_embedding(
         assert not isinstance(
             LlamaCppCompletionGenerator, str
         ), LlamaCppCompletionGenerator
-        completion_generator = get_completion_generator(body)
-        assert isinstance(
-            completion_generator, LlamaCppCompletionGenerator
-        ), f"Model {body.model} is not supported for llama.cpp embeddings."
-
-        assert completion_generator.client, "Model is not loaded yet"
-        return await run_in_threadpool(
-            completion_generator.client.create_embedding,
-            **body.dict(exclude={"user"}),
-        )
+        async with acquire_generator("completion", body.model):
+            completion_generator = await get_completion_generator(body)
+            assert isinstance(
+                completion_generator, LlamaCppCompletionGenerator
+            ), f"Model {body.model} is not supported for llama.cpp embeddings."
+
+            assert completion_generator.client, "Model is not loaded yet"
+            return await run_in_threadpool(
+                completion_generator.client.create_embedding,
+                **body.dict(exclude={"user"}),
+            )
+
+
+@router.get("/v1/metrics")
+async def get_metrics() -> dict[str, dict]:
+    """Get the queue depth and wait time of each lane of the scheduler,
+    and the resident generators of the pool."""
+    return scheduler.metrics | {
+        "pool": {
+            "resident": generator_pool.keys(),
+            "used_memory_mb": generator_pool.used_memory_mb,
+        }
+        | asdict(generator_pool.stats)
+    }
 
 
 @router.get("/v1/models", response_model=create_model_from_typeddict(ModelList))  # type: ignore
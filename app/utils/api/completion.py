@@ -1,7 +1,6 @@
 import logging
 from datetime import timedelta
 from json import dumps
-from re import Pattern, compile
 from socket import gaierror
 from typing import (
     Any,
@@ -16,7 +15,7 @@ from typing import (
     Union,
 )
 
-from aiohttp import ClientResponse, ClientSession, client_exceptions
+from aiohttp import ClientResponse, client_exceptions
 from openai import error
 from orjson import dumps as orjson_dumps
 from orjson import loads as orjson_loads
@@ -40,6 +39,8 @@ from app.models.completion_models import (
     CompletionChunk,
 )
 from app.models.function_calling.base import FunctionCall
+from app.utils.api.session_pool import session_pool
+from app.utils.api.sse import ServerSentEventParser
 from app.utils.chat.text_generations.converter import (
     make_chat_completion_chunk_from_json,
     make_chat_completion_from_json,
@@ -50,9 +51,6 @@ from app.utils.chat.text_generations.converter import (
 T = TypeVar("T")
 TimeUnitType = Union[int, float, timedelta]
 logger = logging.getLogger(__name__)
-api_regex_pattern: Pattern = compile(
-    r"data:\s*({.+?})\s*\r?\n\s*\r?\n"
-)  # regex pattern to extract json from streaming api response
 
 
 def _create_retry_decorator(
@@ -113,18 +111,13 @@ async def _extract_json_from_streaming_response(
     streaming_response: ClientResponse,
 ) -> AsyncIterator[dict]:
     """Extract json from streaming `aiohttp.ClientResponse`"""
-    stream_buffer: bytes = b""
-    async for stream, end_of_chunk in streaming_response.content.iter_chunks():  # stream from api
-        stream_buffer += stream
-        if not end_of_chunk:
-            continue
-        for match in api_regex_pattern.finditer(stream_buffer.decode("utf-8")):
-            try:
-                json_data: dict = orjson_loads(match.group(1))
-                yield json_data
-                stream_buffer = b""
-            except Exception:
-                continue
+    parser = ServerSentEventParser()
+    # Read until EOF even after [DONE], so that the connection can be reused
+    async for stream in streaming_response.content.iter_any():  # stream from api
+        for json_data in parser.feed(stream):
+            yield json_data
+    for json_data in parser.close():
+        yield json_data
 
 
 def _get_response_exception(
@@ -439,18 +432,17 @@ async def acreate_completion(
     data = orjson_dumps(
         kwargs | {"stream": stream, "model": model, "prompt": prompt}
     )
-    async with ClientSession(
-        timeout=ChatConfig.timeout
-    ) as session:  # initialize client
-        async with session.post(url, headers=headers, data=data) as response:
-            await _handle_error_response(response)
-            if stream:
-                async for json_data in _extract_json_from_streaming_response(
-                    response
-                ):
-                    yield make_completion_chunk_from_json(json_data)
-            else:
-                yield make_completion_from_json(await response.json())
+    async with session_pool.get(api_base).post(
+        url, headers=headers, data=data
+    ) as response:
+        await _handle_error_response(response)
+        if stream:
+            async for json_data in _extract_json_from_streaming_response(
+                response
+            ):
+                yield make_completion_chunk_from_json(json_data)
+        else:
+            yield make_completion_from_json(await response.json())
 
 
 async def acreate_chat_completion(
@@ -473,13 +465,14 @@ async def acreate_chat_completion(
             functions=functions, function_call=function_call
         )
     )
-    async with ClientSession(timeout=ChatConfig.timeout) as session:
-        async with session.post(url, headers=headers, data=data) as response:
-            await _handle_error_response(response)
-            if stream:
-                async for json_data in _extract_json_from_streaming_response(
-                    response
-                ):
-                    yield make_chat_completion_chunk_from_json(json_data)
-            else:
-                yield make_chat_completion_from_json(await response.json())
+    async with session_pool.get(api_base).post(
+        url, headers=headers, data=data
+    ) as response:
+        await _handle_error_response(response)
+        if stream:
+            async for json_data in _extract_json_from_streaming_response(
+                response
+            ):
+                yield make_chat_completion_chunk_from_json(json_data)
+        else:
+            yield make_chat_completion_from_json(await response.json())
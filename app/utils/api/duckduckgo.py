@@ -1,15 +1,27 @@
+import asyncio
 import logging
 import re
-from collections import deque
+from collections import OrderedDict, deque
 from dataclasses import dataclass
 from datetime import datetime
 from decimal import Decimal
 from html import unescape
 from itertools import cycle
 from random import choice
-from time import sleep
-from typing import Deque, Dict, Iterator, Optional, Set, Tuple
+from time import monotonic, sleep
+from typing import (
+    Any,
+    AsyncIterator,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
 from urllib.parse import unquote
+from weakref import WeakKeyDictionary
 
 import httpx
 from lxml import html
@@ -55,6 +67,198 @@ class MapsResult:
     hours: Optional[Dict[str, str]] = None
 
 
+def _normalize(raw_html: Optional[str] = None) -> str:
+    """strip HTML tags"""
+    if raw_html:
+        return unescape(re.sub(REGEX_STRIP_TAGS, "", raw_html))
+    return ""
+
+
+def _normalize_url(url: Optional[str] = None) -> str:
+    """unquote url and replace spaces with '+'"""
+    if url:
+        return unquote(url).replace(" ", "+")
+    return ""
+
+
+def _is_500_in_url(url: str) -> bool:
+    """something like '506-00.js' inside the url"""
+    return bool(REGEX_500_IN_URL.search(url))
+
+
+def _is_google_fallback(href: str, keywords: str) -> bool:
+    return href == f"http://www.google.com/search?q={keywords}"
+
+
+def _extract_vqd(content: bytes, keywords: str) -> Optional[str]:
+    """Extract vqd value from the page of https://duckduckgo.com"""
+    for c1, c2 in (
+        (b'vqd="', b'"'),
+        (b"vqd=", b"&"),
+        (b"vqd='", b"'"),
+    ):
+        try:
+            start = content.index(c1) + len(c1)
+            end = content.index(c2, start)
+            return content[start:end].decode()
+        except ValueError:
+            logger.warning(f"_get_vqd() keywords={keywords} vqd not found")
+    return None
+
+
+def _text_api_payload(
+    keywords: str,
+    region: str,
+    safesearch: str,
+    timelimit: Optional[str],
+    vqd: str,
+) -> Dict[str, Any]:
+    payload: Dict[str, Any] = {
+        "q": keywords,  #
+        "kl": region,
+        "l": region,
+        "s": 0,
+        "df": timelimit,
+        "vqd": vqd,
+        "o": "json",
+    }
+    if safesearch == "off":
+        # payload["p"] = '-2'
+        payload["ex"] = "-2"
+    elif safesearch == "moderate":
+        payload["p"] = ""
+        payload["sp"] = "0"
+        payload["ex"] = "-1"
+    elif safesearch == "on":  # strict
+        payload["sp"] = "0"
+        payload["p"] = "1"
+    return payload
+
+
+def _parse_text_api_page(
+    resp: httpx.Response, keywords: str, cache: Set[str]
+) -> List[Dict[str, Optional[str]]]:
+    """Parse a page of https://links.duckduckgo.com/d.js.
+    An empty list means there are no more results."""
+    try:
+        page_data = resp.json().get("results", None)
+    except Exception:
+        return []
+    if page_data is None:
+        return []
+
+    results: List[Dict[str, Optional[str]]] = []
+    for row in page_data:
+        href = row.get("u", None)
+        if href and href not in cache and not _is_google_fallback(href, keywords):
+            cache.add(href)
+            body = _normalize(row["a"])
+            if body:
+                results.append(
+                    {
+                        "title": _normalize(row["t"]),
+                        "href": _normalize_url(href),
+                        "body": body,
+                    }
+                )
+    return results
+
+
+def _text_html_payload(
+    keywords: str,
+    region: str,
+    safesearch: str,
+    timelimit: Optional[str],
+) -> Dict[str, Any]:
+    safesearch_base = {"on": 1, "moderate": -1, "off": -2}
+    return {
+        "q": keywords,
+        "kl": region,
+        "p": safesearch_base[safesearch.lower()],
+        "df": timelimit,
+    }
+
+
+def _parse_text_html_page(
+    content: bytes, keywords: str, cache: Set[str]
+) -> Tuple[List[Dict[str, Optional[str]]], Optional[Dict[str, Any]]]:
+    """Parse a page of https://html.duckduckgo.com/html.
+    Returns the results, and the payload of the next page if there is one."""
+    tree = html.fromstring(content)
+    if tree.xpath('//div[@class="no-results"]/text()'):
+        return [], None
+
+    results: List[Dict[str, Optional[str]]] = []
+    for e in tree.xpath('//div[contains(@class, "results_links")]'):
+        href = e.xpath('.//a[contains(@class, "result__a")]/@href')
+        href = href[0] if href else None
+        if href and href not in cache and not _is_google_fallback(href, keywords):
+            cache.add(href)
+            title = e.xpath('.//a[contains(@class, "result__a")]/text()')
+            body = e.xpath('.//a[contains(@class, "result__snippet")]//text()')
+            results.append(
+                {
+                    "title": _normalize(title[0]) if title else None,
+                    "href": _normalize_url(href),
+                    "body": _normalize("".join(body)) if body else None,
+                }
+            )
+
+    next_page = tree.xpath('.//div[@class="nav-link"]')
+    next_page = next_page[-1] if next_page else None
+    if next_page is None or not results:
+        return results, None
+
+    names = next_page.xpath('.//input[@type="hidden"]/@name')
+    values = next_page.xpath('.//input[@type="hidden"]/@value')
+    return results, {n: v for n, v in zip(names, values)}
+
+
+def _text_lite_payload(
+    keywords: str, region: str, timelimit: Optional[str]
+) -> Dict[str, Any]:
+    return {
+        "q": keywords,
+        "kl": region,
+        "df": timelimit,
+    }
+
+
+def _parse_text_lite_page(
+    content: bytes, keywords: str, cache: Set[str]
+) -> List[Dict[str, Optional[str]]]:
+    """Parse a page of https://lite.duckduckgo.com/lite/.
+    An empty list means there are no more results."""
+    if b"No more results." in content:
+        return []
+
+    tree = html.fromstring(content)
+    results: List[Dict[str, Optional[str]]] = []
+    data = zip(cycle(range(1, 5)), tree.xpath("//table[last()]//tr"))
+    title, href, body = None, None, None
+    for i, e in data:
+        if i == 1:
+            href = e.xpath(".//a//@href")
+            href = href[0] if href else None
+            if href is None or href in cache or _is_google_fallback(href, keywords):
+                [next(data, None) for _ in range(3)]  # skip block(i=1,2,3,4)
+            else:
+                cache.add(href)
+                title = e.xpath(".//a//text()")[0]
+        elif i == 2:
+            body = e.xpath(".//td[@class='result-snippet']//text()")
+            body = "".join(body).strip()
+        elif i == 3:
+            results.append(
+                {
+                    "title": _normalize(title),
+                    "href": _normalize_url(href),
+                    "body": _normalize(body),
+                }
+            )
+    return results
+
+
 class DDGS:
     """DuckDuckgo_search class to get search results from duckduckgo.com"""
 
@@ -106,34 +310,20 @@ class DDGS:
         """Get vqd value for a search query."""
         resp = self._get_url("POST", "https://duckduckgo.com", data={"q": keywords})
         if resp:
-            for c1, c2 in (
-                (b'vqd="', b'"'),
-                (b"vqd=", b"&"),
-                (b"vqd='", b"'"),
-            ):
-                try:
-                    start = resp.content.index(c1) + len(c1)
-                    end = resp.content.index(c2, start)
-                    return resp.content[start:end].decode()
-                except ValueError:
-                    logger.warning(f"_get_vqd() keywords={keywords} vqd not found")
+            return _extract_vqd(resp.content, keywords)
         return None
 
     def _is_500_in_url(self, url: str) -> bool:
         """something like '506-00.js' inside the url"""
-        return bool(REGEX_500_IN_URL.search(url))
+        return _is_500_in_url(url)
 
     def _normalize(self, raw_html: Optional[str] = None) -> str:
         """strip HTML tags"""
-        if raw_html:
-            return unescape(re.sub(REGEX_STRIP_TAGS, "", raw_html))
-        return ""
+        return _normalize(raw_html)
 
     def _normalize_url(self, url: Optional[str] = None) -> str:
         """unquote url and replace spaces with '+'"""
-        if url:
-            return unquote(url).replace(" ", "+")
-        return ""
+        return _normalize_url(url)
 
     def text(
         self,
@@ -189,27 +379,8 @@ class DDGS:
         vqd = self._get_vqd(keywords)
         assert vqd, "error in getting vqd"
 
-        payload = {
-            "q": keywords,  #
-            "kl": region,
-            "l": region,
-            "s": 0,
-            "df": timelimit,
-            "vqd": vqd,
-            "o": "json",
-        }
-        if safesearch == "off":
-            # payload["p"] = '-2'
-            payload["ex"] = "-2"
-        elif safesearch == "moderate":
-            payload["p"] = ""
-            payload["sp"] = "0"
-            payload["ex"] = "-1"
-        elif safesearch == "on":  # strict
-            payload["sp"] = "0"
-            payload["p"] = "1"
-
-        cache = set()
+        payload = _text_api_payload(keywords, region, safesearch, timelimit, vqd)
+        cache: Set[str] = set()
         for s in ("0", "20", "70", "120"):
             payload["s"] = s
             resp = self._get_url(
@@ -217,32 +388,10 @@ class DDGS:
             )
             if resp is None:
                 break
-            try:
-                page_data = resp.json().get("results", None)
-            except Exception:
-                break
-            if page_data is None:
-                break
-
-            result_exists = False
-            for row in page_data:
-                href = row.get("u", None)
-                if (
-                    href
-                    and href not in cache
-                    and href != f"http://www.google.com/search?q={keywords}"
-                ):
-                    cache.add(href)
-                    body = self._normalize(row["a"])
-                    if body:
-                        result_exists = True
-                        yield {
-                            "title": self._normalize(row["t"]),
-                            "href": self._normalize_url(href),
-                            "body": body,
-                        }
-            if result_exists is False:
+            results = _parse_text_api_page(resp, keywords, cache)
+            if not results:
                 break
+            yield from results
 
     def _text_html(
         self,
@@ -265,13 +414,9 @@ class DDGS:
         """
         assert keywords, "keywords is mandatory"
 
-        safesearch_base = {"on": 1, "moderate": -1, "off": -2}
-        payload = {
-            "q": keywords,
-            "kl": region,
-            "p": safesearch_base[safesearch.lower()],
-            "df": timelimit,
-        }
+        payload: Optional[Dict[str, Any]] = _text_html_payload(
+            keywords, region, safesearch, timelimit
+        )
         cache: Set[str] = set()
         for _ in range(10):
             resp = self._get_url(
@@ -279,38 +424,10 @@ class DDGS:
             )
             if resp is None:
                 break
-
-            tree = html.fromstring(resp.content)
-            if tree.xpath('//div[@class="no-results"]/text()'):
+            results, payload = _parse_text_html_page(resp.content, keywords, cache)
+            yield from results
+            if payload is None:
                 return
-
-            result_exists = False
-            for e in tree.xpath('//div[contains(@class, "results_links")]'):
-                href = e.xpath('.//a[contains(@class, "result__a")]/@href')
-                href = href[0] if href else None
-                if (
-                    href
-                    and href not in cache
-                    and href != f"http://www.google.com/search?q={keywords}"
-                ):
-                    cache.add(href)
-                    title = e.xpath('.//a[contains(@class, "result__a")]/text()')
-                    body = e.xpath('.//a[contains(@class, "result__snippet")]//text()')
-                    result_exists = True
-                    yield {
-                        "title": self._normalize(title[0]) if title else None,
-                        "href": self._normalize_url(href),
-                        "body": self._normalize("".join(body)) if body else None,
-                    }
-
-            next_page = tree.xpath('.//div[@class="nav-link"]')
-            next_page = next_page[-1] if next_page else None
-            if next_page is None or result_exists is False:
-                return
-
-            names = next_page.xpath('.//input[@type="hidden"]/@name')
-            values = next_page.xpath('.//input[@type="hidden"]/@value')
-            payload = {n: v for n, v in zip(names, values)}
             sleep(0.75)
 
     def _text_lite(
@@ -332,11 +449,7 @@ class DDGS:
         """
         assert keywords, "keywords is mandatory"
 
-        payload = {
-            "q": keywords,
-            "kl": region,
-            "df": timelimit,
-        }
+        payload = _text_lite_payload(keywords, region, timelimit)
         cache: Set[str] = set()
         for s in ("0", "20", "70", "120"):
             payload["s"] = s
@@ -345,40 +458,10 @@ class DDGS:
             )
             if resp is None:
                 break
-
-            if b"No more results." in resp.content:
-                return
-
-            tree = html.fromstring(resp.content)
-
-            result_exists = False
-            data = zip(cycle(range(1, 5)), tree.xpath("//table[last()]//tr"))
-            title, href, body = None, None, None
-            for i, e in data:
-                if i == 1:
-                    href = e.xpath(".//a//@href")
-                    href = href[0] if href else None
-                    if (
-                        href is None
-                        or href in cache
-                        or href == f"http://www.google.com/search?q={keywords}"
-                    ):
-                        [next(data, None) for _ in range(3)]  # skip block(i=1,2,3,4)
-                    else:
-                        cache.add(href)
-                        title = e.xpath(".//a//text()")[0]
-                elif i == 2:
-                    body = e.xpath(".//td[@class='result-snippet']//text()")
-                    body = "".join(body).strip()
-                elif i == 3:
-                    result_exists = True
-                    yield {
-                        "title": self._normalize(title),
-                        "href": self._normalize_url(href),
-                        "body": self._normalize(body),
-                    }
-            if result_exists is False:
+            results = _parse_text_lite_page(resp.content, keywords, cache)
+            if not results:
                 break
+            yield from results
             sleep(0.75)
 
     def images(
@@ -913,3 +996,198 @@ class DDGS:
         except Exception:
             page_data = None
         return page_data
+
+
+class AsyncDDGS:
+    """DuckDuckGo text search on the event loop, without a thread per search.
+    - One `httpx.AsyncClient` is shared, so that connections are pooled and kept alive (HTTP/2).
+    - The vqd of a query is cached for `vqd_ttl` seconds, saving a request when it is searched again.
+    - Failed requests are retried with exponential backoff, awaited with `asyncio.sleep`.
+
+    Usage:
+    >>> async for result in get_async_ddgs().text("python"):
+    ...     print(result["href"])
+    """
+
+    def __init__(
+        self,
+        headers=None,
+        proxies=None,
+        timeout=10,
+        max_connections: int = 10,
+        max_keepalive_connections: int = 5,
+        max_retries: int = 3,
+        backoff: float = 1.0,
+        vqd_cache_size: int = 256,
+        vqd_ttl: float = 600.0,
+    ) -> None:
+        if headers is None:
+            headers = {
+                "User-Agent": choice(USERAGENTS),
+                "Referer": "https://duckduckgo.com/",
+            }
+        self._client = httpx.AsyncClient(
+            headers=headers,
+            proxies=proxies,
+            timeout=timeout,
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+            ),
+        )
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.vqd_cache_size = vqd_cache_size
+        self.vqd_ttl = vqd_ttl
+        self._vqd_cache: OrderedDict[str, Tuple[str, float]] = OrderedDict()
+
+    async def __aenter__(self) -> "AsyncDDGS":
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+    async def _get_url(
+        self, method: str, url: str, **kwargs
+    ) -> Optional[httpx.Response]:
+        for i in range(self.max_retries):
+            try:
+                resp = await self._client.request(
+                    method, url, follow_redirects=True, **kwargs
+                )
+                if _is_500_in_url(str(resp.url)) or resp.status_code == 202:
+                    raise httpx.HTTPError("")
+                resp.raise_for_status()
+                if resp.status_code == 200:
+                    return resp
+            except Exception as ex:
+                logger.warning(f"_get_url() {url} {type(ex).__name__} {ex}")
+                if i >= self.max_retries - 1 or "418" in str(ex):
+                    raise ex
+            await asyncio.sleep(self.backoff * 2**i)
+        return None
+
+    async def _get_vqd(self, keywords: str) -> Optional[str]:
+        """Get vqd value for a search query, from the cache if possible."""
+        cached = self._vqd_cache.get(keywords)
+        if cached is not None:
+            vqd, stored_at = cached
+            if monotonic() - stored_at < self.vqd_ttl:
+                self._vqd_cache.move_to_end(keywords)
+                return vqd
+            del self._vqd_cache[keywords]
+
+        resp = await self._get_url(
+            "POST", "https://duckduckgo.com", data={"q": keywords}
+        )
+        if resp is None:
+            return None
+        vqd = _extract_vqd(resp.content, keywords)
+        if vqd:
+            self._vqd_cache[keywords] = (vqd, monotonic())
+            while len(self._vqd_cache) > self.vqd_cache_size:
+                self._vqd_cache.popitem(last=False)
+        return vqd
+
+    async def text(
+        self,
+        keywords: str,
+        region: str = "wt-wt",
+        safesearch: str = "moderate",
+        timelimit: Optional[str] = None,
+        backend: str = "api",
+    ) -> AsyncIterator[Dict[str, Optional[str]]]:
+        """DuckDuckGo text search generator. Query params: https://duckduckgo.com/params
+        Same as `DDGS.text`, but each page is requested only when the previous one is consumed.
+
+        Args:
+            keywords: keywords for query.
+            region: wt-wt, us-en, uk-en, ru-ru, etc. Defaults to "wt-wt".
+            safesearch: on, moderate, off. Defaults to "moderate".
+            timelimit: d, w, m, y. Defaults to None.
+            backend: api, html, lite. Defaults to api.
+        Yields:
+            dict with search results.
+
+        """
+        assert keywords, "keywords is mandatory"
+
+        cache: Set[str] = set()
+        if backend == "api":
+            vqd = await self._get_vqd(keywords)
+            assert vqd, "error in getting vqd"
+            payload = _text_api_payload(keywords, region, safesearch, timelimit, vqd)
+            for s in ("0", "20", "70", "120"):
+                payload["s"] = s
+                resp = await self._get_url(
+                    "GET", "https://links.duckduckgo.com/d.js", params=payload
+                )
+                if resp is None:
+                    break
+                results = _parse_text_api_page(resp, keywords, cache)
+                if not results:
+                    break
+                for result in results:
+                    yield result
+
+        elif backend == "html":
+            next_payload: Optional[Dict[str, Any]] = _text_html_payload(
+                keywords, region, safesearch, timelimit
+            )
+            for page in range(10):
+                if page:
+                    await asyncio.sleep(0.75)
+                resp = await self._get_url(
+                    "POST", "https://html.duckduckgo.com/html", data=next_payload
+                )
+                if resp is None:
+                    break
+                results, next_payload = _parse_text_html_page(
+                    resp.content, keywords, cache
+                )
+                for result in results:
+                    yield result
+                if next_payload is None:
+                    break
+
+        elif backend == "lite":
+            payload = _text_lite_payload(keywords, region, timelimit)
+            for page, s in enumerate(("0", "20", "70", "120")):
+                if page:
+                    await asyncio.sleep(0.75)
+                payload["s"] = s
+                resp = await self._get_url(
+                    "POST", "https://lite.duckduckgo.com/lite/", data=payload
+                )
+                if resp is None:
+                    break
+                results = _parse_text_lite_page(resp.content, keywords, cache)
+                if not results:
+                    break
+                for result in results:
+                    yield result
+
+
+_async_ddgs: "WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncDDGS]" = (
+    WeakKeyDictionary()
+)
+
+
+def get_async_ddgs() -> AsyncDDGS:
+    """The `AsyncDDGS` shared by every search in the running event loop."""
+    loop = asyncio.get_running_loop()
+    ddgs = _async_ddgs.get(loop)
+    if ddgs is None:
+        ddgs = _async_ddgs[loop] = AsyncDDGS()
+    return ddgs
+
+
+async def close_async_ddgs() -> None:
+    """Close the connections of the `AsyncDDGS` in the running event loop."""
+    ddgs = _async_ddgs.pop(asyncio.get_running_loop(), None)
+    if ddgs is not None:
+        await ddgs.aclose()
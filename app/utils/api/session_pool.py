@@ -0,0 +1,114 @@
+"""App-lifetime aiohttp sessions for completion APIs, one per API base.
+Reusing a session keeps TCP/TLS connections alive between requests and retries."""
+
+from asyncio import (
+    AbstractEventLoop,
+    get_running_loop,
+    run_coroutine_threadsafe,
+)
+from typing import Iterable, Optional
+from urllib.parse import urlsplit
+from warnings import catch_warnings, simplefilter
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+
+from app.common.config import ChatConfig
+from app.utils.logger import ApiLogger
+
+
+class ClientSessionPool:
+    """Keeps one `ClientSession` per origin (scheme, host and port) of API bases.
+    Sessions are opened lazily, or at startup with `open`, and closed at shutdown with `close`.
+    Connection limits of 0 mean unlimited. If limited, a request waits at most
+    `connect_timeout` seconds for a free connection, as streams hold theirs until they end."""
+
+    def __init__(
+        self,
+        limit: int = ChatConfig.api_connection_limit,
+        limit_per_host: int = ChatConfig.api_connection_limit_per_host,
+        dns_cache_ttl: int = ChatConfig.api_dns_cache_ttl,
+        keepalive_timeout: float = ChatConfig.api_keepalive_timeout,
+        connect_timeout: float = ChatConfig.api_connect_timeout,
+    ) -> None:
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.connect_timeout = connect_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self._sessions: dict[str, tuple[ClientSession, AbstractEventLoop]] = {}
+
+    @staticmethod
+    def _get_key(api_base: str) -> str:
+        url = urlsplit(api_base)
+        return f"{url.scheme}://{url.netloc}"
+
+    def _create_session(self) -> ClientSession:
+        return ClientSession(
+            connector=TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_cache_ttl,
+                keepalive_timeout=self.keepalive_timeout,
+            ),
+            # `connect` includes waiting for a free connection of the pool
+            timeout=ClientTimeout(
+                total=ChatConfig.timeout.total,
+                connect=self.connect_timeout,
+                sock_connect=ChatConfig.timeout.sock_connect,
+                sock_read=ChatConfig.timeout.sock_read,
+            ),
+        )
+
+    def get(self, api_base: str) -> ClientSession:
+        """Get the session of the API base. Must be called in a running event loop."""
+        key: str = self._get_key(api_base)
+        loop: AbstractEventLoop = get_running_loop()
+        session_and_loop: Optional[
+            tuple[ClientSession, AbstractEventLoop]
+        ] = self._sessions.get(key)
+        if session_and_loop is not None:
+            session, session_loop = session_and_loop
+            if not session.closed and session_loop is loop:
+                return session
+            self._close_stale(session, session_loop)
+        session = self._create_session()
+        self._sessions[key] = (session, loop)
+        return session
+
+    @staticmethod
+    def _close_stale(session: ClientSession, loop: AbstractEventLoop) -> None:
+        """Close a session of another event loop, which can't be awaited from this one."""
+        if session.closed:
+            return
+        if loop.is_running():
+            run_coroutine_threadsafe(session.close(), loop)
+            return
+        connector = session.connector
+        session.detach()
+        if connector is not None:
+            with catch_warnings():
+                # Closes the transports at once, without awaiting
+                simplefilter("ignore", DeprecationWarning)
+                try:
+                    connector.close()
+                except RuntimeError:
+                    pass  # The transports belong to a closed event loop
+
+    def open(self, api_bases: Iterable[Optional[str]]) -> None:
+        """Open sessions of the API bases in advance."""
+        for api_base in api_bases:
+            if api_base:
+                self.get(api_base)
+        ApiLogger.cinfo(
+            f"Opened completion API sessions: {list(self._sessions.keys())}"
+        )
+
+    async def close(self) -> None:
+        sessions = self._sessions
+        self._sessions = {}
+        for session, _ in sessions.values():
+            if not session.closed:
+                await session.close()
+
+
+session_pool = ClientSessionPool()
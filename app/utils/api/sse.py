@@ -0,0 +1,96 @@
+"""Incremental parser of server-sent events (SSE) for streaming completion APIs."""
+
+from logging import getLogger
+from typing import Any
+
+from orjson import JSONDecodeError
+from orjson import loads as orjson_loads
+
+logger = getLogger(__name__)
+
+DONE: bytes = b"[DONE]"
+
+
+class ServerSentEventParser:
+    """Parses SSE byte chunks into JSON objects, without decoding or re-scanning the whole buffer.
+    - Events are separated by a blank line, and lines may end with `\\n` or `\\r\\n`.
+    - Multiple `data:` lines of an event are joined with `\\n`.
+    - Comment lines starting with `:` and other fields such as `event:` are ignored.
+    - `data: [DONE]` sets `done`, and malformed JSON data is skipped.
+    - A line longer than `max_line_size` bytes is dropped, so the buffer cannot grow without bound.
+    """
+
+    def __init__(self, max_line_size: int = 2**20) -> None:
+        self.max_line_size = max_line_size
+        self.done: bool = False
+        self._buffer = bytearray()
+        self._data_lines: list[bytes] = []
+        self._is_dropping_line: bool = False
+
+    def feed(self, chunk: bytes) -> list[Any]:
+        """Feed a chunk, and return the JSON objects of the completed events.
+        Chunks after `[DONE]` are ignored."""
+        if self.done:
+            return []
+        events: list[Any] = []
+        buffer = self._buffer
+        scan_from: int = len(buffer)
+        buffer += chunk
+        line_start: int = 0
+        while True:
+            line_end: int = buffer.find(b"\n", scan_from)
+            if line_end < 0:
+                break
+            if self._is_dropping_line:
+                self._is_dropping_line = False
+            else:
+                self._process_line(
+                    bytes(buffer[line_start:line_end]).rstrip(b"\r"), events
+                )
+            line_start = scan_from = line_end + 1
+        del buffer[:line_start]
+
+        if len(buffer) > self.max_line_size:
+            logger.warning(
+                f"Dropping a SSE line longer than {self.max_line_size} bytes"
+            )
+            buffer.clear()
+            self._is_dropping_line = True
+        return events
+
+    def close(self) -> list[Any]:
+        """Dispatch the last event, if the stream ended without a blank line."""
+        events: list[Any] = self.feed(b"\n\n")
+        self._buffer.clear()
+        self._data_lines.clear()
+        return events
+
+    def _process_line(self, line: bytes, events: list[Any]) -> None:
+        if not line:
+            self._dispatch(events)
+            return
+        if line.startswith(b":"):
+            return  # comment
+        field, _, value = line.partition(b":")
+        if field != b"data":
+            return
+        self._data_lines.append(value[1:] if value.startswith(b" ") else value)
+
+    def _dispatch(self, events: list[Any]) -> None:
+        if not self._data_lines:
+            return
+        data: bytes = (
+            self._data_lines[0]
+            if len(self._data_lines) == 1
+            else b"\n".join(self._data_lines)
+        )
+        self._data_lines.clear()
+        if self.done:
+            return
+        if data == DONE:
+            self.done = True
+            return
+        try:
+            events.append(orjson_loads(data))
+        except JSONDecodeError:
+            logger.warning(f"Skipping malformed SSE data: {data[:100]!r}")
@@ -9,9 +9,17 @@ from app.utils.chat.buffer import BufferedUserContext
 from app.utils.chat.managers.vectorstore import VectorStoreManager
 from app.utils.chat.messages.handler import MessageHandler
 from app.utils.function_calling.query import aget_query_to_search
+from app.utils.langchain.qdrant_vectorstore import UpsertResult
 from app.viewmodels.status import UserStatus
 
 
+def _format_upsert_result(result: UpsertResult) -> str:
+    return (
+        f"{result.n_new} new, {result.n_updated} updated, "
+        f"{result.n_skipped} skipped chunks"
+    )
+
+
 class VectorstoreCommands:
     @staticmethod
     async def query(
@@ -62,21 +70,24 @@ class VectorstoreCommands:
     async def embed(text_to_embed: str, /, buffer: BufferedUserContext) -> str:
         """Embed the text and save its vectors in the redis vectorstore.\n
         /embed <text_to_embed>"""
-        await VectorStoreManager.create_documents(
+        result = await VectorStoreManager.upsert_documents(
             text=text_to_embed, collection_name=buffer.user_id
         )
-        return Lotties.OK.format("Embedding successful!")
+        return Lotties.OK.format(
+            f"Embedding successful!\n{_format_upsert_result(result)}"
+        )
 
     @staticmethod
     @command_response.send_message_and_stop
     async def share(text_to_embed: str, /) -> str:
         """Embed the text and save its vectors in the redis vectorstore. This index is shared for everyone.\n
         /share <text_to_embed>"""
-        await VectorStoreManager.create_documents(
+        result = await VectorStoreManager.upsert_documents(
             text=text_to_embed, collection_name=config.shared_vectorestore_name
         )
         return Lotties.OK.format(
-            "Embedding successful!\nThis data will be shared for everyone."
+            f"Embedding successful!\n{_format_upsert_result(result)}\n"
+            "This data will be shared for everyone."
         )
 
     @staticmethod
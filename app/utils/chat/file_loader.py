@@ -1,5 +1,5 @@
 import io
-from typing import IO, Any
+from typing import IO, Any, Iterator
 
 from langchain.document_loaders.unstructured import UnstructuredBaseLoader
 from langchain.docstore.document import Document
@@ -30,6 +30,14 @@ def read_bytes_to_text(file: bytes, filename: str) -> str:
     return "\n\n".join([doc.page_content for doc in read_bytes_to_documents(file=file, filename=filename)])
 
 
+def iter_bytes_to_texts(file: bytes, filename: str) -> Iterator[str]:
+    """Partition the file, and yield the text of each element, like titles, paragraphs and tables."""
+    for element in partition(file=io.BytesIO(file), file_filename=filename, strategy="fast"):
+        text = str(element)
+        if text:
+            yield text
+
+
 if __name__ == "__main__":
     with open(r"test.pdf", "rb") as f:
         file = f.read()
@@ -0,0 +1,171 @@
+"""Pipeline to embed a document into the vectorstore, in stages connected by bounded queues:
+partition & split -> embed -> upsert.
+"""
+
+from asyncio import Queue, Task, create_task, gather
+from dataclasses import dataclass
+from time import monotonic
+from typing import Any, Awaitable, Callable, Iterable, Iterator, Optional
+
+from app.common.config import ChatConfig
+from app.utils.concurrency import SyncToAsyncIterator
+
+
+@dataclass
+class IngestionProgress:
+    n_chunks: int = 0  # Chunks split so far
+    n_embedded: int = 0
+    n_upserted: int = 0
+    is_split: bool = False  # Whether `n_chunks` is final
+    first_chunk: Optional[str] = None
+
+    @property
+    def is_done(self) -> bool:
+        return self.is_split and self.n_upserted == self.n_chunks
+
+
+class IngestionPipeline:
+    """Embeds a document into the vectorstore, overlapping the stages.
+    - `texts` are partitioned and split into batches of chunks on one dedicated thread.
+    - `embed_concurrency` workers embed the batches, and `upsert_concurrency` workers upsert them.
+    - At most `queue_size` batches wait between stages, so a large document is not held in memory at once.
+    - `on_progress` is awaited when splitting is finished and when all chunks are upserted,
+    and at most every `progress_interval` seconds in between.
+    - If a stage fails, the others are cancelled and the exception is raised.
+
+    Texts are split in windows of about `window_size` characters,
+    so a chunk doesn't span across windows.
+    """
+
+    def __init__(
+        self,
+        texts: Iterable[str],
+        split_text: Callable[[str], list[str]],
+        embed: Callable[[list[str]], Awaitable[list[list[float]]]],
+        upsert: Callable[[list[str], list[list[float]]], Awaitable[Any]],
+        on_progress: Optional[
+            Callable[[IngestionProgress], Awaitable[None]]
+        ] = None,
+        batch_size: int = ChatConfig.ingestion_batch_size,
+        embed_concurrency: int = ChatConfig.ingestion_embedding_concurrency,
+        upsert_concurrency: int = ChatConfig.ingestion_upsert_concurrency,
+        queue_size: int = ChatConfig.ingestion_queue_size,
+        window_size: int = 65536,
+        progress_interval: float = 1.0,
+    ) -> None:
+        self.texts = texts
+        self.split_text = split_text
+        self.embed = embed
+        self.upsert = upsert
+        self.on_progress = on_progress
+        self.batch_size = batch_size
+        self.embed_concurrency = embed_concurrency
+        self.upsert_concurrency = upsert_concurrency
+        self.queue_size = queue_size
+        self.window_size = window_size
+        self.progress_interval = progress_interval
+        self.progress = IngestionProgress()
+        self._n_running_embedders: int = 0
+        self._last_reported_at: float = monotonic()
+
+    def _iter_windows(self) -> Iterator[str]:
+        window: list[str] = []
+        window_size: int = 0
+        for text in self.texts:
+            window.append(text)
+            window_size += len(text)
+            if window_size >= self.window_size:
+                yield "\n\n".join(window)
+                window, window_size = [], 0
+        if window:
+            yield "\n\n".join(window)
+
+    def _iter_batches(self) -> Iterator[list[str]]:
+        """Runs on the partitioning thread."""
+        batch: list[str] = []
+        for window in self._iter_windows():
+            for chunk in self.split_text(window):
+                batch.append(chunk)
+                if len(batch) >= self.batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    async def _report(self, force: bool = False) -> None:
+        if self.on_progress is None:
+            return
+        now = monotonic()
+        if (
+            force
+            or self.progress.is_done
+            or now - self._last_reported_at >= self.progress_interval
+        ):
+            self._last_reported_at = now
+            await self.on_progress(self.progress)
+
+    async def _split(self, batches: "Queue[Optional[list[str]]]") -> None:
+        async_iterator = SyncToAsyncIterator(
+            self._iter_batches(),
+            max_buffer_size=self.queue_size,
+            thread_name="ingestion",
+        )
+        try:
+            async for batch in async_iterator:
+                if self.progress.first_chunk is None:
+                    self.progress.first_chunk = batch[0]
+                self.progress.n_chunks += len(batch)
+                await batches.put(batch)
+        finally:
+            async_iterator.close()
+        self.progress.is_split = True
+        await self._report(force=True)
+        for _ in range(self.embed_concurrency):
+            await batches.put(None)
+
+    async def _embed(
+        self,
+        batches: "Queue[Optional[list[str]]]",
+        embedded: "Queue[Optional[tuple[list[str], list[list[float]]]]]",
+    ) -> None:
+        while (batch := await batches.get()) is not None:
+            embeddings = await self.embed(batch)
+            self.progress.n_embedded += len(batch)
+            await embedded.put((batch, embeddings))
+        self._n_running_embedders -= 1
+        if self._n_running_embedders == 0:
+            for _ in range(self.upsert_concurrency):
+                await embedded.put(None)
+
+    async def _upsert(
+        self,
+        embedded: "Queue[Optional[tuple[list[str], list[list[float]]]]]",
+    ) -> None:
+        while (item := await embedded.get()) is not None:
+            await self.upsert(*item)
+            self.progress.n_upserted += len(item[0])
+            await self._report()
+
+    async def run(self) -> IngestionProgress:
+        batches: Queue[Optional[list[str]]] = Queue(maxsize=self.queue_size)
+        embedded: Queue[Optional[tuple[list[str], list[list[float]]]]] = Queue(
+            maxsize=self.queue_size
+        )
+        self._n_running_embedders = self.embed_concurrency
+        tasks: list[Task[None]] = (
+            [create_task(self._split(batches))]
+            + [
+                create_task(self._embed(batches, embedded))
+                for _ in range(self.embed_concurrency)
+            ]
+            + [
+                create_task(self._upsert(embedded))
+                for _ in range(self.upsert_concurrency)
+            ]
+        )
+        try:
+            await gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        return self.progress
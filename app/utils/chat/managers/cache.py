@@ -1,4 +1,3 @@
-from asyncio import gather
 from dataclasses import asdict, fields
 from uuid import uuid4
 
@@ -14,6 +13,10 @@ from app.models.chat_models import (
     UserChatProfile,
 )
 from app.models.llms import LLMModels
+from app.utils.chat.messages.codec import (
+    decode_message_history,
+    encode_message_history,
+)
 from app.utils.logger import ApiLogger
 
 
@@ -25,12 +28,24 @@ class CacheManager:
     _list_fields: tuple[str] = tuple(
         f"{role.name.lower()}_message_histories" for role in ChatRoles
     )
+    _index_migration_key: str = "chat_rooms:index_migrated"
 
     # Helper methods
     @staticmethod
     def _generate_key(user_id: str, chat_room_id: str, field: str) -> str:
         return f"chat:{user_id}:{chat_room_id}:{field}"
 
+    @staticmethod
+    def _generate_index_key(user_id: str) -> str:
+        return f"chat_rooms:{user_id}"
+
+    @classmethod
+    def _get_all_keys(cls, user_id: str, chat_room_id: str) -> list[str]:
+        return [
+            cls._generate_key(user_id, chat_room_id, field)
+            for field in cls._string_fields + cls._list_fields
+        ]
+
     @classmethod
     def _get_string_fields(
         cls, user_id: str, chat_room_id: str
@@ -49,12 +64,13 @@ class CacheManager:
             for field in cls._list_fields
         }
 
-    @classmethod
-    async def _load_chat_profile(cls, key: bytes) -> UserChatProfile | None:
-        """Loads chat profile from redis."""
+    @staticmethod
+    def _parse_chat_profile(loaded: bytes | None) -> UserChatProfile | None:
+        """Parses chat profile loaded from redis.
+        Returns None if the profile doesn't exist or can't be parsed."""
+        if loaded is None:
+            return None
         try:
-            loaded = await cache.redis.get(key)
-            assert loaded is not None
             kwargs = {
                 k: v
                 for k, v in orjson_loads(loaded).items()
@@ -65,50 +81,182 @@ class CacheManager:
             ApiLogger.cerror("Error reading profile from cache", exc_info=True)
             return None
 
+    @staticmethod
+    def _parse_message_histories(
+        raw_message_histories: list | None,
+    ) -> list[MessageHistory]:
+        """Parses message histories loaded from redis, skipping empty ones."""
+        if raw_message_histories is None:
+            return []
+        message_histories: list[MessageHistory] = []
+        for raw_message_history in raw_message_histories:
+            message_history = decode_message_history(raw_message_history)
+            if message_history.content:
+                message_histories.append(message_history)
+        return message_histories
+
+    @classmethod
+    async def _write_context_in_pipeline(
+        cls,
+        user_chat_context: UserChatContext,
+        only_if_exists: bool,
+        only_if_not_exists: bool,
+        count_delete_result: bool,
+    ) -> bool:
+        """Writes the whole context in a single transactional pipeline.
+        Each list field is rewritten with one DELETE and one RPUSH of all items,
+        so saving a context costs one round trip regardless of the number of messages.
+        The result is the same boolean that sequential SET/DELETE/RPUSH calls would produce.
+        """
+        json_data = user_chat_context.json()
+        user_id: str = user_chat_context.user_id
+        chat_room_id: str = user_chat_context.chat_room_id
+        checks: list[bool] = []  # whether each pipeline result counts for success
+
+        async with cache.redis.pipeline(transaction=True) as pipe:
+            for field, key in cls._get_string_fields(
+                user_id, chat_room_id
+            ).items():
+                pipe.set(
+                    key,
+                    orjson_dumps(json_data[field]),
+                    xx=only_if_exists,
+                    nx=only_if_not_exists,
+                )
+                checks.append(True)
+            for field, key in cls._get_list_fields(
+                user_id, chat_room_id
+            ).items():
+                pipe.delete(key)
+                checks.append(count_delete_result)
+                message_histories: list[MessageHistory] = getattr(
+                    user_chat_context, field
+                )
+                if message_histories:
+                    pipe.rpush(
+                        key,
+                        *(
+                            encode_message_history(message_history)
+                            for message_history in message_histories
+                        ),
+                    )
+                    checks.append(True)
+            if not only_if_exists:
+                # Index the room only when it may be created, so that
+                # a late update of a deleted room doesn't list it again
+                pipe.zadd(
+                    cls._generate_index_key(user_id),
+                    {
+                        chat_room_id: user_chat_context.user_chat_profile.created_at
+                    },
+                    nx=True,
+                )
+                checks.append(False)
+            results: list = await pipe.execute()
+
+        return all(
+            bool(result)
+            for result, check in zip(results, checks)
+            if check
+        )
+
     # Public methods
     @classmethod
     async def fetch_chat_profiles(cls, user_id: str) -> list[UserChatProfile]:
-        """Fetches chat profile values from redis."""
-        keys: list[bytes] = []
-        cursor: int = 0  # Start with cursor 0.
-        while True:
-            cursor, batch_keys = await cache.redis.scan(
-                cursor, match=f"chat:{user_id}:*:user_chat_profile"
-            )
-            keys.extend(batch_keys)
-            if cursor == 0:
-                break
-        return [
-            profile
-            for profile in await gather(
-                *(cls._load_chat_profile(key) for key in keys)
+        """Fetches chat profile values from redis, newest first.
+        Chat rooms are looked up from the per-user index,
+        and index entries whose profile no longer exists are removed."""
+        index_key: str = cls._generate_index_key(user_id)
+        chat_room_ids: list[str] = [
+            chat_room_id.decode("utf-8")
+            if isinstance(chat_room_id, bytes)
+            else chat_room_id
+            for chat_room_id in await cache.redis.zrevrange(index_key, 0, -1)
+        ]
+        if not chat_room_ids:
+            return []
+        profiles: list[UserChatProfile | None] = [
+            cls._parse_chat_profile(loaded)
+            for loaded in await cache.redis.mget(
+                [
+                    cls._generate_key(user_id, chat_room_id, "user_chat_profile")
+                    for chat_room_id in chat_room_ids
+                ]
             )
-            if profile is not None
         ]
+        dangling_chat_room_ids: list[str] = [
+            chat_room_id
+            for chat_room_id, profile in zip(chat_room_ids, profiles)
+            if profile is None
+        ]
+        if dangling_chat_room_ids:
+            ApiLogger.cdebug(
+                f"Removing deleted chat rooms from the index of {user_id}: "
+                f"{dangling_chat_room_ids}"
+            )
+            await cache.redis.zrem(index_key, *dangling_chat_room_ids)
+        return [profile for profile in profiles if profile is not None]
+
+    @classmethod
+    async def migrate_chat_room_index(cls, force: bool = False) -> int:
+        """Builds the per-user chat room index from existing profile keys.
+        This scans the whole keyspace once, and is skipped afterwards
+        unless `force` is set. Returns the number of indexed chat rooms."""
+        if not force and await cache.redis.exists(cls._index_migration_key):
+            return 0
+        n_indexed: int = 0
+        keys: list[bytes] = []
+        async for key in cache.redis.scan_iter(
+            match="chat:*:user_chat_profile", count=1000
+        ):
+            keys.append(key)
+            if len(keys) >= 1000:
+                n_indexed += await cls._index_profile_keys(keys)
+                keys = []
+        if keys:
+            n_indexed += await cls._index_profile_keys(keys)
+        await cache.redis.set(cls._index_migration_key, 1)
+        ApiLogger.cinfo(f"Indexed {n_indexed} chat rooms")
+        return n_indexed
+
+    @classmethod
+    async def _index_profile_keys(cls, keys: list[bytes]) -> int:
+        n_indexed: int = 0
+        async with cache.redis.pipeline(transaction=False) as pipe:
+            for loaded in await cache.redis.mget(keys):
+                profile: UserChatProfile | None = cls._parse_chat_profile(
+                    loaded
+                )
+                if profile is None:
+                    continue
+                pipe.zadd(
+                    cls._generate_index_key(profile.user_id),
+                    {profile.chat_room_id: profile.created_at},
+                )
+                n_indexed += 1
+            await pipe.execute()
+        return n_indexed
 
     @classmethod
     async def read_context_from_profile(
         cls, user_chat_profile: UserChatProfile
     ) -> UserChatContext:
+        """Reads context of the chat room from redis.
+        The model and all message histories are loaded in one pipelined round trip."""
         user_id: str = user_chat_profile.user_id
         chat_room_id: str = user_chat_profile.chat_room_id
+        list_fields: dict[str, str] = cls._get_list_fields(
+            user_id, chat_room_id
+        )
 
-        stored_string: dict[str, str | None] = {
-            field: await cache.redis.get(key)
-            for field, key in cls._get_string_fields(
-                user_id, chat_room_id
-            ).items()
-            if field != "user_chat_profile"
-        }
-        stored_list: dict[str, list | None] = {
-            field: await cache.redis.lrange(key, 0, -1)
-            for field, key in cls._get_list_fields(
-                user_id, chat_room_id
-            ).items()
-        }
+        async with cache.redis.pipeline(transaction=False) as pipe:
+            pipe.get(cls._generate_key(user_id, chat_room_id, "llm_model"))
+            for key in list_fields.values():
+                pipe.lrange(key, 0, -1)
+            stored_llm_model, *stored_lists = await pipe.execute()
 
-        # if any of stored strings are None, create new context
-        if any([value is None for value in stored_string.values()]):
+        # if the stored model is None, create new context
+        if stored_llm_model is None:
             default: UserChatContext = UserChatContext.construct_default(
                 user_id=user_id,
                 chat_room_id=chat_room_id,
@@ -116,40 +264,21 @@ class CacheManager:
             await cls.create_context(default)
             return default
         try:
-            for field, value in stored_string.items():
-                if value is not None:
-                    stored_string[field] = orjson_loads(value)
-            for field, value in stored_list.items():
-                if value is not None:
-                    stored_list[field] = [orjson_loads(v) for v in value]
-            if stored_string["llm_model"] not in LLMModels.member_names:
-                stored_string["llm_model"] = DEFAULT_LLM_MODEL
+            stored_list: dict[str, list[MessageHistory]] = {
+                field: cls._parse_message_histories(value)
+                for field, value in zip(list_fields.keys(), stored_lists)
+            }
+            llm_model_name: str = orjson_loads(stored_llm_model)
+            if llm_model_name not in LLMModels.member_names:
+                llm_model_name = DEFAULT_LLM_MODEL
             return UserChatContext(
                 user_chat_profile=user_chat_profile,
-                llm_model=LLMModels.get_member(
-                    stored_string["llm_model"],
-                ),
-                user_message_histories=[
-                    MessageHistory(**m)
-                    for m in stored_list["user_message_histories"]
-                    if m["content"]
-                ]
-                if stored_list["user_message_histories"] is not None
-                else [],
-                ai_message_histories=[
-                    MessageHistory(**m)
-                    for m in stored_list["ai_message_histories"]
-                    if m["content"]
-                ]
-                if stored_list["ai_message_histories"] is not None
-                else [],
-                system_message_histories=[
-                    MessageHistory(**m)
-                    for m in stored_list["system_message_histories"]
-                    if m["content"]
-                ]
-                if stored_list["system_message_histories"] is not None
-                else [],
+                llm_model=LLMModels.get_member(llm_model_name),
+                user_message_histories=stored_list["user_message_histories"],
+                ai_message_histories=stored_list["ai_message_histories"],
+                system_message_histories=stored_list[
+                    "system_message_histories"
+                ],
             )
         except Exception:
             ApiLogger.cerror("Error reading context from cache", exc_info=True)
@@ -167,27 +296,12 @@ class CacheManager:
         only_if_exists: bool = False,
         only_if_not_exists: bool = True,
     ) -> bool:
-        json_data = user_chat_context.json()
-        success: bool = True
-        for field, key in cls._get_string_fields(
-            user_chat_context.user_id, user_chat_context.chat_room_id
-        ).items():
-            result = await cache.redis.set(
-                key,
-                orjson_dumps(json_data[field]),
-                xx=only_if_exists,
-                nx=only_if_not_exists,
-            )
-            success &= bool(result)
-        for field, key in cls._get_list_fields(
-            user_chat_context.user_id, user_chat_context.chat_room_id
-        ).items():
-            result = await cache.redis.delete(key)
-            for item in json_data[field]:
-                result = await cache.redis.rpush(key, orjson_dumps(item))
-                success &= bool(result)
-
-        return success
+        return await cls._write_context_in_pipeline(
+            user_chat_context=user_chat_context,
+            only_if_exists=only_if_exists,
+            only_if_not_exists=only_if_not_exists,
+            count_delete_result=False,
+        )
 
     @classmethod
     async def reset_context(
@@ -212,48 +326,36 @@ class CacheManager:
         user_chat_context: UserChatContext,
         only_if_exists: bool = True,
     ) -> bool:
-        json_data = user_chat_context.json()
-        success = True
-        for field, key in cls._get_string_fields(
-            user_chat_context.user_id,
-            user_chat_context.chat_room_id,
-        ).items():
-            result = await cache.redis.set(
-                key,
-                orjson_dumps(json_data[field]),
-                xx=only_if_exists,
-            )
-            success &= bool(result)
-        for field, key in cls._get_list_fields(
-            user_chat_context.user_id,
-            user_chat_context.chat_room_id,
-        ).items():
-            result = await cache.redis.delete(key)
-            success &= bool(result)
-            for item in json_data[field]:
-                result = await cache.redis.rpush(key, orjson_dumps(item))
-                success &= bool(result)
-        return success
+        return await cls._write_context_in_pipeline(
+            user_chat_context=user_chat_context,
+            only_if_exists=only_if_exists,
+            only_if_not_exists=False,
+            count_delete_result=True,
+        )
 
     @classmethod
     async def delete_chat_room(cls, user_id: str, chat_room_id: str) -> int:
-        # delete all keys starting with "chat:{user_id}:{chat_room_id}:"
-        keys = [
-            key
-            async for key in cache.redis.scan_iter(
-                f"chat:{user_id}:{chat_room_id}:*"
-            )
-        ]
-        if not keys:
-            return 0
-        return await cache.redis.delete(*keys)
+        # delete all keys of the chat room and remove it from the index
+        async with cache.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(*cls._get_all_keys(user_id, chat_room_id))
+            pipe.zrem(cls._generate_index_key(user_id), chat_room_id)
+            n_deleted, _ = await pipe.execute()
+        return n_deleted
 
     @classmethod
     async def delete_user(cls, user_id: str) -> int:
-        # delete all keys starting with "chat:{user_id}:"
-        keys = [key async for key in cache.redis.scan_iter(f"*:{user_id}:*")]
-        if not keys:
-            return 0
+        # delete all keys of the chat rooms in the index, and the index itself
+        index_key: str = cls._generate_index_key(user_id)
+        keys: list[str] = [index_key]
+        for chat_room_id in await cache.redis.zrange(index_key, 0, -1):
+            keys.extend(
+                cls._get_all_keys(
+                    user_id,
+                    chat_room_id.decode("utf-8")
+                    if isinstance(chat_room_id, bytes)
+                    else chat_room_id,
+                )
+            )
         return await cache.redis.delete(*keys)
 
     @classmethod
@@ -328,7 +430,7 @@ class CacheManager:
         field = f"{ChatRoles.get_name(role).lower()}_message_histories"
         key = cls._generate_key(user_id, chat_room_id, field)
         message_histories_json = [
-            orjson_dumps(message_history.__dict__)
+            encode_message_history(message_history)
             for message_history in message_histories
         ]
         result = await cache.redis.delete(key)
@@ -353,10 +455,10 @@ class CacheManager:
         # if message_history_json is instance of list, then it is a list of message histories
         if isinstance(message_history_json, list):
             return [
-                MessageHistory(**orjson_loads(m)) for m in message_history_json
+                decode_message_history(m) for m in message_history_json
             ]
         # otherwise, it is a single message history
-        return MessageHistory(**orjson_loads(message_history_json))
+        return decode_message_history(message_history_json)
 
     @classmethod
     async def rpop_message_history(
@@ -376,10 +478,10 @@ class CacheManager:
         # if message_history_json is instance of list, then it is a list of message histories
         if isinstance(message_history_json, list):
             return [
-                MessageHistory(**orjson_loads(m)) for m in message_history_json
+                decode_message_history(m) for m in message_history_json
             ]
         # otherwise, it is a single message history
-        return MessageHistory(**orjson_loads(message_history_json))
+        return decode_message_history(message_history_json)
 
     @classmethod
     async def append_message_history(
@@ -392,7 +494,7 @@ class CacheManager:
     ) -> bool:
         field = f"{ChatRoles.get_name(role).lower()}_message_histories"
         message_history_key = cls._generate_key(user_id, chat_room_id, field)
-        message_history_json = orjson_dumps(message_history.__dict__)
+        message_history_json = encode_message_history(message_history)
         result = (
             await cache.redis.rpush(message_history_key, message_history_json)
             if not if_exists
@@ -415,7 +517,7 @@ class CacheManager:
         if raw_message_histories is None:
             return []
         return [
-            MessageHistory(**orjson_loads(raw_message_history))
+            decode_message_history(raw_message_history)
             for raw_message_history in raw_message_histories
         ]
 
@@ -481,6 +583,6 @@ class CacheManager:
         field = f"{ChatRoles.get_name(role).lower()}_message_histories"
         key = cls._generate_key(user_id, chat_room_id, field)
         result = await cache.redis.lset(
-            key, index, orjson_dumps(message_history.__dict__)
+            key, index, encode_message_history(message_history)
         )
         return bool(result)
@@ -1,7 +1,12 @@
 from typing import Optional
 from uuid import uuid4
 
-from app.models.chat_models import ChatRoles, MessageHistory, UserChatContext
+from app.models.chat_models import (
+    ChatRoles,
+    MessageHistory,
+    MessageHistoryList,
+    UserChatContext,
+)
 
 from .cache import CacheManager
 
@@ -118,21 +123,18 @@ class MessageManager:
         summarized_content: Optional[str] = None,  # =
         update_cache: bool = True,
     ) -> None:
+        if role is ChatRoles.AI:
+            histories: list[
+                MessageHistory
+            ] = user_chat_context.ai_message_histories
+        elif role is ChatRoles.USER:
+            histories = user_chat_context.user_message_histories
+        elif role is ChatRoles.SYSTEM:
+            histories = user_chat_context.system_message_histories
+        else:
+            raise ValueError(f"Invalid role: {role}")
         try:
-            if role is ChatRoles.AI:
-                histories_to_change: MessageHistory = (
-                    user_chat_context.ai_message_histories[index]
-                )
-            elif role is ChatRoles.USER:
-                histories_to_change = user_chat_context.user_message_histories[
-                    index
-                ]
-            elif role is ChatRoles.SYSTEM:
-                histories_to_change = (
-                    user_chat_context.system_message_histories[index]
-                )
-            else:
-                raise ValueError(f"Invalid role: {role}")
+            histories_to_change: MessageHistory = histories[index]
         except IndexError:
             return None
         if new_content is not None:
@@ -146,6 +148,8 @@ class MessageManager:
                 user_chat_context.get_tokens_of(summarized_content)
                 + user_chat_context.llm_model.value.token_margin
             )
+        if isinstance(histories, MessageHistoryList):
+            histories.recalculate_tokens()
         if update_cache:
             await CacheManager.set_message_history(
                 user_id=user_chat_context.user_id,
@@ -7,6 +7,7 @@ from orjson import JSONDecodeError
 from orjson import loads as orjson_loads
 from pydantic import ValidationError
 
+from app.common.lotties import Lotties
 from app.database.schemas.auth import Users
 from app.errors.chat_exceptions import (
     ChatException,
@@ -19,6 +20,7 @@ from app.models.chat_models import ChatRoles, UserChatContext, UserChatProfile
 from app.models.llms import LLMModels
 from app.utils.chat.buffer import BufferedUserContext
 from app.utils.chat.chat_rooms import create_new_chat_room
+from app.utils.chat.ingestion import IngestionProgress
 from app.utils.chat.messages.handler import (
     MessageHandler,
     _interruption_event_watcher,
@@ -271,11 +273,26 @@ async def _websocket_receiver(buffer: BufferedUserContext) -> None:
                 )
 
         if received_bytes is not None:
+            filename: str = buffer.optional_info.get("filename") or ""
+
+            async def send_progress(progress: IngestionProgress) -> None:
+                await SendToWebsocket.message(
+                    websocket=buffer.websocket,
+                    msg=Lotties.READ.format(
+                        f"### Embedding {filename}\n"
+                        f"{progress.n_upserted}/{progress.n_chunks} chunks"
+                        + ("" if progress.is_split else "+")
+                    ),
+                    chat_room_id=buffer.current_chat_room_id,
+                    finish=False,
+                )
+
             await buffer.queue.put(
                 await VectorStoreManager.embed_file_to_vectorstore(
                     file=received_bytes,
-                    filename=buffer.optional_info.get("filename") or "",
+                    filename=filename,
                     collection_name=buffer.current_user_chat_context.user_id,
+                    on_progress=send_progress,
                 )
             )
 
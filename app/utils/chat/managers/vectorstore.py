@@ -1,7 +1,10 @@
-from asyncio import gather
-from typing import Any, Coroutine
+from asyncio import Lock, gather
+from heapq import nlargest
+from itertools import chain
+from operator import itemgetter
+from time import monotonic
+from typing import Any, Awaitable, Callable, Optional, TypeVar
 
-from fastapi.concurrency import run_in_threadpool
 from langchain.docstore.document import Document
 from langchain.text_splitter import TokenTextSplitter
 from qdrant_client import QdrantClient
@@ -9,13 +12,123 @@ from qdrant_client import QdrantClient
 from app.common.config import (
     EMBEDDING_TOKEN_CHUNK_OVERLAP,
     EMBEDDING_TOKEN_CHUNK_SIZE,
+    ChatConfig,
 )
 from app.common.lotties import Lotties
 from app.database.connection import cache
-from app.utils.chat.file_loader import read_bytes_to_text
+from app.utils.chat.file_loader import iter_bytes_to_texts
+from app.utils.chat.ingestion import IngestionPipeline, IngestionProgress
+from app.utils.langchain.qdrant_vectorstore import UpsertResult
+
+T = TypeVar("T")
+
+
+class CollectionRegistry:
+    """Cached names of the vectorstore collections, so that a query doesn't list them every time.
+    - Existing collections are trusted for `ttl` seconds,
+    and missing ones for `missing_ttl` seconds, to notice changes made by other processes.
+    - Collections created or deleted by this process are updated at once.
+    - Concurrent lookups share one listing.
+    - A collection dropped by another process is skipped by searches, and created again by writes."""
+
+    def __init__(
+        self,
+        list_names: Optional[Callable[[], Awaitable[list[str]]]] = None,
+        ttl: float = ChatConfig.vectorstore_collections_ttl,
+        missing_ttl: float = ChatConfig.vectorstore_missing_collections_ttl,
+    ) -> None:
+        self.list_names = list_names
+        self.ttl = ttl
+        self.missing_ttl = missing_ttl
+        self._names: set[str] = set()
+        self._listed_at: float = float("-inf")
+        self._generation: int = 0  # Incremented by every local change
+        self._lock: Optional[Lock] = None
+        self._create_lock: Optional[Lock] = None
+
+    def _is_trusted(self, collection_name: str) -> bool:
+        age: float = monotonic() - self._listed_at
+        if collection_name in self._names:
+            return age < self.ttl
+        return age < self.missing_ttl
+
+    async def refresh(self) -> set[str]:
+        """List the collections again."""
+        if self._lock is None:
+            self._lock = Lock()
+        requested_at: float = monotonic()
+        async with self._lock:
+            if self._listed_at >= requested_at:
+                return self._names  # Listed by another lookup in the meantime
+            generation: int = self._generation
+            names: list[str] = await (
+                self.list_names or VectorStoreManager.get_all_collection_names
+            )()
+            if generation == self._generation:
+                # Otherwise, the listing may miss a local change. List again next time.
+                self._names = set(names)
+                self._listed_at = monotonic()
+            return self._names
+
+    async def exists(self, collection_name: str) -> bool:
+        if not self._is_trusted(collection_name):
+            await self.refresh()
+        return collection_name in self._names
+
+    async def filter_existing(self, collection_names: list[str]) -> list[str]:
+        if not all(map(self._is_trusted, collection_names)):
+            await self.refresh()
+        return [name for name in collection_names if name in self._names]
+
+    def add(self, collection_name: str) -> None:
+        self._generation += 1
+        self._names.add(collection_name)
+
+    def discard(self, collection_name: str) -> None:
+        self._generation += 1
+        self._names.discard(collection_name)
+
+    def clear(self) -> None:
+        self._generation += 1
+        self._names.clear()
+        self._listed_at = float("-inf")
+
+    async def search_unless_dropped(
+        self, search: Awaitable[list[T]], collection_name: str
+    ) -> list[T]:
+        """Await a search, returning nothing if the collection
+        has been dropped by another process since it was listed."""
+        try:
+            return await search
+        except Exception:
+            if collection_name in await self.refresh():
+                raise
+            return []
+
+    async def write_unless_dropped(
+        self, write: Callable[[], Awaitable[T]], collection_name: str
+    ) -> T:
+        """Await a write, creating the collection and writing once more
+        if it has been dropped by another process since it was listed."""
+        try:
+            return await write()
+        except Exception:
+            if collection_name in await self.refresh():
+                raise
+        if self._create_lock is None:
+            self._create_lock = Lock()
+        async with self._create_lock:
+            # Concurrent writes to the dropped collection create it once
+            if collection_name not in self._names:
+                await VectorStoreManager.create_collection(
+                    collection_name=collection_name
+                )
+        return await write()
 
 
 class VectorStoreManager:
+    collections: CollectionRegistry = CollectionRegistry()
+
     @staticmethod
     async def get_vector_size() -> int:
         return len(await cache.vectorstore._aembed_query("foo"))
@@ -28,23 +141,64 @@ class VectorStoreManager:
         chunk_overlap: int = EMBEDDING_TOKEN_CHUNK_OVERLAP,
         tokenizer_model: str = "gpt-3.5-turbo",
     ) -> list[str]:
+        texts = await VectorStoreManager._split_into_collection(
+            text,
+            collection_name=collection_name,
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            tokenizer_model=tokenizer_model,
+        )
+        await VectorStoreManager.collections.write_unless_dropped(
+            lambda: cache.vectorstore.aadd_texts(
+                texts, collection_name=collection_name
+            ),
+            collection_name=collection_name,
+        )
+        return texts
+
+    @staticmethod
+    async def upsert_documents(
+        text: str,
+        collection_name: str,
+        chunk_size: int = EMBEDDING_TOKEN_CHUNK_SIZE,
+        chunk_overlap: int = EMBEDDING_TOKEN_CHUNK_OVERLAP,
+        tokenizer_model: str = "gpt-3.5-turbo",
+    ) -> UpsertResult:
+        """Like `create_documents`, but only the chunks not stored yet are embedded.
+        Returns the number of new, updated and skipped chunks."""
+        texts = await VectorStoreManager._split_into_collection(
+            text,
+            collection_name=collection_name,
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            tokenizer_model=tokenizer_model,
+        )
+        return await VectorStoreManager.collections.write_unless_dropped(
+            lambda: cache.vectorstore.aadd_new_texts(
+                texts, collection_name=collection_name
+            ),
+            collection_name=collection_name,
+        )
+
+    @staticmethod
+    async def _split_into_collection(
+        text: str,
+        collection_name: str,
+        chunk_size: int,
+        chunk_overlap: int,
+        tokenizer_model: str,
+    ) -> list[str]:
+        """Split the text into chunks, creating the collection if missing."""
         texts = TokenTextSplitter(
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
             model_name=tokenizer_model,
         ).split_text(text)
         assert isinstance(cache.vectorstore.client, QdrantClient)
-        if (
-            collection_name
-            not in await VectorStoreManager.get_all_collection_names()
-        ):
+        if not await VectorStoreManager.collections.exists(collection_name):
             await VectorStoreManager.create_collection(
                 collection_name=collection_name,
             )
-
-        await cache.vectorstore.aadd_texts(
-            texts, collection_name=collection_name
-        )
         return texts
 
     @staticmethod
@@ -53,13 +207,39 @@ class VectorStoreManager:
         collection_name: str,
         k: int = 1,
     ) -> list[Document]:
-        if (
-            collection_name
-            not in await VectorStoreManager.get_all_collection_names()
-        ):
+        if not await VectorStoreManager.collections.exists(collection_name):
+            return []
+        return await VectorStoreManager.collections.search_unless_dropped(
+            cache.vectorstore.asimilarity_search(
+                query, collection_name=collection_name, k=k
+            ),
+            collection_name=collection_name,
+        )
+
+    @staticmethod
+    async def _asearch_existing_collections_by_vector(
+        query: str,
+        collection_names: list[str],
+        search: Callable[[list[float], str], Awaitable[list[T]]],
+    ) -> list[list[T]]:
+        """Embed the query once, and search the existing collections with it at once.
+        Returns the results of each collection, in order."""
+        existing_collection_names: list[
+            str
+        ] = await VectorStoreManager.collections.filter_existing(
+            collection_names
+        )
+        if not existing_collection_names:
             return []
-        return await cache.vectorstore.asimilarity_search(
-            query, collection_name=collection_name, k=k
+        embedding: list[float] = await cache.vectorstore._aembed_query(query)
+        return await gather(
+            *[
+                VectorStoreManager.collections.search_unless_dropped(
+                    search(embedding, collection_name),
+                    collection_name=collection_name,
+                )
+                for collection_name in existing_collection_names
+            ]
         )
 
     @staticmethod
@@ -68,26 +248,20 @@ class VectorStoreManager:
         collection_names: list[str],
         k: int = 1,
     ) -> list[Document]:
-        # Nested function to handle index check and search.
         # results: list[list[Document]] =   # shape: (index, k)
         # Reorganize results to have shape: (index * k)
-
-        query_tasks: list[Coroutine[Any, Any, list[Document]]] = []
-        existing_collection_names: list[
-            str
-        ] = await VectorStoreManager.get_all_collection_names()
-        for collection_name in collection_names:
-            if collection_name in existing_collection_names:
-                query_tasks.append(
-                    cache.vectorstore.asimilarity_search(
-                        query,
-                        collection_name=collection_name,
-                        k=k,
-                    )
+        results: list[
+            list[tuple[Document, float]]
+        ] = await VectorStoreManager._asearch_existing_collections_by_vector(
+            query,
+            collection_names=collection_names,
+            search=lambda embedding, collection_name: (
+                cache.vectorstore.asimilarity_search_with_score_by_vector(
+                    embedding, collection_name=collection_name, k=k
                 )
-        return [
-            item for sublist in await gather(*query_tasks) for item in sublist
-        ]
+            ),
+        )
+        return [document for sublist in results for document, _ in sublist]
 
     @staticmethod
     async def asimilarity_search_multiple_collections_with_score(
@@ -95,36 +269,20 @@ class VectorStoreManager:
         collection_names: list[str],
         k: int = 1,
     ) -> list[tuple[Document, float]]:
-        # Nested function to handle index check and search.
-        # search_with_score_if_index_exists's shape: k
-        # search_with_score_if_index_exists's return type: list[tuple[Document, float]]
-        # Assume that tuple[Document, float] is a single result.
-        # Reorganize results to have shape: (index * k), sorted by score.
-
-        query_tasks: list[
-            Coroutine[Any, Any, list[tuple[Document, float]]]
-        ] = []
-        existing_collection_names: list[
-            str
-        ] = await VectorStoreManager.get_all_collection_names()
-        for collection_name in collection_names:
-            if collection_name in existing_collection_names:
-                query_tasks.append(
-                    cache.vectorstore.asimilarity_search_with_score(
-                        query,
-                        collection_name=collection_name,
-                        k=k,
-                    )
+        # results: list[list[tuple[Document, float]]] =   # shape: (index, k)
+        # Merge the results into the top k, sorted by score.
+        results: list[
+            list[tuple[Document, float]]
+        ] = await VectorStoreManager._asearch_existing_collections_by_vector(
+            query,
+            collection_names=collection_names,
+            search=lambda embedding, collection_name: (
+                cache.vectorstore.asimilarity_search_with_score_by_vector(
+                    embedding, collection_name=collection_name, k=k
                 )
-        return sorted(
-            [
-                item
-                for sublist in await gather(*query_tasks)
-                for item in sublist
-            ],
-            key=lambda x: x[1],
-            reverse=True,
+            ),
         )
+        return nlargest(k, chain.from_iterable(results), key=itemgetter(1))
 
     @staticmethod
     async def amax_marginal_relevance_search_multiple_collections_with_score(
@@ -135,38 +293,24 @@ class VectorStoreManager:
         lambda_mult: float = 0.5,
         **kwargs: Any,
     ) -> list[tuple[Document, float]]:
-        # Nested function to handle index check and search.
-        # search_with_score_if_index_exists's shape: k
-        # search_with_score_if_index_exists's return type: list[tuple[Document, float]]
-        # Assume that tuple[Document, float] is a single result.
-        # Reorganize results to have shape: (index * k), sorted by score.
-
-        query_tasks: list[
-            Coroutine[Any, Any, list[tuple[Document, float]]]
-        ] = []
-        existing_collection_names: list[
-            str
-        ] = await VectorStoreManager.get_all_collection_names()
-        for collection_name in collection_names:
-            if collection_name in existing_collection_names:
-                query_tasks.append(
-                    cache.vectorstore.amax_marginal_relevance_search_with_score(
-                        query=query,
-                        collection_name=collection_name,
-                        k=k,
-                        fetch_k=fetch_k,
-                        lambda_mult=lambda_mult,
-                    )
+        # results: list[list[tuple[Document, float]]] =   # shape: (index, k)
+        # Merge the results into the top k, sorted by score.
+        results: list[
+            list[tuple[Document, float]]
+        ] = await VectorStoreManager._asearch_existing_collections_by_vector(
+            query,
+            collection_names=collection_names,
+            search=lambda embedding, collection_name: (
+                cache.vectorstore.amax_marginal_relevance_search_with_score_by_vector(
+                    embedding,
+                    collection_name=collection_name,
+                    k=k,
+                    fetch_k=fetch_k,
+                    lambda_mult=lambda_mult,
                 )
-        return sorted(
-            [
-                item
-                for sublist in await gather(*query_tasks)
-                for item in sublist
-            ],
-            key=lambda x: x[1],
-            reverse=True,
+            ),
         )
+        return nlargest(k, chain.from_iterable(results), key=itemgetter(1))
 
     @classmethod
     async def embed_file_to_vectorstore(
@@ -174,17 +318,42 @@ class VectorStoreManager:
         file: bytes,
         filename: str,
         collection_name: str,
+        on_progress: Optional[
+            Callable[[IngestionProgress], Awaitable[None]]
+        ] = None,
+        chunk_size: int = EMBEDDING_TOKEN_CHUNK_SIZE,
+        chunk_overlap: int = EMBEDDING_TOKEN_CHUNK_OVERLAP,
+        tokenizer_model: str = "gpt-3.5-turbo",
     ) -> str:
-        # if user uploads file, embed it
+        # if user uploads file, embed it, while it is partitioned and split
         try:
-            text: str = await run_in_threadpool(
-                read_bytes_to_text, file, filename
-            )
-            docs: list[str] = await VectorStoreManager.create_documents(
-                text, collection_name=collection_name
-            )
-            doc_sample_without_triple_backticks: str = docs[0][:100].replace(
-                "```", "'''"
+            if not await cls.collections.exists(collection_name):
+                await cls.create_collection(collection_name=collection_name)
+
+            async def upsert(
+                texts: list[str], embeddings: list[list[float]]
+            ) -> list[str]:
+                return await cls.collections.write_unless_dropped(
+                    lambda: cache.vectorstore.aadd_embedded_texts(
+                        texts, embeddings, collection_name=collection_name
+                    ),
+                    collection_name=collection_name,
+                )
+
+            progress = await IngestionPipeline(
+                texts=iter_bytes_to_texts(file, filename),
+                split_text=TokenTextSplitter(
+                    chunk_size=chunk_size,
+                    chunk_overlap=chunk_overlap,
+                    model_name=tokenizer_model,
+                ).split_text,
+                embed=cache.vectorstore._aembed_texts,
+                upsert=upsert,
+                on_progress=on_progress,
+            ).run()
+            assert progress.first_chunk is not None
+            doc_sample_without_triple_backticks: str = (
+                progress.first_chunk[:100].replace("```", "'''")
             )
             return Lotties.OK.format(
                 f'### Successfully Embedded\n`"{doc_sample_without_triple_backticks}"`'
@@ -238,6 +407,7 @@ class VectorStoreManager:
                 ),  # type: ignore
             )
         )
+        cls.collections.add(collection_name)
 
     @staticmethod
     async def delete_collection(collection_name: str) -> bool:
@@ -247,6 +417,7 @@ class VectorStoreManager:
 
         grpc_collections = cache.vectorstore.client.async_grpc_collections
         response = await grpc_collections.Delete(grpc.DeleteCollection(collection_name=collection_name))  # type: ignore
+        VectorStoreManager.collections.discard(collection_name)
         return getattr(response, "result", False)
 
     @property
@@ -1,7 +1,5 @@
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
 from typing import (
-    Any,
     AsyncGenerator,
     AsyncIterator,
     Callable,
@@ -12,6 +10,7 @@ from typing import (
 )
 
 from fastapi import WebSocket
+from orjson import dumps as orjson_dumps
 
 from app.common.config import ChatConfig
 from app.errors.chat_exceptions import (
@@ -33,45 +32,30 @@ from app.utils.chat.messages.converter import (
     message_histories_to_list,
 )
 from app.utils.chat.tokens import cutoff_message_histories
-from app.utils.logger import ApiLogger
+from app.utils.concurrency import SyncToAsyncIterator
 
 
-class SyncToAsyncGenerator:
-    def __init__(self, sync_gen: Iterator):
-        self._gen: Iterator[Any] = sync_gen
-        self._queue: asyncio.Queue = asyncio.Queue()
+class StreamFrameTemplate:
+    """Pre-serialized `MessageToWebsocket` of streamed text, skipping pydantic for every frame.
+    `format(msg)` is the same JSON as sending `MessageToWebsocket(msg=msg, finish=False, ...)`.
+    """
 
-    def __aiter__(self):
-        return self
+    _placeholder: str = "\x00"
 
-    async def __anext__(self):
-        value = await self._queue.get()
-        if value is self:  # using `self` as sentinel
-            raise StopAsyncIteration
-        return value
+    def __init__(self, actual_role: Optional[str] = None) -> None:
+        serialized: str = orjson_dumps(
+            MessageToWebsocket(
+                msg=self._placeholder,
+                finish=False,
+                actual_role=actual_role,
+            ).dict(exclude_none=True)
+        ).decode("utf-8")
+        self.prefix, self.suffix = serialized.split(
+            orjson_dumps(self._placeholder).decode("utf-8")
+        )
 
-    async def run(self, executor: Optional[ThreadPoolExecutor] = None):
-        it = iter(self._gen)  # Get an iterator from the generator
-        while True:
-            try:
-                # Use 'self' as a sentinel value to avoid raising StopIteration
-                value = await asyncio.get_running_loop().run_in_executor(
-                    executor, next, it, self
-                )
-                if value is self:  # Check if the iterator is exhausted
-                    await self._queue.put(self)  # Notify of completion
-                    break
-                else:
-                    await self._queue.put(value)
-            except StopIteration:
-                # This exception is expected and handled gracefully
-                break
-            except Exception as e:
-                # Other exceptions are unexpected and should propagate up
-                ApiLogger.cexception(
-                    f"Unexpected exception in SyncToAsyncGenerator: {e}"
-                )
-                raise e
+    def format(self, msg: str) -> str:
+        return self.prefix + orjson_dumps(msg).decode("utf-8") + self.suffix
 
 
 class SendToWebsocket:
@@ -139,6 +123,70 @@ class SendToWebsocket:
             ).dict(exclude_none=True)
         )
 
+    @staticmethod
+    async def coalesced_stream(
+        websocket: WebSocket,
+        async_stream: AsyncIterator,
+        stream_progress: StreamProgress,
+        actual_role: Optional[str] = None,
+        flush_interval: float = ChatConfig.stream_flush_interval,
+        flush_size: int = ChatConfig.stream_flush_size,
+    ) -> None:
+        """Send text deltas to websocket, coalescing them into fewer frames.
+        A frame is sent when `flush_interval` seconds have passed since the last frame,
+        or when `flush_size` bytes are buffered. The first delta is sent at once.
+        Unsent text is kept in `stream_progress.buffer` until it is flushed."""
+        loop = asyncio.get_running_loop()
+        frame_template = StreamFrameTemplate(actual_role=actual_role)
+        send_lock = asyncio.Lock()  # Keep the order of frames
+        buffered_bytes: int = 0
+        last_flush: float = float("-inf")
+        flush_timer: Optional[asyncio.TimerHandle] = None
+        flush_task: Optional[asyncio.Task] = None
+
+        async def flush() -> None:
+            nonlocal buffered_bytes, last_flush, flush_timer
+            async with send_lock:
+                if flush_timer is not None:
+                    flush_timer.cancel()
+                    flush_timer = None
+                text: str = stream_progress.buffer
+                if not text:
+                    return
+                stream_progress.response += text
+                stream_progress.buffer = ""
+                buffered_bytes = 0
+                last_flush = loop.time()
+                await websocket.send_text(frame_template.format(text))
+
+        def flush_on_deadline() -> None:
+            # Flush the buffered text, if no more delta came in time
+            nonlocal flush_timer, flush_task
+            flush_timer = None
+            flush_task = loop.create_task(flush())
+
+        try:
+            async for delta in async_stream:  # stream from api
+                if not isinstance(delta, str) or not delta:
+                    continue
+                stream_progress.buffer += delta
+                buffered_bytes += len(delta.encode("utf-8"))
+                if (
+                    buffered_bytes >= flush_size
+                    or loop.time() - last_flush >= flush_interval
+                ):
+                    await flush()
+                elif flush_timer is None:
+                    flush_timer = loop.call_at(
+                        last_flush + flush_interval, flush_on_deadline
+                    )
+        finally:
+            if flush_timer is not None:
+                flush_timer.cancel()
+        if flush_task is not None:
+            await flush_task
+        await flush()
+
     @classmethod
     async def stream(
         cls,
@@ -155,31 +203,22 @@ class SendToWebsocket:
         ],
         stream_progress: StreamProgress,
         actual_role: Optional[str] = None,
-        chunk_size: int = 1,
+        flush_interval: float = ChatConfig.stream_flush_interval,
+        flush_size: int = ChatConfig.stream_flush_size,
     ) -> None:
         """Send SSE stream to websocket"""
         current_model: LLMModel = buffer.current_llm_model.value
 
         async def consumer(async_stream: AsyncIterator) -> None:
             """Helper function to send chunks of data"""
-            iteration: int = 0
-            async for delta in async_stream:  # stream from api
-                if isinstance(delta, str):
-                    stream_progress.buffer += delta
-                    iteration += 1
-                    if iteration % chunk_size == 0:
-                        stream_progress.response += stream_progress.buffer
-                        await cls.message(
-                            websocket=buffer.websocket,
-                            msg=stream_progress.buffer,
-                            chat_room_id=None,
-                            finish=False,
-                            actual_role=actual_role,
-                            model_name=None,
-                        )
-                        stream_progress.buffer = ""
-                else:
-                    pass
+            await cls.coalesced_stream(
+                websocket=buffer.websocket,
+                async_stream=async_stream,
+                stream_progress=stream_progress,
+                actual_role=actual_role,
+                flush_interval=flush_interval,
+                flush_size=flush_size,
+            )
 
         async def transmission(
             user_message_histories: list[MessageHistory],
@@ -224,11 +263,11 @@ class SendToWebsocket:
                         await consumer(async_stream=_stream)
 
                     case _stream if isinstance(_stream, (Generator, Iterator)):
-                        async_stream = SyncToAsyncGenerator(sync_gen=_stream)
-                        await asyncio.gather(
-                            consumer(async_stream=async_stream),
-                            async_stream.run(executor=None),
-                        )
+                        async_stream = SyncToAsyncIterator(_stream)
+                        try:
+                            await consumer(async_stream=async_stream)
+                        finally:
+                            async_stream.close()
 
                     case _ as _stream:
                         raise ChatModelNotImplementedException(
@@ -0,0 +1,79 @@
+"""A module for encoding message histories into compact bytes for Redis lists.
+
+Each entry starts with a header byte. The lower 7 bits are the format version,
+and the highest bit tells whether the payload is zlib-compressed.
+The payload of version 1 is a fixed-field JSON array, so field names are not repeated in every entry.
+Legacy entries, which are JSON objects of `MessageHistory.__dict__`, are decoded transparently."""
+
+from typing import Any, Optional
+from zlib import compress, decompress
+
+from orjson import dumps as orjson_dumps
+from orjson import loads as orjson_loads
+
+from app.common.config import ChatConfig
+from app.models.base_models import MessageHistory
+from app.models.chat_models import ChatRoles
+
+CODEC_VERSION: int = 1
+COMPRESSED_FLAG: int = 0x80
+LEGACY_JSON_HEADER: int = ord("{")
+
+# Fixed field order of version 1 payload. Never reorder; append new fields only.
+_FIELDS: tuple[str, ...] = (
+    "role",
+    "content",
+    "tokens",
+    "timestamp",
+    "uuid",
+    "actual_role",
+    "model_name",
+    "summarized",
+    "summarized_tokens",
+)
+_ACTUAL_ROLE_INDEX: int = _FIELDS.index("actual_role")
+_ACTUAL_ROLE_TO_CODE: dict[str, int] = {
+    role.value: code for code, role in enumerate(ChatRoles)
+}
+_CODE_TO_ACTUAL_ROLE: dict[int, str] = {
+    code: value for value, code in _ACTUAL_ROLE_TO_CODE.items()
+}
+
+
+def encode_message_history(
+    message_history: MessageHistory,
+    compression_threshold: Optional[int] = ChatConfig.message_history_compression_threshold,
+) -> bytes:
+    """Encode message history into versioned compact bytes.
+    Payloads longer than `compression_threshold` bytes are compressed,
+    unless the threshold is None."""
+    values: list[Any] = [getattr(message_history, field) for field in _FIELDS]
+    actual_role: Optional[str] = values[_ACTUAL_ROLE_INDEX]
+    if actual_role in _ACTUAL_ROLE_TO_CODE:
+        values[_ACTUAL_ROLE_INDEX] = _ACTUAL_ROLE_TO_CODE[actual_role]
+    payload: bytes = orjson_dumps(values)
+    if compression_threshold is not None and len(payload) > compression_threshold:
+        compressed: bytes = compress(payload, 1)
+        if len(compressed) < len(payload):
+            return bytes((CODEC_VERSION | COMPRESSED_FLAG,)) + compressed
+    return bytes((CODEC_VERSION,)) + payload
+
+
+def decode_message_history(raw: bytes | str) -> MessageHistory:
+    """Decode message history from compact bytes, or from legacy JSON."""
+    if isinstance(raw, str):
+        raw = raw.encode("utf-8")
+    header: int = raw[0]
+    if header == LEGACY_JSON_HEADER:
+        return MessageHistory(**orjson_loads(raw))
+    if header & ~COMPRESSED_FLAG != CODEC_VERSION:
+        raise ValueError(f"Unknown message history codec version: {header}")
+    payload: bytes = raw[1:]
+    if header & COMPRESSED_FLAG:
+        payload = decompress(payload)
+    values: list[Any] = orjson_loads(payload)
+    actual_role: Any = values[_ACTUAL_ROLE_INDEX]
+    if isinstance(actual_role, int):
+        values[_ACTUAL_ROLE_INDEX] = _CODE_TO_ACTUAL_ROLE[actual_role]
+    # The fields are produced by `encode_message_history`, so skip validation.
+    return MessageHistory.construct(**dict(zip(_FIELDS, values)))
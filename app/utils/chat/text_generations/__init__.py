@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import TYPE_CHECKING, Iterator
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator
 
 from app.models.base_models import APIChatMessage, TextGenerationSettings
 from app.models.completion_models import (
@@ -9,6 +9,8 @@ from app.models.completion_models import (
     CompletionChunk,
 )
 
+from .streaming import IncrementalDetokenizer, StopStringMatcher
+
 if TYPE_CHECKING:
     from app.models.llms import LLMModel
 
@@ -130,6 +132,27 @@ class BaseCompletionGenerator(ABC):
                 return True
         return False
 
+    @staticmethod
+    def stream_text_with_stops(
+        token_ids: Iterable[int],
+        decode: Callable[[list[int]], str],
+        stops: list[str],
+    ) -> Iterator[str]:
+        """A helper method to stream text out of generated tokens, until any of the stop strings.
+        The stop string itself and the text after it are not yielded."""
+        detokenizer = IncrementalDetokenizer(decode)
+        matcher = StopStringMatcher(stops)
+        for token_id in token_ids:
+            text, is_stopped = matcher.push(detokenizer.push(token_id))
+            if text:
+                yield text
+            if is_stopped:
+                return
+        text, is_stopped = matcher.push(detokenizer.flush())
+        text += "" if is_stopped else matcher.flush()
+        if text:
+            yield text
+
     @property
     @abstractmethod
     def llm_model(self) -> "LLMModel":
@@ -91,8 +91,12 @@ def _make_common_kwargs(buffer: BufferedUserContext, max_tokens: int) -> dict:
     """Make common kwargs to use for completion API"""
     if isinstance(buffer.current_llm_model.value, OpenAIModel):
         model = buffer.current_llm_model.value.name
+        extra_kwargs = {}
     else:
         model = buffer.current_llm_model.name
+        extra_kwargs = {
+            "session_id": f"{buffer.user_id}:{buffer.current_chat_room_id}"
+        }
     return dict(
         model=model,
         temperature=buffer.current_user_chat_profile.temperature,
@@ -103,6 +107,7 @@ def _make_common_kwargs(buffer: BufferedUserContext, max_tokens: int) -> dict:
         max_tokens=max_tokens,
         api_key=_get_api_key(buffer=buffer),
         api_base=_get_api_base(buffer=buffer),
+        **extra_kwargs,
     )
 
 
@@ -198,43 +198,19 @@ class ExllamaCompletionGenerator(BaseCompletionGenerator):
         with self._generator_context_manager(
             prompt, settings=settings
         ) as generator:
-            # Start generation
-            initial_len = generator.sequence[0].shape[0]
-            has_leading_space: bool = False
-            text_cursor: int = 0
             n_completion_tokens: int = 0
 
-            for n_completion_tokens in range(1, settings.max_tokens + 1):
-                token = generator.gen_single_token()
-                if token.item() == generator.tokenizer.eos_token_id:
-                    return
-                if (
-                    n_completion_tokens == 0
-                    and generator.tokenizer.tokenizer.IdToPiece(
-                        int(token)
-                    ).startswith("▁")
-                ):
-                    has_leading_space = True
-
-                decoded_text = str(
-                    generator.tokenizer.decode(
-                        generator.sequence[0][initial_len:]
-                    )
-                )
-                if has_leading_space:
-                    decoded_text = " " + decoded_text
-                if self.is_possible_to_generate_stops(
-                    decoded_text, stops=stops
-                ):
-                    for stop in stops:
-                        if stop in decoded_text:
-                            return
-                    continue
-                text_piece = decoded_text[text_cursor:]
-                if "�" in text_piece:
-                    continue
-                yield text_piece
-                text_cursor += len(text_piece)
+            def generate_tokens() -> Iterator[int]:
+                nonlocal n_completion_tokens
+                for n_completion_tokens in range(1, settings.max_tokens + 1):
+                    token_id = int(generator.gen_single_token())
+                    if token_id == generator.tokenizer.eos_token_id:
+                        return
+                    yield token_id
+
+            yield from self.stream_text_with_stops(
+                generate_tokens(), decode=self.decode, stops=stops
+            )
             self._completion_status[
                 settings.completion_id
             ] = n_completion_tokens
@@ -264,7 +240,7 @@ class ExllamaCompletionGenerator(BaseCompletionGenerator):
             model=model_path,
             text=last_token if last_token is not None else "",
             finish_reason="length"
-            if self._completion_status.get(
+            if self._completion_status.pop(
                 completion_id, self.tokenizer.encode(generated_text).shape[1]
             )
             >= settings.max_tokens
@@ -278,7 +254,7 @@ class ExllamaCompletionGenerator(BaseCompletionGenerator):
         completion_id: str = settings.completion_id
         generated_text: str = self._generate_text(prompt, settings=settings)
         n_prompt_tokens: int = self.tokenizer.encode(prompt).shape[1]
-        n_completion_tokens: int = self._completion_status.get(
+        n_completion_tokens: int = self._completion_status.pop(
             completion_id, self.tokenizer.encode(generated_text).shape[1]
         )
         return make_completion(
@@ -320,7 +296,7 @@ class ExllamaCompletionGenerator(BaseCompletionGenerator):
             model=model_path,
             content=last_token if last_token is not None else "",
             finish_reason="length"
-            if self._completion_status.get(
+            if self._completion_status.pop(
                 completion_id, self.tokenizer.encode(generated_text).shape[1]
             )
             else "stop",
@@ -336,7 +312,7 @@ class ExllamaCompletionGenerator(BaseCompletionGenerator):
         prompt = self.convert_messages_into_prompt(messages, settings=settings)
         generated_text: str = self._generate_text(prompt, settings=settings)
         prompt_tokens: int = self.tokenizer.encode(prompt).shape[1]
-        completion_tokens: int = self._completion_status.get(
+        completion_tokens: int = self._completion_status.pop(
             completion_id, self.tokenizer.encode(generated_text).shape[1]
         )
         return make_chat_completion(
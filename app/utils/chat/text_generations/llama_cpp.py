@@ -4,7 +4,7 @@ import sys
 from os import getpid, kill
 from pathlib import Path
 from signal import SIGINT
-from typing import TYPE_CHECKING, Iterator, Literal, Optional
+from typing import TYPE_CHECKING, Iterator, Optional
 
 from app.models.base_models import APIChatMessage, TextGenerationSettings
 from app.models.completion_models import (
@@ -17,7 +17,9 @@ from app.utils.chat.build_llama_shared_lib import build_shared_lib
 from app.utils.logger import ApiLogger
 
 from . import BaseCompletionGenerator
+from .logit_bias import make_logit_bias_processor
 from .path import resolve_model_path_to_posix
+from .session_cache import LlamaSessionCache
 
 logger = ApiLogger("||🦙 llama_cpp.generator||")
 
@@ -43,38 +45,62 @@ if TYPE_CHECKING:
     from app.models.llms import LlamaCppModel
 
 
-def _make_logit_bias_processor(
-    llama: llama_cpp.Llama,
-    logit_bias: dict[str, float],
-    logit_bias_type: Optional[Literal["input_ids", "tokens"]],
-):
-    """Create a logit bias processor that can be used to bias the logit scores of the model."""
-    if logit_bias_type is None:
-        logit_bias_type = "input_ids"
+# llama-cpp-python tokenizes the prompt with a leading space
+def _tokenize_prompt(client: llama_cpp.Llama, prompt: str) -> list[int]:
+    return client.tokenize(b" " + prompt.encode("utf-8"))
 
-    to_bias: dict[int, float] = {}
-    if logit_bias_type == "input_ids":
-        for input_id_string, score in logit_bias.items():
-            to_bias[int(input_id_string)] = score
 
-    elif logit_bias_type == "tokens":
-        for token, score in logit_bias.items():
-            for input_id in llama.tokenize(
-                token.encode("utf-8"), add_bos=False
-            ):
-                to_bias[input_id] = score
+def _get_evaluated_ids(client: llama_cpp.Llama) -> list[int]:
+    input_ids = getattr(client, "_input_ids", None)
+    if input_ids is None:
+        input_ids = getattr(client, "eval_tokens", ())
+    return list(input_ids)
 
-    def logit_bias_processor(
-        input_ids: list[int],
-        scores: list[float],
-    ) -> list[float]:
-        new_scores: list[float] = [0.0] * len(scores)
-        for input_id, score in enumerate(scores):
-            new_scores[input_id] = score + to_bias.get(input_id, 0.0)
 
-        return new_scores
+def _load_session_state(
+    client: llama_cpp.Llama,
+    session_cache: Optional[LlamaSessionCache],
+    prompt: str,
+    settings: TextGenerationSettings,
+) -> None:
+    if session_cache is None:
+        return
+    state = session_cache.load(
+        _tokenize_prompt(client, prompt),
+        session_id=settings.session_id,
+        evaluated_ids=_get_evaluated_ids(client),
+    )
+    if state is not None:
+        client.load_state(state)
 
-    return logit_bias_processor
+
+def _save_session_state(
+    client: llama_cpp.Llama,
+    session_cache: Optional[LlamaSessionCache],
+    settings: TextGenerationSettings,
+) -> None:
+    if session_cache is None:
+        return
+    session_cache.save(
+        _get_evaluated_ids(client),
+        client.save_state(),
+        session_id=settings.session_id,
+    )
+    logger.info(
+        f"🦙 Session cache: {len(session_cache.cache_state)} sessions, "
+        f"hit rate {session_cache.hit_rate:.2%}, "
+        f"{session_cache.saved_tokens} tokens saved"
+    )
+
+
+def _save_session_state_after(
+    chunks: Iterator[CompletionChunk],
+    client: llama_cpp.Llama,
+    session_cache: Optional[LlamaSessionCache],
+    settings: TextGenerationSettings,
+) -> Iterator[CompletionChunk]:
+    yield from chunks
+    _save_session_state(client, session_cache, settings)
 
 
 def _create_completion(
@@ -82,8 +108,10 @@ def _create_completion(
     prompt: str,
     stream: bool,
     settings: TextGenerationSettings,
+    session_cache: Optional[LlamaSessionCache] = None,
 ) -> Completion | Iterator[CompletionChunk]:
-    return client.create_completion(  # type: ignore
+    _load_session_state(client, session_cache, prompt, settings)
+    completion_or_chunks = client.create_completion(  # type: ignore
         stream=stream,
         prompt=prompt,
         max_tokens=settings.max_tokens,
@@ -101,7 +129,7 @@ def _create_completion(
         mirostat_eta=settings.mirostat_eta,
         logits_processor=llama_cpp.LogitsProcessorList(  # type: ignore
             [
-                _make_logit_bias_processor(
+                make_logit_bias_processor(
                     client,
                     settings.logit_bias,
                     settings.logit_bias_type,
@@ -112,6 +140,12 @@ def _create_completion(
         else None,
         stop=settings.stop,
     )
+    if stream:
+        return _save_session_state_after(
+            completion_or_chunks, client, session_cache, settings  # type: ignore
+        )
+    _save_session_state(client, session_cache, settings)
+    return completion_or_chunks  # type: ignore
 
 
 def _create_chat_completion(
@@ -119,10 +153,12 @@ def _create_chat_completion(
     messages: list[APIChatMessage],
     stream: bool,
     settings: TextGenerationSettings,
+    session_cache: Optional[LlamaSessionCache] = None,
 ) -> ChatCompletion | Iterator[ChatCompletionChunk]:
     prompt: str = LlamaCppCompletionGenerator.convert_messages_into_prompt(
         messages, settings=settings
     )
+    _load_session_state(client, session_cache, prompt, settings)
     completion_or_chunks = client(
         prompt=prompt,
         temperature=settings.temperature,
@@ -139,7 +175,7 @@ def _create_chat_completion(
         mirostat_eta=settings.mirostat_eta,
         logits_processor=llama_cpp.LogitsProcessorList(  # type: ignore
             [
-                _make_logit_bias_processor(
+                make_logit_bias_processor(
                     client,
                     settings.logit_bias,
                     settings.logit_bias_type,
@@ -151,9 +187,12 @@ def _create_chat_completion(
         stop=settings.stop,
     )
     if stream:
-        chunks: Iterator[CompletionChunk] = completion_or_chunks  # type: ignore
+        chunks: Iterator[CompletionChunk] = _save_session_state_after(
+            completion_or_chunks, client, session_cache, settings  # type: ignore
+        )
         return client._convert_text_completion_chunks_to_chat(chunks)  # type: ignore
     else:
+        _save_session_state(client, session_cache, settings)
         completion: Completion = completion_or_chunks  # type: ignore
         return client._convert_text_completion_to_chat(completion)  # type: ignore
 
@@ -161,6 +200,7 @@ def _create_chat_completion(
 class LlamaCppCompletionGenerator(BaseCompletionGenerator):
     generator: Optional[Iterator[CompletionChunk | ChatCompletionChunk]] = None
     client: Optional[llama_cpp.Llama] = None
+    session_cache: Optional[LlamaSessionCache] = None
     _llm_model: Optional["LlamaCppModel"] = None
 
     def __del__(self) -> None:
@@ -222,6 +262,7 @@ class LlamaCppCompletionGenerator(BaseCompletionGenerator):
             verbose=llm_model.echo,
             **additional_kwargs,
         )
+        session_cache: Optional[LlamaSessionCache] = None
         if llm_model.cache:
             cache_type = llm_model.cache_type
             if cache_type is None:
@@ -237,15 +278,24 @@ class LlamaCppCompletionGenerator(BaseCompletionGenerator):
                         f"🦙 Using disk cache with size {cache_size}",
                     )
                 cache = llama_cpp.LlamaDiskCache(capacity_bytes=cache_size)
+            elif cache_type == "session":
+                if llm_model.echo:
+                    logger.info(
+                        f"🦙 Using session cache with size {cache_size}",
+                    )
+                cache = None
+                session_cache = LlamaSessionCache(capacity_bytes=cache_size)
             else:
                 if llm_model.echo:
                     logger.info(
                         f"🦙 Using ram cache with size {cache_size}",
                     )
                 cache = llama_cpp.LlamaRAMCache(capacity_bytes=cache_size)
-            client.set_cache(cache)
+            if cache is not None:
+                client.set_cache(cache)
         self = cls()
         self.client = client
+        self.session_cache = session_cache
         self._llm_model = llm_model
         return self
 
@@ -256,7 +306,11 @@ class LlamaCppCompletionGenerator(BaseCompletionGenerator):
     ) -> Completion:
         assert self.client is not None
         completion = _create_completion(
-            client=self.client, prompt=prompt, stream=False, settings=settings
+            client=self.client,
+            prompt=prompt,
+            stream=False,
+            settings=settings,
+            session_cache=self.session_cache,
         )
         assert not isinstance(completion, Iterator)
         return completion
@@ -268,7 +322,11 @@ class LlamaCppCompletionGenerator(BaseCompletionGenerator):
     ) -> Iterator[CompletionChunk]:
         assert self.client is not None
         completion_chunk_generator = _create_completion(
-            client=self.client, prompt=prompt, stream=True, settings=settings
+            client=self.client,
+            prompt=prompt,
+            stream=True,
+            settings=settings,
+            session_cache=self.session_cache,
         )
         assert isinstance(completion_chunk_generator, Iterator)
         self.generator = completion_chunk_generator
@@ -283,6 +341,7 @@ class LlamaCppCompletionGenerator(BaseCompletionGenerator):
             messages=messages,
             stream=False,
             settings=settings,
+            session_cache=self.session_cache,
         )
         assert not isinstance(chat_completion, Iterator)
         return chat_completion
@@ -296,6 +355,7 @@ class LlamaCppCompletionGenerator(BaseCompletionGenerator):
             messages=messages,
             stream=True,
             settings=settings,
+            session_cache=self.session_cache,
         )
         assert isinstance(chat_completion_chunk_generator, Iterator)
         self.generator = chat_completion_chunk_generator
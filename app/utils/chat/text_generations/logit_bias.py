@@ -0,0 +1,75 @@
+"""Logit bias processors for llama.cpp, which don't depend on llama.cpp itself."""
+
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Literal, Optional
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from llama_cpp import Llama
+
+
+_TOKENS_BIAS_CACHE_SIZE: int = 128
+_tokens_bias_cache: OrderedDict[
+    tuple[str, frozenset[tuple[str, float]]], dict[int, float]
+] = OrderedDict()
+
+
+def _tokenize_logit_bias(
+    llama: "Llama", logit_bias: dict[str, float]
+) -> dict[int, float]:
+    """Tokenize the `tokens` mode logit bias. Cached per (model, bias map)."""
+    key = (str(llama.model_path), frozenset(logit_bias.items()))
+    if key in _tokens_bias_cache:
+        _tokens_bias_cache.move_to_end(key)
+        return _tokens_bias_cache[key]
+
+    to_bias: dict[int, float] = {}
+    for token, score in logit_bias.items():
+        for input_id in llama.tokenize(token.encode("utf-8"), add_bos=False):
+            to_bias[input_id] = score
+    _tokens_bias_cache[key] = to_bias
+    if len(_tokens_bias_cache) > _TOKENS_BIAS_CACHE_SIZE:
+        _tokens_bias_cache.popitem(last=False)
+    return to_bias
+
+
+def make_logit_bias_processor(
+    llama: "Llama",
+    logit_bias: dict[str, float],
+    logit_bias_type: Optional[Literal["input_ids", "tokens"]],
+):
+    """Create a logit bias processor that can be used to bias the logit scores of the model.
+    The bias is precomputed into sparse index and value arrays, which are added to the scores in place.
+    """
+    if logit_bias_type is None:
+        logit_bias_type = "input_ids"
+
+    to_bias: dict[int, float] = {}
+    if logit_bias_type == "input_ids":
+        for input_id_string, score in logit_bias.items():
+            to_bias[int(input_id_string)] = score
+
+    elif logit_bias_type == "tokens":
+        to_bias = _tokenize_logit_bias(llama, logit_bias)
+
+    bias_indices = np.fromiter(
+        to_bias.keys(), dtype=np.intc, count=len(to_bias)
+    )
+    bias_values = np.fromiter(
+        to_bias.values(), dtype=np.single, count=len(to_bias)
+    )
+
+    def logit_bias_processor(
+        input_ids: list[int],
+        scores: "list[float] | np.ndarray",
+    ) -> "list[float] | np.ndarray":
+        if isinstance(scores, np.ndarray):
+            scores[bias_indices] += bias_values
+            return scores
+        # Older llama-cpp-python passes the scores as a list
+        new_scores = np.array(scores, dtype=np.single)
+        new_scores[bias_indices] += bias_values
+        return new_scores.tolist()
+
+    return logit_bias_processor
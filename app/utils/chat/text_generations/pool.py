@@ -0,0 +1,235 @@
+"""A pool of generators for the local completion server.
+Several models are kept resident under a memory budget, instead of unloading
+the previous model every time another model is requested."""
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from logging import INFO, getLogger
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Generic,
+    Iterable,
+    Literal,
+    Optional,
+    TypeVar,
+)
+
+from app.utils.system import deallocate_memory, get_total_memory_usage
+
+if TYPE_CHECKING:
+    from logging import Logger
+
+T = TypeVar("T")
+
+
+class GeneratorPoolFullError(Exception):
+    """Raised when an item doesn't fit, because the resident items to evict are in use.
+    Should be returned as 503 Service Unavailable, to be retried later."""
+
+    def __init__(self, key: str, resident_keys: list[str]) -> None:
+        self.key = key
+        self.resident_keys = resident_keys
+        super().__init__(
+            f"Cannot load `{key}` now, as the models in use "
+            f"({resident_keys}) must be kept. Please try again later."
+        )
+
+
+@dataclass
+class _PoolEntry(Generic[T]):
+    item: T
+    memory_mb: float = 0.0
+    uses: int = 0
+
+
+@dataclass
+class PoolStats:
+    hits: int = 0
+    loads: int = 0
+    evictions: int = 0
+
+
+class GeneratorPool(Generic[T]):
+    """Keeps generators resident until the memory budget or the maximum number of items is exceeded.
+    The memory usage of each item is measured when it is loaded, using RAM + VRAM usage.
+
+    Eviction policy:
+    - `lru`: Evict the least recently used item first.
+    - `lfu`: Evict the least frequently used item first. Ties are broken by recency.
+    Pinned items, and items that `can_evict` refuses, are never evicted.
+    If an item would fit only by evicting items that `can_evict` refuses, it is not loaded,
+    and `GeneratorPoolFullError` is raised instead.
+
+    Without a memory budget, only one item is kept by default, as an unchecked second model may run out of memory."""
+
+    def __init__(
+        self,
+        memory_budget_mb: Optional[float] = None,
+        max_items: Optional[int] = None,
+        policy: Literal["lru", "lfu"] = "lru",
+        pinned: Iterable[str] = (),
+        can_evict: Callable[[str], bool] = lambda key: True,
+        memory_usage_getter: Callable[
+            [], Optional[float]
+        ] = get_total_memory_usage,
+        deallocator: Callable[[T], None] = deallocate_memory,
+        logger: Optional["Logger"] = None,
+    ) -> None:
+        if logger is None:
+            logger = getLogger(__name__)
+            logger.setLevel(INFO)
+        self.memory_budget_mb = memory_budget_mb
+        self.max_items = (
+            1 if max_items is None and memory_budget_mb is None else max_items
+        )
+        self.policy = policy
+        self.pinned: set[str] = set(pinned)
+        self.can_evict = can_evict
+        self.memory_usage_getter = memory_usage_getter
+        self.deallocator = deallocator
+        self.logger = logger
+        self.stats = PoolStats()
+        self._entries: OrderedDict[str, _PoolEntry[T]] = OrderedDict()
+        self._measured_memory_mb: dict[str, float] = {}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def keys(self) -> list[str]:
+        return list(self._entries.keys())
+
+    @property
+    def used_memory_mb(self) -> float:
+        return sum(entry.memory_mb for entry in self._entries.values())
+
+    def pin(self, key: str) -> None:
+        self.pinned.add(key)
+
+    def unpin(self, key: str) -> None:
+        self.pinned.discard(key)
+
+    def get(self, key: str) -> Optional[T]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        entry.uses += 1
+        self._entries.move_to_end(key)
+        self.stats.hits += 1
+        return entry.item
+
+    def get_or_load(
+        self,
+        key: str,
+        loader: Callable[[], T],
+        estimated_memory_mb: float = 0.0,
+    ) -> T:
+        """Get the item of the key, or load it with the loader.
+        Before loading, evict items to make room for `estimated_memory_mb`,
+        or for the measured size if the item has been loaded before."""
+        item = self.get(key)
+        if item is not None:
+            return item
+
+        required_mb: float = max(
+            estimated_memory_mb, self._measured_memory_mb.get(key, 0.0)
+        )
+        if self._is_over_budget(
+            required_mb=required_mb,
+            adding=1,
+            evicting=self._candidates(exclude=key),
+        ) and not self._is_over_budget(
+            required_mb=required_mb,
+            adding=1,
+            evicting=self._candidates(exclude=key, check_in_use=False),
+        ):
+            # Wait for the items in use, instead of loading past the budget
+            raise GeneratorPoolFullError(key, self.keys())
+        self._evict_until_fits(required_mb=required_mb, exclude=key)
+        mem_usage_before: Optional[float] = self.memory_usage_getter()
+        item = loader()
+        mem_usage_after: Optional[float] = self.memory_usage_getter()
+        if mem_usage_before is not None and mem_usage_after is not None:
+            memory_mb = max(mem_usage_after - mem_usage_before, 0.0)
+        else:
+            memory_mb = estimated_memory_mb
+        self._measured_memory_mb[key] = memory_mb
+        self._entries[key] = _PoolEntry(item=item, memory_mb=memory_mb, uses=1)
+        self.stats.loads += 1
+        self.logger.info(
+            f"Loaded `{key}` into the pool ({memory_mb:.0f} MB). "
+            f"Resident: {self.keys()} ({self.used_memory_mb:.0f} MB)"
+        )
+
+        # The measured size may be bigger than estimated
+        self._evict_until_fits(required_mb=0.0, exclude=key)
+        return item
+
+    def evict(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.stats.evictions += 1
+        self.logger.info(
+            f"Evicting `{key}` from the pool ({entry.memory_mb:.0f} MB)"
+        )
+        item = entry.item
+        del entry
+        self.deallocator(item)
+
+    def clear(self) -> None:
+        for key in self.keys():
+            self.evict(key)
+
+    def _is_over_budget(
+        self, required_mb: float, adding: int, evicting: Iterable[str] = ()
+    ) -> bool:
+        evicting = list(evicting)
+        if (
+            self.max_items is not None
+            and len(self._entries) + adding - len(evicting) > self.max_items
+        ):
+            return True
+        if (
+            self.memory_budget_mb is not None
+            and self.used_memory_mb
+            - sum(self._entries[key].memory_mb for key in evicting)
+            + required_mb
+            > self.memory_budget_mb
+        ):
+            return True
+        return False
+
+    def _candidates(
+        self, exclude: str, check_in_use: bool = True
+    ) -> list[str]:
+        return [
+            key
+            for key in self._entries  # from least recently used
+            if key != exclude
+            and key not in self.pinned
+            and (not check_in_use or self.can_evict(key))
+        ]
+
+    def _select_victim(self, exclude: str) -> Optional[str]:
+        candidates: list[str] = self._candidates(exclude=exclude)
+        if not candidates:
+            return None
+        if self.policy == "lfu":
+            return min(candidates, key=lambda key: self._entries[key].uses)
+        return candidates[0]
+
+    def _evict_until_fits(self, required_mb: float, exclude: str) -> None:
+        adding: int = 0 if exclude in self._entries else 1
+        while self._is_over_budget(required_mb=required_mb, adding=adding):
+            victim: Optional[str] = self._select_victim(exclude=exclude)
+            if victim is None:
+                self.logger.warning(
+                    "Generator pool is over budget, "
+                    "but every resident item is pinned or in use."
+                )
+                return
+            self.evict(victim)
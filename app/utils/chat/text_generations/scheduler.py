@@ -0,0 +1,155 @@
+"""A request scheduler for the local completion server.
+Requests are queued per lane, e.g. one lane for text generation and another for embeddings,
+so that a long generation does not block cheap embedding requests."""
+
+from asyncio import CancelledError, Future, get_running_loop
+from contextlib import asynccontextmanager
+from dataclasses import asdict, dataclass
+from heapq import heappop, heappush
+from itertools import count
+from time import perf_counter
+from typing import AsyncIterator, Optional
+
+
+class SchedulerQueueFullError(Exception):
+    """Raised when the queue of a lane is full. Should be returned as 429 Too Many Requests."""
+
+    def __init__(self, lane_name: str, max_queue_size: int) -> None:
+        self.lane_name = lane_name
+        self.max_queue_size = max_queue_size
+        super().__init__(
+            f"Too many requests are waiting for `{lane_name}` "
+            f"(max queue size: {max_queue_size}). Please try again later."
+        )
+
+
+@dataclass
+class LaneMetrics:
+    concurrency: int
+    max_queue_size: int
+    running: int = 0
+    queued: int = 0
+    completed: int = 0
+    rejected: int = 0
+    total_wait_time: float = 0.0
+    max_wait_time: float = 0.0
+
+    @property
+    def average_wait_time(self) -> float:
+        return self.total_wait_time / self.completed if self.completed else 0.0
+
+    def to_dict(self) -> dict[str, float]:
+        return asdict(self) | {"average_wait_time": self.average_wait_time}
+
+
+class _Lane:
+    """A priority queue of requests, running at most `concurrency` requests at once.
+    Requests of the same priority are served in FIFO order. Lower priority value comes first."""
+
+    def __init__(self, name: str, concurrency: int, max_queue_size: int) -> None:
+        self.name = name
+        self.metrics = LaneMetrics(
+            concurrency=max(concurrency, 1), max_queue_size=max_queue_size
+        )
+        self._waiters: list[tuple[int, int, Future]] = []
+        self._counter = count()
+
+    @property
+    def is_busy(self) -> bool:
+        return self.metrics.running > 0
+
+    async def enter(self, priority: int) -> None:
+        metrics = self.metrics
+        if metrics.running < metrics.concurrency and not self._waiters:
+            metrics.running += 1
+            return
+        if metrics.queued >= metrics.max_queue_size:
+            metrics.rejected += 1
+            raise SchedulerQueueFullError(self.name, metrics.max_queue_size)
+
+        future: Future = get_running_loop().create_future()
+        heappush(self._waiters, (priority, next(self._counter), future))
+        metrics.queued += 1
+        try:
+            await future
+        except CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was already handed over, so give it to the next one.
+                self.leave()
+            else:
+                metrics.queued -= 1
+            raise
+
+    def leave(self) -> None:
+        # Hand over the slot to the next waiter, if any.
+        while self._waiters:
+            _, _, future = heappop(self._waiters)
+            if not future.done():
+                self.metrics.queued -= 1
+                future.set_result(None)
+                return
+        self.metrics.running -= 1
+
+
+class RequestScheduler:
+    """Schedules requests into lanes, each with its own concurrency and queue size limit.
+    A lane named like `completion:llama_7b` falls back to the concurrency of `completion`.
+
+    Usage:
+    >>> scheduler = RequestScheduler(concurrency={"completion": 1, "embedding": 2})
+    >>> async with scheduler.acquire("completion"):
+    >>>     ...
+    """
+
+    def __init__(
+        self,
+        concurrency: Optional[dict[str, int]] = None,
+        default_concurrency: int = 1,
+        max_queue_size: int = 32,
+    ) -> None:
+        self.concurrency: dict[str, int] = concurrency or {}
+        self.default_concurrency = default_concurrency
+        self.max_queue_size = max_queue_size
+        self._lanes: dict[str, _Lane] = {}
+
+    def lane(self, lane_name: str) -> _Lane:
+        if lane_name not in self._lanes:
+            self._lanes[lane_name] = _Lane(
+                name=lane_name,
+                concurrency=self.concurrency.get(
+                    lane_name,
+                    self.concurrency.get(
+                        lane_name.split(":", 1)[0], self.default_concurrency
+                    ),
+                ),
+                max_queue_size=self.max_queue_size,
+            )
+        return self._lanes[lane_name]
+
+    def is_busy(self, lane_name: str) -> bool:
+        return lane_name in self._lanes and self._lanes[lane_name].is_busy
+
+    @asynccontextmanager
+    async def acquire(
+        self, lane_name: str, priority: int = 0
+    ) -> AsyncIterator[float]:
+        """Wait for a slot of the lane, and yield the seconds waited.
+        Raises `SchedulerQueueFullError` if the queue of the lane is full."""
+        lane = self.lane(lane_name)
+        started_at: float = perf_counter()
+        await lane.enter(priority)
+        wait_time: float = perf_counter() - started_at
+        lane.metrics.total_wait_time += wait_time
+        lane.metrics.max_wait_time = max(lane.metrics.max_wait_time, wait_time)
+        try:
+            yield wait_time
+        finally:
+            lane.metrics.completed += 1
+            lane.leave()
+
+    @property
+    def metrics(self) -> dict[str, dict[str, float]]:
+        return {
+            lane_name: lane.metrics.to_dict()
+            for lane_name, lane in self._lanes.items()
+        }
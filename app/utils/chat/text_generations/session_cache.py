@@ -0,0 +1,100 @@
+"""A llama state cache keyed by session, which doesn't depend on llama.cpp itself."""
+
+from collections import OrderedDict
+from typing import Any, Optional, Sequence
+
+
+def _longest_token_prefix(a: Sequence[int], b: Sequence[int]) -> int:
+    length = 0
+    for _a, _b in zip(a, b):
+        if _a != _b:
+            break
+        length += 1
+    return length
+
+
+class LlamaSessionCache:
+    """A llama state cache which keeps one state per session, e.g. per user and chat room.
+    The follow-up turn of a session reuses its previous state, so that only the new suffix tokens
+    are evaluated. Sessions are evicted in LRU order when the total state size exceeds the capacity.
+    Requests without a session fall back to the longest prefix among all sessions.
+
+    The session id is passed with each call, as requests to the same model share the cache.
+    A state is anything with a `llama_state_size` attribute, e.g. `LlamaState`."""
+
+    def __init__(self, capacity_bytes: int = (2 << 30)) -> None:
+        self.capacity_bytes = capacity_bytes
+        self.hits: int = 0
+        self.misses: int = 0
+        self.saved_tokens: int = 0
+        self.cache_state: OrderedDict[
+            str, tuple[tuple[int, ...], Any]
+        ] = OrderedDict()
+
+    @property
+    def cache_size(self) -> int:
+        return sum(
+            state.llama_state_size for _, state in self.cache_state.values()
+        )
+
+    @property
+    def hit_rate(self) -> float:
+        total: int = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def _find_session(
+        self, input_ids: Sequence[int], session_id: Optional[str]
+    ) -> tuple[Optional[str], int]:
+        """Find the session whose state shares the longest prefix with the input ids,
+        preferring the given session."""
+        if session_id in self.cache_state:
+            prefix_len = _longest_token_prefix(
+                self.cache_state[session_id][0], input_ids
+            )
+            if prefix_len > 0:
+                return session_id, prefix_len
+        best_session_id: Optional[str] = None
+        best_prefix_len: int = 0
+        for other_session_id, (other_input_ids, _) in self.cache_state.items():
+            prefix_len = _longest_token_prefix(other_input_ids, input_ids)
+            if prefix_len > best_prefix_len:
+                best_session_id, best_prefix_len = other_session_id, prefix_len
+        return best_session_id, best_prefix_len
+
+    def load(
+        self,
+        input_ids: Sequence[int],
+        session_id: Optional[str] = None,
+        evaluated_ids: Sequence[int] = (),
+    ) -> Optional[Any]:
+        """Get the state to load before evaluating the input ids.
+        Returns None if no state shares a longer prefix than the tokens already evaluated by the model.
+        The returned state must be loaded, as it is counted as a hit."""
+        found_session_id, prefix_len = self._find_session(
+            input_ids, session_id=session_id
+        )
+        if found_session_id is None or prefix_len <= _longest_token_prefix(
+            evaluated_ids, input_ids
+        ):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.saved_tokens += prefix_len
+        self.cache_state.move_to_end(found_session_id)
+        return self.cache_state[found_session_id][1]
+
+    def save(
+        self,
+        input_ids: Sequence[int],
+        state: Any,
+        session_id: Optional[str] = None,
+    ) -> None:
+        """Save the state after evaluating the input ids, as the latest state of the session."""
+        if session_id is None:
+            session_id = f"anonymous:{hash(tuple(input_ids))}"
+        self.cache_state[session_id] = (tuple(input_ids), state)
+        self.cache_state.move_to_end(session_id)
+        while (
+            self.cache_size > self.capacity_bytes and len(self.cache_state) > 1
+        ):
+            self.cache_state.popitem(last=False)
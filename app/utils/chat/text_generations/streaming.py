@@ -0,0 +1,133 @@
+"""Helpers for streaming text out of generated tokens.
+Both helpers do a constant amount of work per token, regardless of the length of the output."""
+
+from collections import deque
+from typing import Callable, Sequence
+
+REPLACEMENT_CHAR: str = "�"  # Decoded from an incomplete multibyte character
+
+
+class IncrementalDetokenizer:
+    """Decodes tokens one by one, only decoding a small trailing window of tokens.
+    The window gives the tokenizer enough context for leading spaces and multibyte characters,
+    so that the concatenated outputs are the same as decoding all tokens at once."""
+
+    def __init__(
+        self,
+        decode: Callable[[list[int]], str],
+        prefix_ids: Sequence[int] = (),
+    ) -> None:
+        self.decode = decode
+        self.token_ids: list[int] = list(prefix_ids)
+        self._prefix_offset: int = 0  # Start of the window
+        self._read_offset: int = len(
+            self.token_ids
+        )  # Tokens before this are already emitted
+        self._prefix_text: str = (
+            decode(self.token_ids) if self.token_ids else ""
+        )
+
+    def push(self, token_id: int) -> str:
+        """Add a token, and return the newly decoded text.
+        Returns an empty string while a multibyte character is incomplete."""
+        self.token_ids.append(token_id)
+        text: str = self.decode(self.token_ids[self._prefix_offset :])
+        if len(text) <= len(self._prefix_text) or text.endswith(
+            REPLACEMENT_CHAR
+        ):
+            return ""
+        new_text: str = text[len(self._prefix_text) :]
+        self._prefix_offset = self._read_offset
+        self._read_offset = len(self.token_ids)
+        self._prefix_text = self.decode(
+            self.token_ids[self._prefix_offset : self._read_offset]
+        )
+        return new_text
+
+    def flush(self) -> str:
+        """Return the text of the remaining tokens, even if it is incomplete."""
+        text: str = self.decode(self.token_ids[self._prefix_offset :])
+        new_text: str = text[len(self._prefix_text) :]
+        self._prefix_offset = self._read_offset = len(self.token_ids)
+        self._prefix_text = ""
+        return new_text
+
+
+class StopStringMatcher:
+    """Finds stop strings in streamed text with an Aho-Corasick automaton.
+    Text which could be the beginning of a stop string is held back until it is decided.
+
+    Usage:
+    >>> matcher = StopStringMatcher(["### User:"])
+    >>> matcher.push("Hello ##")
+    ('Hello ', False)
+    >>> matcher.push("# User: Hi")
+    ('', True)
+    """
+
+    def __init__(self, stops: Sequence[str]) -> None:
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._depth: list[int] = [0]
+        self._match_length: list[int] = [0]  # Length of the longest stop ending here
+        for stop in stops:
+            if stop:
+                self._add(stop)
+        self._build()
+        self._state: int = 0
+        self._held: str = ""
+
+    def _add(self, stop: str) -> None:
+        node: int = 0
+        for char in stop:
+            if char not in self._goto[node]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._depth.append(self._depth[node] + 1)
+                self._match_length.append(0)
+                self._goto[node][char] = len(self._goto) - 1
+            node = self._goto[node][char]
+        self._match_length[node] = max(self._match_length[node], len(stop))
+
+    def _build(self) -> None:
+        queue: deque[int] = deque(self._goto[0].values())
+        while queue:
+            node: int = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail: int = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                if self._fail[child] == child:
+                    self._fail[child] = 0
+                self._match_length[child] = max(
+                    self._match_length[child],
+                    self._match_length[self._fail[child]],
+                )
+
+    def push(self, text: str) -> tuple[str, bool]:
+        """Feed text, and return the text which is safe to emit, and whether a stop string is found.
+        When found, the returned text ends right before the stop string."""
+        text = self._held + text
+        offset: int = len(self._held)
+        goto, fail = self._goto, self._fail
+        state: int = self._state
+        for idx in range(offset, len(text)):
+            char: str = text[idx]
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if self._match_length[state]:
+                self._state, self._held = 0, ""
+                return text[: idx + 1 - self._match_length[state]], True
+        self._state = state
+        # The last `depth` characters could be the beginning of a stop string
+        depth: int = self._depth[state]
+        self._held = text[len(text) - depth :] if depth else ""
+        return text[: len(text) - depth], False
+
+    def flush(self) -> str:
+        """Return the held text at the end of the stream."""
+        held, self._held, self._state = self._held, "", 0
+        return held
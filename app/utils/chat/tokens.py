@@ -1,14 +1,33 @@
 from bisect import bisect_left
+from heapq import merge
 from typing import TYPE_CHECKING, Optional, Union
 
 from langchain import PromptTemplate
 
 from app.common.config import ChatConfig
-from app.models.chat_models import ChatRoles, MessageHistory, UserChatContext
+from app.models.chat_models import (
+    ChatRoles,
+    MessageHistory,
+    MessageHistoryList,
+    UserChatContext,
+)
 
 if TYPE_CHECKING:
     from app.models.llms import LLMModel
 
+# Tags of the message histories, used when splitting merged messages by role.
+_USER, _AI, _SYSTEM = range(3)
+
+
+def _tokens_of_last(message_histories: list[MessageHistory], n: int) -> int:
+    """Get the total tokens of the last n messages, using prefix sums if available.
+    Like `message_histories[-n:]`, n of 0 means all messages."""
+    if isinstance(message_histories, MessageHistoryList):
+        return message_histories.tokens_of_last(
+            n if n > 0 else len(message_histories)
+        )
+    return sum(m.tokens for m in message_histories[-n:])
+
 
 def get_token_limit_with_n_messages(
     user_chat_context: UserChatContext,
@@ -24,14 +43,13 @@ def get_token_limit_with_n_messages(
     This is used to determine if the LLM model has enough tokens to generate a response.
     """
     llm_model: LLMModel = user_chat_context.llm_model.value
-    users: list[MessageHistory] = user_chat_context.user_message_histories
-    ais: list[MessageHistory] = user_chat_context.ai_message_histories
-    syss: list[MessageHistory] = user_chat_context.system_message_histories
 
     return llm_model.max_total_tokens - (
-        sum([m.tokens for m in users[-min(n_user_messages, len(users)) :]])
-        + sum([m.tokens for m in ais[-min(n_ai_messages, len(ais)) :]])
-        + sum([m.tokens for m in syss[-min(n_system_messages, len(syss)) :]])
+        _tokens_of_last(user_chat_context.user_message_histories, n_user_messages)
+        + _tokens_of_last(user_chat_context.ai_message_histories, n_ai_messages)
+        + _tokens_of_last(
+            user_chat_context.system_message_histories, n_system_messages
+        )
         + prefix_prompt_tokens
         + suffix_prompt_tokens
         + llm_model.token_margin
@@ -138,54 +156,49 @@ def cutoff_message_histories(
         if suffix_message
         else token_limit
     )
-    print(f"- DEBUG: remaining_tokens: {remaining_tokens}", flush=True)
 
     # If the remaining tokens are negative, return an empty tuple.
     if remaining_tokens < 0:
         return ([], [], [])
 
-    # Sort all messages by timestamp and filter out the prefix and suffix messages.
-    messages_without_prefix_and_suffix: list[MessageHistory] = sorted(
-        user_message_histories
-        + ai_message_histories
-        + [m for m in system_message_histories if not m.is_prefix and not m.is_suffix],
-        key=lambda m: m.timestamp,
-    )
-
-    # If the total tokens of all messages are less than or equal to the remaining tokens, return the input as it is.
-    if sum(m.tokens for m in messages_without_prefix_and_suffix) <= remaining_tokens:
-        _system_message_histories = [
-            m
-            for m in messages_without_prefix_and_suffix
-            if m in system_message_histories
-        ]
-        if prefix_message:
-            _system_message_histories.insert(0, prefix_message)
-        if suffix_message:
-            _system_message_histories.append(suffix_message)
-        return (
-            user_message_histories,
-            ai_message_histories,
-            _system_message_histories,
+    # Merge all messages by timestamp, tagged with the index of the list they belong to.
+    # Each history is appended in chronological order, so a linear merge is enough.
+    merged_messages: list[tuple[int, MessageHistory]] = list(
+        merge(
+            ((_USER, m) for m in user_message_histories),
+            ((_AI, m) for m in ai_message_histories),
+            (
+                (_SYSTEM, m)
+                for m in system_message_histories
+                if not m.is_prefix and not m.is_suffix
+            ),
+            key=lambda tagged: tagged[1].timestamp,
         )
+    )
 
     # Get the cumulative tokens of all messages.
-    all_tokens = [0]
-    for m in messages_without_prefix_and_suffix:
+    all_tokens: list[int] = [0]
+    for _, m in merged_messages:
         all_tokens.append(all_tokens[-1] + m.tokens)
 
-    # Find the index of the first message that fits the remaining tokens using binary search.
-    index = bisect_left(all_tokens, all_tokens[-1] - remaining_tokens)
-
-    # Slice the selected messages from the index to the end.
-    selected_messages: list[MessageHistory] = messages_without_prefix_and_suffix[index:]
-
-    # Separate selected messages by each type using list comprehensions.
-    user_messages = [m for m in selected_messages if m in user_message_histories]
-    ai_messages = [m for m in selected_messages if m in ai_message_histories]
+    # If the total tokens of all messages are less than or equal to the remaining tokens,
+    # return the input as it is. Otherwise, find the index of the first message
+    # that fits the remaining tokens using binary search.
+    if all_tokens[-1] <= remaining_tokens:
+        index: int = 0
+    else:
+        index = bisect_left(all_tokens, all_tokens[-1] - remaining_tokens)
+
+    # Separate selected messages by each type using the tags.
+    selected_messages: tuple[list[MessageHistory], ...] = ([], [], [])
+    for tag, m in merged_messages[index:]:
+        selected_messages[tag].append(m)
+    user_messages, ai_messages, system_messages = selected_messages
+    if index == 0:
+        user_messages = user_message_histories
+        ai_messages = ai_message_histories
 
     # Add prefix and suffix messages to the system message.
-    system_messages = [m for m in selected_messages if m in system_message_histories]
     if prefix_message:
         system_messages.insert(0, prefix_message)
     if suffix_message:
@@ -0,0 +1,154 @@
+"""Helpers for streaming out of blocking code, without blocking the event loop."""
+
+from asyncio import AbstractEventLoop, CancelledError, Future, get_running_loop
+from collections import deque
+from threading import Condition, Thread
+from typing import Any, Generic, Iterable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+def _set_result_unless_done(future: "Future[None]") -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class _Channel(Generic[T]):
+    """The state shared by the consumer and the producing thread.
+    The thread holds only the channel, not the `SyncToAsyncIterator`,
+    so that an abandoned iterator is garbage collected and stops the thread."""
+
+    def __init__(self, max_buffer_size: int, loop: AbstractEventLoop) -> None:
+        self.max_buffer_size = max_buffer_size
+        self.loop = loop
+        self.condition = Condition()
+        self.items: deque[T] = deque()  # Produced, guarded by the condition
+        self.waiter: Optional["Future[None]"] = None
+        self.exception: Optional[BaseException] = None
+        self.is_finished: bool = False
+        self.is_cancelled: bool = False
+
+    def cancel(self) -> None:
+        with self.condition:
+            self.is_cancelled = True
+            self.condition.notify_all()
+
+    def wake_up_consumer(self) -> None:
+        # Must be called with the condition acquired
+        waiter, self.waiter = self.waiter, None
+        if waiter is not None:
+            try:
+                self.loop.call_soon_threadsafe(_set_result_unless_done, waiter)
+            except RuntimeError:
+                pass  # The event loop is closed
+
+    def produce(self, iterator: Iterator[T]) -> None:
+        condition = self.condition
+        try:
+            for item in iterator:
+                with condition:
+                    while (
+                        len(self.items) >= self.max_buffer_size
+                        and not self.is_cancelled
+                    ):
+                        condition.wait()
+                    if self.is_cancelled:
+                        break
+                    self.items.append(item)
+                    self.wake_up_consumer()
+        except Exception as exception:
+            self.exception = exception
+        finally:
+            if self.is_cancelled:
+                close: Any = getattr(iterator, "close", None)
+                if close is not None:
+                    close()
+            with condition:
+                self.is_finished = True
+                self.wake_up_consumer()
+
+
+class SyncToAsyncIterator(Generic[T]):
+    """Iterates a blocking iterator on one dedicated thread, handing the items to the event loop.
+    - The thread wakes the event loop up with `call_soon_threadsafe` only when the consumer is waiting,
+    and every item produced until the consumer resumes is handed over in the same batch.
+    - The thread pauses when `max_buffer_size` items are not consumed yet.
+    - When the consumer stops, by `close`, cancellation or garbage collection,
+    the thread stops and closes the iterator, so that its `finally` runs in the thread.
+    - An exception raised by the iterator is raised to the consumer.
+
+    Usage:
+    >>> async for token in SyncToAsyncIterator(generate_tokens()):
+    ...     print(token)
+    """
+
+    def __init__(
+        self,
+        iterable: Iterable[T],
+        max_buffer_size: int = 256,
+        thread_name: Optional[str] = None,
+    ) -> None:
+        self.max_buffer_size = max_buffer_size
+        self.thread_name = thread_name
+        self._iterator: Iterator[T] = iter(iterable)
+        self._batch: deque[T] = deque()  # Taken by the consumer
+        self._channel: Optional[_Channel[T]] = None
+        self._is_cancelled: bool = False
+        self._thread: Optional[Thread] = None
+
+    def __aiter__(self) -> "SyncToAsyncIterator[T]":
+        return self
+
+    async def __anext__(self) -> T:
+        if self._batch:
+            return self._batch.popleft()
+        if self._channel is None:
+            if self._is_cancelled:
+                raise StopAsyncIteration
+            self._start()
+        channel = self._channel
+        assert channel is not None
+        while True:
+            with channel.condition:
+                if channel.items:
+                    if len(channel.items) >= channel.max_buffer_size:
+                        channel.condition.notify()
+                    self._batch, channel.items = channel.items, self._batch
+                    return self._batch.popleft()
+                if channel.is_finished:
+                    exception, channel.exception = channel.exception, None
+                    if exception is not None:
+                        raise exception
+                    raise StopAsyncIteration
+                channel.waiter = waiter = channel.loop.create_future()
+            try:
+                await waiter
+            except CancelledError:
+                self.close()
+                raise
+
+    def close(self) -> None:
+        """Stop the thread. The iterator is closed after the item being produced now."""
+        self._is_cancelled = True
+        if self._channel is not None:
+            self._channel.cancel()
+
+    async def aclose(self) -> None:
+        self.close()
+
+    def __del__(self) -> None:
+        if getattr(self, "_channel", None) is not None:
+            self.close()
+
+    def _start(self) -> None:
+        # The thread must not refer to `self`, or `self` is never collected
+        self._channel = channel = _Channel(
+            max_buffer_size=self.max_buffer_size, loop=get_running_loop()
+        )
+        self._thread = Thread(
+            target=channel.produce,
+            args=(self._iterator,),
+            name=self.thread_name,
+            daemon=True,
+        )
+        self._thread.start()
@@ -12,6 +12,8 @@ from app.models.base_models import (
     CreateCompletionRequest,
     CreateEmbeddingRequest,
 )
+from app.utils.chat.text_generations.pool import GeneratorPoolFullError
+from app.utils.chat.text_generations.scheduler import SchedulerQueueFullError
 from app.utils.logger import ApiLogger
 
 logger = ApiLogger(__name__)
@@ -100,6 +102,34 @@ class RouteErrorHandler(APIRoute):
         async def custom_route_handler(request: Request) -> Response:
             try:
                 return await original_route_handler(request)
+            except SchedulerQueueFullError as e:
+                logger.warning(f"Rejected a request: {e}")
+                return JSONResponse(
+                    {
+                        "error": {
+                            "message": str(e),
+                            "type": "server_overloaded",
+                            "param": None,
+                            "code": "queue_full",
+                        }
+                    },
+                    429,
+                    headers={"Retry-After": "1"},
+                )
+            except GeneratorPoolFullError as e:
+                logger.warning(f"Rejected a request: {e}")
+                return JSONResponse(
+                    {
+                        "error": {
+                            "message": str(e),
+                            "type": "server_overloaded",
+                            "param": None,
+                            "code": "models_in_use",
+                        }
+                    },
+                    503,
+                    headers={"Retry-After": "1"},
+                )
             except (OSError, MemoryError) as e:
                 logger.exception(f"Exception in llama-cpp: {e}")
                 if isinstance(e, MemoryError):
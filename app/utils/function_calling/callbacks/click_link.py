@@ -1,8 +1,12 @@
-from typing import Optional
+from asyncio import Semaphore, gather
+from contextlib import asynccontextmanager, nullcontext
+from typing import AsyncIterator, Optional
 from urllib.parse import urlparse
 
-from requests_html import HTML, AsyncHTMLSession
+from fastapi.concurrency import run_in_threadpool
+from requests_html import HTML, AsyncHTMLSession, HTMLResponse
 
+from app.common.config import ChatConfig
 from app.common.lotties import Lotties
 from app.models.base_models import ParserDefinitions
 from app.models.function_calling.functions import FunctionCalls
@@ -12,6 +16,7 @@ from app.utils.chat.managers.websocket import SendToWebsocket
 from app.utils.logger import ApiLogger
 
 from ..request import request_function_call
+from ..web_cache import WebCacheEntry, web_cache
 
 PARSER_DEFINITIONS = {
     "dcinside.com": ParserDefinitions(
@@ -25,6 +30,85 @@ BASE_FILTERING = (
 )
 
 
+class FetchLimiter:
+    """Limits the number of pages fetched at once, in total and per host."""
+
+    def __init__(
+        self,
+        max_fetches: int = ChatConfig.browsing_max_fetches,
+        max_fetches_per_host: int = ChatConfig.browsing_max_fetches_per_host,
+    ) -> None:
+        self.max_fetches_per_host = max_fetches_per_host
+        self._semaphore = Semaphore(max_fetches)
+        self._host_semaphores: dict[str, Semaphore] = {}
+
+    @asynccontextmanager
+    async def limit(self, url: str) -> AsyncIterator[None]:
+        host: str = urlparse(url).netloc
+        if host not in self._host_semaphores:
+            self._host_semaphores[host] = Semaphore(self.max_fetches_per_host)
+        async with self._host_semaphores[host], self._semaphore:
+            yield
+
+
+def _get_tld(url: str) -> str:
+    return ".".join(urlparse(url).netloc.split(".")[-2:])
+
+
+async def _render_html_if_required(
+    url: str,
+    html: HTML,
+    timeout_for_render: int = 10,
+    sleep_for_render: int = 0,
+) -> HTML:
+    parser_definition = PARSER_DEFINITIONS.get(_get_tld(url))
+    if parser_definition and parser_definition.render_js:
+        await html.arender(
+            timeout=timeout_for_render,
+            sleep=sleep_for_render,
+            keep_page=True,
+        )
+    return html
+
+
+def _extract_text_chunks(
+    url: str,
+    html: HTML,
+    tokens_per_chunk: int,
+    chunk_overlap: int,
+) -> list[str]:
+    """Extract text from html, and split it into chunks.
+    This is CPU-bound, so it should be run in a thread pool."""
+    parser_definition = PARSER_DEFINITIONS.get(_get_tld(url))
+    if not parser_definition or not parser_definition.selector:
+        if html.xpath("//article"):
+            selector = "//article"
+        else:
+            selector = "//body"
+    else:
+        selector = parser_definition.selector
+
+    contents = html.xpath(selector + "//text()" + BASE_FILTERING)
+    if isinstance(contents, list):
+        text = " ".join(
+            [
+                content.strip()
+                for content in contents
+                if isinstance(content, str) and content.strip()
+            ]
+        )
+    elif isinstance(contents, str):
+        text = contents.strip()
+    else:
+        text = contents.text.strip()
+
+    return Shared().token_text_splitter.split_text(
+        text,
+        tokens_per_chunk=tokens_per_chunk,
+        chunk_overlap=chunk_overlap,
+    )
+
+
 async def _parse_text_content(
     url: str,
     asession: AsyncHTMLSession,
@@ -32,46 +116,52 @@ async def _parse_text_content(
     chunk_overlap: int,
     timeout_for_render: int = 10,
     sleep_for_render: int = 0,
+    fetch_limiter: Optional[FetchLimiter] = None,
 ) -> list[str]:
+    """Get text chunks of the url. Chunks are cached, and a stale cache
+    is revalidated with ETag or Last-Modified if the server supports it."""
     try:
-        tld = ".".join(urlparse(url).netloc.split(".")[-2:])
-        html: HTML = (await asession.get(url, timeout=10)).html  # type: ignore
-
-        parser_definition = PARSER_DEFINITIONS.get(tld)
-        js_required = parser_definition and parser_definition.render_js
-        if js_required:
-            await html.arender(
-                timeout=timeout_for_render,
-                sleep=sleep_for_render,
-                keep_page=True,
-            )
-        if not parser_definition or not parser_definition.selector:
-            if html.xpath("//article"):
-                selector = "//article"
-            else:
-                selector = "//body"
-        else:
-            selector = parser_definition.selector
-
-        contents = html.xpath(selector + "//text()" + BASE_FILTERING)
-        if isinstance(contents, list):
-            text = " ".join(
-                [
-                    content.strip()
-                    for content in contents
-                    if isinstance(content, str) and content.strip()
-                ]
-            )
-        elif isinstance(contents, str):
-            text = contents.strip()
-        else:
-            text = contents.text.strip()
+        cache_key: str = web_cache.page_key(
+            url, tokens_per_chunk=tokens_per_chunk, chunk_overlap=chunk_overlap
+        )
+        cached: Optional[WebCacheEntry] = await web_cache.get(cache_key)
+        if cached is not None and web_cache.is_fresh(cached):
+            return cached.value
 
-        return Shared().token_text_splitter.split_text(
-            text,
+        async with (
+            fetch_limiter.limit(url)
+            if fetch_limiter is not None
+            else nullcontext()
+        ):
+            response: HTMLResponse = await asession.get(
+                url,
+                headers=cached.validators if cached is not None else None,
+                timeout=10,
+            )  # type: ignore
+            if cached is not None and response.status_code == 304:
+                await web_cache.revalidate(cache_key, cached)
+                return cached.value
+            html: HTML = await _render_html_if_required(
+                url,
+                html=response.html,
+                timeout_for_render=timeout_for_render,
+                sleep_for_render=sleep_for_render,
+            )
+        chunks: list[str] = await run_in_threadpool(
+            _extract_text_chunks,
+            url=url,
+            html=html,
             tokens_per_chunk=tokens_per_chunk,
             chunk_overlap=chunk_overlap,
         )
+        if chunks and response.ok:
+            await web_cache.set(
+                cache_key,
+                chunks,
+                etag=response.headers.get("ETag"),
+                last_modified=response.headers.get("Last-Modified"),
+            )
+        return chunks
 
     except Exception as e:
         ApiLogger("||_parse_text_content||").exception(e)
@@ -134,8 +224,12 @@ async def click_link_callback(
     asession: Optional[AsyncHTMLSession] = None,
     timeout: float | int = 10,
     maximum_scrolls: int = 10,
+    scoring_batch_size: int = ChatConfig.browsing_scoring_batch_size,
+    fetch_limiter: Optional[FetchLimiter] = None,
 ) -> list[tuple[str, int]]:
-    """Click link and get most relevant content and score"""
+    """Click link and get most relevant content and score.
+    Scrollable contents are scored `scoring_batch_size` at a time in parallel,
+    speculating that the previous contents were scrolled down."""
     if asession is None:
         asession = AsyncHTMLSession()
         temp_asession = True
@@ -163,66 +257,78 @@ async def click_link_callback(
             asession=asession,
             tokens_per_chunk=scrolling_chunk_size,
             chunk_overlap=scrolling_chunk_overlap,
+            fetch_limiter=fetch_limiter,
         )
         max_scroll_position: int = len(scrollable_contents)
-        for scroll_idx, scrollable_content in enumerate(
-            scrollable_contents[:maximum_scrolls]
-        ):
-            # Read the content and predict next action, and evaluate relevance score of the content
-            (
-                action,
-                relevance_score,
-            ) = await _get_controlling_page_and_relevance_score(
-                query=query,
-                link=link,
-                scroll_position=scroll_idx + 1,
-                max_scroll_position=max_scroll_position,
-                previous_actions=previous_actions,
-                scrollable_content=scrollable_content.strip(),
-                timeout=timeout,
+        n_scrolls: int = min(max_scroll_position, maximum_scrolls)
+        for batch_start in range(0, n_scrolls, max(scoring_batch_size, 1)):
+            # Read the contents and predict next actions, and evaluate relevance scores of the contents
+            batch_indices = range(
+                batch_start,
+                min(batch_start + max(scoring_batch_size, 1), n_scrolls),
             )
-            ApiLogger("||_click_link||").info(
-                (
-                    f"\n### Action: {action}\n\n"
-                    f"### Relevance Score: {relevance_score}\n\n"
-                    f"### scrollable_content: {scrollable_content}\n\n"
-                )
+            actions_and_scores = await gather(
+                *[
+                    _get_controlling_page_and_relevance_score(
+                        query=query,
+                        link=link,
+                        scroll_position=scroll_idx + 1,
+                        max_scroll_position=max_scroll_position,
+                        previous_actions=previous_actions
+                        + ["scroll_down"] * (scroll_idx - batch_start),
+                        scrollable_content=scrollable_contents[
+                            scroll_idx
+                        ].strip(),
+                        timeout=timeout,
+                    )
+                    for scroll_idx in batch_indices
+                ]
             )
-            if relevance_score is not None and (
-                not content_idx_and_score_list
-                or relevance_score >= content_idx_and_score_list[-1][1]
+            for scroll_idx, (action, relevance_score) in zip(
+                batch_indices, actions_and_scores
             ):
-                content_idx_and_score_list.append(
-                    (scroll_idx, relevance_score)
+                ApiLogger("||_click_link||").info(
+                    (
+                        f"\n### Action: {action}\n\n"
+                        f"### Relevance Score: {relevance_score}\n\n"
+                        f"### scrollable_content: {scrollable_contents[scroll_idx]}\n\n"
+                    )
                 )
-            if action == "scroll_down":
-                previous_actions.append("scroll_down")
-                await SendToWebsocket.message(
-                    websocket=buffer.websocket,
-                    msg=Lotties.SCROLL_DOWN.format("### Scrolling down"),
-                    chat_room_id=buffer.current_chat_room_id,
-                    finish=False,
-                )
-                continue
-            elif action == "go_back":
-                await SendToWebsocket.message(
-                    websocket=buffer.websocket,
-                    msg=Lotties.GO_BACK.format("### Going back"),
-                    chat_room_id=buffer.current_chat_room_id,
-                    finish=False,
-                )
-                return [
-                    (scrollable_contents[idx], score)
-                    for idx, score in content_idx_and_score_list
-                ]
-            elif action == "pick":
-                content_idx_and_score_list.append((scroll_idx, 10))
-                return [
-                    (scrollable_contents[idx], score)
-                    for idx, score in content_idx_and_score_list
-                ]
-            else:
-                continue
+                if relevance_score is not None and (
+                    not content_idx_and_score_list
+                    or relevance_score >= content_idx_and_score_list[-1][1]
+                ):
+                    content_idx_and_score_list.append(
+                        (scroll_idx, relevance_score)
+                    )
+                if action == "scroll_down":
+                    previous_actions.append("scroll_down")
+                    await SendToWebsocket.message(
+                        websocket=buffer.websocket,
+                        msg=Lotties.SCROLL_DOWN.format("### Scrolling down"),
+                        chat_room_id=buffer.current_chat_room_id,
+                        finish=False,
+                    )
+                    continue
+                elif action == "go_back":
+                    await SendToWebsocket.message(
+                        websocket=buffer.websocket,
+                        msg=Lotties.GO_BACK.format("### Going back"),
+                        chat_room_id=buffer.current_chat_room_id,
+                        finish=False,
+                    )
+                    return [
+                        (scrollable_contents[idx], score)
+                        for idx, score in content_idx_and_score_list
+                    ]
+                elif action == "pick":
+                    content_idx_and_score_list.append((scroll_idx, 10))
+                    return [
+                        (scrollable_contents[idx], score)
+                        for idx, score in content_idx_and_score_list
+                    ]
+                else:
+                    continue
 
         return [
             (scrollable_contents[idx], score)
@@ -1,9 +1,9 @@
+from asyncio import Task, as_completed, create_task
 from collections import deque
 from copy import deepcopy
 from re import Pattern, compile
 from typing import Optional, Sequence, Tuple, cast
 
-from fastapi.concurrency import run_in_threadpool
 from requests_html import AsyncHTMLSession
 
 from app.common.config import ChatConfig
@@ -16,7 +16,8 @@ from app.utils.chat.managers.websocket import SendToWebsocket
 from app.utils.logger import ApiLogger
 
 from ..request import request_function_call
-from .click_link import click_link_callback
+from ..web_cache import web_cache
+from .click_link import FetchLimiter, click_link_callback
 
 URL_PATTERN: Pattern = compile(
     r"http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+"
@@ -101,6 +102,8 @@ async def full_web_browsing_callback(
     collect_score_larger_than: int = 5,
     timeout: float | int = 10,
     maximum_scrolls: int = 20,
+    max_links_in_parallel: int = ChatConfig.browsing_max_links_in_parallel,
+    scoring_batch_size: int = ChatConfig.browsing_scoring_batch_size,
 ) -> Optional[str]:
     # Init variables
     relevant_content_and_scores: deque[Tuple[str, int]] = deque(
@@ -136,11 +139,16 @@ async def full_web_browsing_callback(
             return overall_snippets
 
     asession = AsyncHTMLSession()
+    fetch_limiter = FetchLimiter()
     try:
         # Get query to search, and perform web search
-        snippets_with_link: dict[str, str] = await run_in_threadpool(
-            Shared().duckduckgo.formatted_results_with_link,
-            query=query_to_search,
+        snippets_with_link: dict[str, str] = dict(
+            await web_cache.get_or_set(
+                web_cache.search_key(query_to_search, kind="links"),
+                lambda: Shared().duckduckgo.aformatted_results_with_link(
+                    query=query_to_search
+                ),
+            )
         )
         for link in user_provided_links:
             snippets_with_link[link] = (
@@ -168,51 +176,74 @@ async def full_web_browsing_callback(
                 # Prepare to click link, prevent infinite loop
                 if link_to_click is None or link_to_click in visited_links:
                     continue
-                if link_to_click in snippets_with_link:
-                    snippets_with_link.pop(link_to_click)
-                else:
-                    visited_links.add(link_to_click)
+                # Speculatively click the next candidate links together
+                links_to_click: list[str] = [link_to_click] + [
+                    link
+                    for link in sorted(
+                        snippets_with_link,
+                        key=lambda link: link not in user_provided_links,
+                    )
+                    if link != link_to_click and link not in visited_links
+                ][: max_links_in_parallel - 1]
+                for link in links_to_click:
+                    if link in snippets_with_link:
+                        snippets_with_link.pop(link)
+                    else:
+                        visited_links.add(link)
 
-                # Get click result and most relevant content & score
+                # Get click results and most relevant content & score
                 # Score: 0 = not relevant, 10 = most relevant
-                click_results: list[
-                    tuple[str, int]
-                ] = await click_link_callback(
-                    buffer=buffer,
-                    query=query_to_search,
-                    link=link_to_click,
-                    scrolling_chunk_size=scrolling_chunk_size,
-                    scrolling_chunk_overlap=scrolling_chunk_overlap,
-                    asession=asession,
-                    timeout=timeout,
-                    maximum_scrolls=maximum_scrolls,
-                )
-                if click_results:
-                    _harvest_click_results(
-                        click_results=click_results,
-                        relevant_content_and_scores=relevant_content_and_scores,
-                    )
-                    if click_results[-1][1] == 10:
-                        # Found the best result!
-                        await SendToWebsocket.message(
-                            websocket=buffer.websocket,
-                            msg=Lotties.OK.format("### I found the result!"),
-                            chat_room_id=buffer.current_chat_room_id,
-                            finish=False,
+                click_tasks: list[Task[list[tuple[str, int]]]] = [
+                    create_task(
+                        click_link_callback(
+                            buffer=buffer,
+                            query=query_to_search,
+                            link=link,
+                            scrolling_chunk_size=scrolling_chunk_size,
+                            scrolling_chunk_overlap=scrolling_chunk_overlap,
+                            asession=asession,
+                            timeout=timeout,
+                            maximum_scrolls=maximum_scrolls,
+                            scoring_batch_size=scoring_batch_size,
+                            fetch_limiter=fetch_limiter,
                         )
-                        return get_best_result()
-                    else:
-                        # Update most relevant content and continue browsing
-                        continue
-                else:
-                    # Click failed, continue browsing
-                    await SendToWebsocket.message(
-                        websocket=buffer.websocket,
-                        msg=Lotties.FAIL.format("### Reading content failed"),
-                        chat_room_id=buffer.current_chat_room_id,
-                        finish=False,
                     )
-                    continue
+                    for link in links_to_click
+                ]
+                try:
+                    for click_task in as_completed(click_tasks):
+                        click_results: list[tuple[str, int]] = await click_task
+                        if not click_results:
+                            # Click failed, continue browsing
+                            await SendToWebsocket.message(
+                                websocket=buffer.websocket,
+                                msg=Lotties.FAIL.format(
+                                    "### Reading content failed"
+                                ),
+                                chat_room_id=buffer.current_chat_room_id,
+                                finish=False,
+                            )
+                            continue
+                        _harvest_click_results(
+                            click_results=click_results,
+                            relevant_content_and_scores=relevant_content_and_scores,
+                        )
+                        if click_results[-1][1] == 10:
+                            # Found the best result! Stop clicking other links
+                            await SendToWebsocket.message(
+                                websocket=buffer.websocket,
+                                msg=Lotties.OK.format(
+                                    "### I found the result!"
+                                ),
+                                chat_room_id=buffer.current_chat_room_id,
+                                finish=False,
+                            )
+                            return get_best_result()
+                finally:
+                    for click_task in click_tasks:
+                        click_task.cancel()
+                # Update most relevant content and continue browsing
+                continue
             elif action == "finish_browsing":
                 # A sufficient amount of information has been provided or there is no more information to find.
                 await SendToWebsocket.message(
@@ -1,7 +1,5 @@
 from typing import Optional
 
-from fastapi.concurrency import run_in_threadpool
-
 from app.common.lotties import Lotties
 from app.models.function_calling.functions import FunctionCalls
 from app.shared import Shared
@@ -10,6 +8,7 @@ from app.utils.chat.managers.websocket import SendToWebsocket
 from app.utils.logger import ApiLogger
 
 from ..query import aget_query_to_search
+from ..web_cache import web_cache
 
 
 async def lite_web_browsing_callback(
@@ -31,7 +30,10 @@ async def lite_web_browsing_callback(
             query=query,
             function=FunctionCalls.get_function_call(FunctionCalls.web_search),
         )
-        r = await run_in_threadpool(Shared().duckduckgo.run, query_to_search)
+        r = await web_cache.get_or_set(
+            web_cache.search_key(query_to_search, kind="run"),
+            lambda: Shared().duckduckgo.arun(query_to_search),
+        )
         # ApiLogger("||lite_web_browsing_chain||").info(r)
 
         await SendToWebsocket.message(
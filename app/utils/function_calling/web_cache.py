@@ -0,0 +1,239 @@
+"""Cache of web search results and parsed web pages, for the browsing callbacks.
+Entries are kept in memory with TTL and LRU eviction, and optionally shared through redis.
+"""
+
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from time import time
+from typing import Any, Awaitable, Callable, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from orjson import dumps as orjson_dumps
+from orjson import loads as orjson_loads
+from redis.asyncio import Redis
+
+from app.common.config import ChatConfig
+from app.database.connection import cache
+from app.utils.logger import ApiLogger
+
+DEFAULT_PORTS: dict[str, int] = {"http": 80, "https": 443}
+
+
+@dataclass
+class WebCacheEntry:
+    value: Any
+    stored_at: float = field(default_factory=time)
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+    @property
+    def validators(self) -> dict[str, str]:
+        """Headers for a conditional request, to revalidate this entry."""
+        headers: dict[str, str] = {}
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+@dataclass
+class WebCacheMetrics:
+    hits: int = 0  # Fresh entries
+    stale_hits: int = 0  # Stale entries, which can be revalidated
+    misses: int = 0
+    revalidations: int = 0  # Stale entries confirmed with 304 Not Modified
+    redis_hits: int = 0  # Entries loaded from redis, included in the above
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total: int = self.hits + self.stale_hits + self.misses
+        return (self.hits + self.revalidations) / total if total else 0.0
+
+    def to_dict(self) -> dict[str, float]:
+        return asdict(self) | {"hit_rate": self.hit_rate}
+
+
+class WebCache:
+    """A TTL + LRU cache, keyed by normalized URLs and queries.
+    - An entry is fresh for `ttl` seconds. After that, it is kept until `stale_ttl` seconds
+    if it has an ETag or Last-Modified header, so that it can be revalidated with a conditional request.
+    - Up to `max_size` entries are kept in memory, and the least recently used one is evicted first.
+    - If `redis_getter` returns a redis client, entries are also shared through redis,
+    so that other workers and restarts can reuse them. Redis errors are ignored.
+    """
+
+    def __init__(
+        self,
+        max_size: int = ChatConfig.web_cache_size,
+        ttl: float = ChatConfig.web_cache_ttl,
+        stale_ttl: float = ChatConfig.web_cache_stale_ttl,
+        redis_getter: Optional[Callable[[], Optional[Redis]]] = None,
+        key_prefix: str = "web_cache:",
+    ) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stale_ttl = max(stale_ttl, ttl)
+        self.redis_getter = redis_getter
+        self.key_prefix = key_prefix
+        self.metrics = WebCacheMetrics()
+        self._entries: OrderedDict[str, WebCacheEntry] = OrderedDict()
+
+    @staticmethod
+    def normalize_url(url: str) -> str:
+        """Lowercase the scheme and host, and drop the default port, the fragment
+        and the trailing slash. Query parameters are sorted."""
+        parts = urlsplit(url.strip())
+        scheme: str = parts.scheme.lower()
+        netloc: str = (parts.hostname or "").lower()
+        if parts.port is not None and parts.port != DEFAULT_PORTS.get(scheme):
+            netloc += f":{parts.port}"
+        return urlunsplit(
+            (
+                scheme,
+                netloc,
+                parts.path.rstrip("/") or "/",
+                urlencode(
+                    sorted(parse_qsl(parts.query, keep_blank_values=True))
+                ),
+                "",
+            )
+        )
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        return " ".join(query.lower().split())
+
+    @classmethod
+    def page_key(
+        cls, url: str, tokens_per_chunk: int, chunk_overlap: int
+    ) -> str:
+        return (
+            f"page:{tokens_per_chunk}:{chunk_overlap}:{cls.normalize_url(url)}"
+        )
+
+    @classmethod
+    def search_key(cls, query: str, kind: str = "results") -> str:
+        return f"search:{kind}:{cls.normalize_query(query)}"
+
+    def is_fresh(self, entry: WebCacheEntry) -> bool:
+        return time() - entry.stored_at < self.ttl
+
+    def _is_alive(self, entry: WebCacheEntry) -> bool:
+        if self.is_fresh(entry):
+            return True
+        return bool(entry.validators) and (
+            time() - entry.stored_at < self.stale_ttl
+        )
+
+    def _get_redis(self) -> Optional[Redis]:
+        if self.redis_getter is None:
+            return None
+        try:
+            return self.redis_getter()
+        except Exception:
+            return None
+
+    def _remember(self, key: str, entry: WebCacheEntry) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.metrics.evictions += 1
+
+    async def _load_from_redis(self, key: str) -> Optional[WebCacheEntry]:
+        redis = self._get_redis()
+        if redis is None:
+            return None
+        try:
+            loaded: Optional[bytes] = await redis.get(self.key_prefix + key)
+            if loaded is None:
+                return None
+            self.metrics.redis_hits += 1
+            return WebCacheEntry(**orjson_loads(loaded))
+        except Exception as e:
+            ApiLogger.cwarning(f"Failed to load web cache from redis: {e}")
+            return None
+
+    async def _store_in_redis(self, key: str, entry: WebCacheEntry) -> None:
+        redis = self._get_redis()
+        if redis is None:
+            return
+        try:
+            await redis.set(
+                self.key_prefix + key,
+                orjson_dumps(asdict(entry)),
+                ex=int(self.stale_ttl if entry.validators else self.ttl)
+                or None,
+            )
+        except Exception as e:
+            ApiLogger.cwarning(f"Failed to store web cache in redis: {e}")
+
+    async def get(self, key: str) -> Optional[WebCacheEntry]:
+        """Get an entry, which may be stale. Check it with `is_fresh`,
+        and revalidate a stale one with its `validators`."""
+        entry: Optional[WebCacheEntry] = self._entries.get(key)
+        if entry is None:
+            entry = await self._load_from_redis(key)
+            if entry is not None:
+                self._remember(key, entry)
+        else:
+            self._entries.move_to_end(key)
+        if entry is None or not self._is_alive(entry):
+            self._entries.pop(key, None)
+            self.metrics.misses += 1
+            return None
+        if self.is_fresh(entry):
+            self.metrics.hits += 1
+        else:
+            self.metrics.stale_hits += 1
+        return entry
+
+    async def set(
+        self,
+        key: str,
+        value: Any,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> WebCacheEntry:
+        entry = WebCacheEntry(
+            value=value, etag=etag, last_modified=last_modified
+        )
+        self._remember(key, entry)
+        await self._store_in_redis(key, entry)
+        return entry
+
+    async def revalidate(self, key: str, entry: WebCacheEntry) -> None:
+        """Mark a stale entry as fresh again, after 304 Not Modified."""
+        self.metrics.revalidations += 1
+        await self.set(
+            key,
+            entry.value,
+            etag=entry.etag,
+            last_modified=entry.last_modified,
+        )
+
+    async def get_or_set(
+        self, key: str, factory: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """Get a fresh value, or make a new one with `factory` and cache it if not empty."""
+        entry: Optional[WebCacheEntry] = await self.get(key)
+        if entry is not None and self.is_fresh(entry):
+            return entry.value
+        value: Any = await factory()
+        if value:
+            await self.set(key, value)
+        return value
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+web_cache = WebCache(
+    redis_getter=(
+        (lambda: cache.redis if cache.is_initiated else None)
+        if ChatConfig.web_cache_use_redis
+        else None
+    )
+)
@@ -0,0 +1,229 @@
+"""Cache of embeddings, in front of the embedding models.
+Embeddings are kept in memory with LRU eviction, and optionally shared through redis as float32 bytes.
+"""
+
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from hashlib import sha256
+from threading import Lock
+from typing import Callable, Iterable, List, Optional
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+from langchain.embeddings.base import Embeddings
+from redis.asyncio import Redis
+
+from app.common.config import ChatConfig
+from app.utils.logger import ApiLogger
+
+
+@dataclass
+class EmbeddingCacheMetrics:
+    hits: int = 0  # Texts found in memory
+    redis_hits: int = 0  # Texts found in redis
+    misses: int = 0  # Texts embedded by the model
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total: int = self.hits + self.redis_hits + self.misses
+        return (self.hits + self.redis_hits) / total if total else 0.0
+
+    def to_dict(self) -> dict[str, float]:
+        return asdict(self) | {"hit_rate": self.hit_rate}
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an embedding model, so that an identical text is embedded only once.
+    - Texts are keyed by their SHA-256 hash, under the model name as namespace.
+    - Up to `max_size` embeddings are kept in memory, and the least recently used one is evicted first.
+    - The async methods also share embeddings through redis, if `redis_getter` returns a redis client.
+    Redis errors are ignored.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        max_size: int = ChatConfig.embedding_cache_size,
+        redis_getter: Optional[Callable[[], Optional[Redis]]] = None,
+        redis_ttl: int = ChatConfig.embedding_cache_ttl,
+        key_prefix: str = "embedding:",
+    ) -> None:
+        self.embeddings = embeddings
+        self.namespace: str = str(
+            getattr(embeddings, "model", None) or type(embeddings).__name__
+        )
+        self.max_size = max_size
+        self.redis_getter = redis_getter
+        self.redis_ttl = redis_ttl
+        self.key_prefix = key_prefix
+        self.metrics = EmbeddingCacheMetrics()
+        self._entries: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._lock = Lock()  # Sync methods run in the threadpool
+
+    def key(self, text: str, kind: str = "document") -> str:
+        return (
+            f"{self.key_prefix}{self.namespace}:{kind}:"
+            f"{sha256(text.encode('utf-8')).hexdigest()}"
+        )
+
+    def _get(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            embedding: Optional[np.ndarray] = self._entries.get(key)
+            if embedding is None:
+                return None
+            self._entries.move_to_end(key)
+            self.metrics.hits += 1
+        return embedding.tolist()
+
+    def _remember(self, key: str, embedding: np.ndarray) -> None:
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.metrics.evictions += 1
+
+    def _get_redis(self) -> Optional[Redis]:
+        if self.redis_getter is None:
+            return None
+        try:
+            return self.redis_getter()
+        except Exception:
+            return None
+
+    def _lookup(
+        self, texts: List[str], kind: str
+    ) -> tuple[List[Optional[List[float]]], dict[str, List[int]]]:
+        """Look up the texts in memory.
+        Returns the embeddings found, and the indices of each missing key."""
+        results: List[Optional[List[float]]] = []
+        missing: dict[str, List[int]] = {}
+        for idx, text in enumerate(texts):
+            key = self.key(text, kind=kind)
+            embedding = self._get(key)
+            if embedding is None:
+                missing.setdefault(key, []).append(idx)
+            results.append(embedding)
+        return results, missing
+
+    def _fill(
+        self,
+        results: List[Optional[List[float]]],
+        indices: Iterable[int],
+        key: str,
+        embedding: np.ndarray,
+    ) -> None:
+        self._remember(key, embedding)
+        as_list: List[float] = embedding.tolist()
+        for idx in indices:
+            results[idx] = as_list
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        results, missing = self._lookup(texts, kind="document")
+        if missing:
+            self.metrics.misses += len(missing)
+            for (key, indices), embedding in zip(
+                missing.items(),
+                self.embeddings.embed_documents(
+                    [texts[indices[0]] for indices in missing.values()]
+                ),
+            ):
+                self._fill(
+                    results, indices, key, np.asarray(embedding, np.float32)
+                )
+        return results  # type: ignore
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self.key(text, kind="query")
+        embedding: Optional[List[float]] = self._get(key)
+        if embedding is not None:
+            return embedding
+        self.metrics.misses += 1
+        as_array = np.asarray(self.embeddings.embed_query(text), np.float32)
+        self._remember(key, as_array)
+        return as_array.tolist()
+
+    async def _load_from_redis(
+        self, keys: List[str]
+    ) -> List[Optional[np.ndarray]]:
+        redis = self._get_redis()
+        if redis is None or not keys:
+            return [None] * len(keys)
+        try:
+            loaded: List[Optional[bytes]] = await redis.mget(keys)
+        except Exception as e:
+            ApiLogger.cwarning(f"Failed to load embeddings from redis: {e}")
+            return [None] * len(keys)
+        return [
+            None if value is None else np.frombuffer(value, np.float32)
+            for value in loaded
+        ]
+
+    async def _store_in_redis(self, entries: dict[str, np.ndarray]) -> None:
+        redis = self._get_redis()
+        if redis is None or not entries:
+            return
+        try:
+            async with redis.pipeline(transaction=False) as pipeline:
+                for key, embedding in entries.items():
+                    pipeline.set(
+                        key, embedding.tobytes(), ex=self.redis_ttl or None
+                    )
+                await pipeline.execute()
+        except Exception as e:
+            ApiLogger.cwarning(f"Failed to store embeddings in redis: {e}")
+
+    async def _aembed(
+        self,
+        texts: List[str],
+        kind: str,
+        embed: Callable[[List[str]], List[List[float]]],
+    ) -> List[List[float]]:
+        results, missing = self._lookup(texts, kind=kind)
+        if not missing:
+            return results  # type: ignore
+
+        for (key, indices), embedding in zip(
+            list(missing.items()),
+            await self._load_from_redis(list(missing)),
+        ):
+            if embedding is not None:
+                self.metrics.redis_hits += 1
+                self._fill(results, indices, key, embedding)
+                del missing[key]
+        if not missing:
+            return results  # type: ignore
+
+        self.metrics.misses += len(missing)
+        embedded: dict[str, np.ndarray] = {
+            key: np.asarray(embedding, np.float32)
+            for key, embedding in zip(
+                missing,
+                await run_in_threadpool(
+                    embed, [texts[indices[0]] for indices in missing.values()]
+                ),
+            )
+        }
+        for key, embedding in embedded.items():
+            self._fill(results, missing[key], key, embedding)
+        await self._store_in_redis(embedded)
+        return results  # type: ignore
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self._aembed(
+            texts, kind="document", embed=self.embeddings.embed_documents
+        )
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (
+            await self._aembed(
+                [text],
+                kind="query",
+                embed=lambda texts: [self.embeddings.embed_query(texts[0])],
+            )
+        )[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
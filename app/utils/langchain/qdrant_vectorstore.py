@@ -2,6 +2,7 @@
 
 import warnings
 from asyncio import gather
+from dataclasses import dataclass, field
 from hashlib import md5
 from operator import itemgetter
 from typing import (
@@ -23,6 +24,8 @@ from langchain.embeddings.base import Embeddings
 from langchain.vectorstores.qdrant import Qdrant as _Qdrant
 from langchain.vectorstores.utils import maximal_marginal_relevance
 
+from app.utils.langchain.cached_embeddings import CachedEmbeddings
+
 if TYPE_CHECKING:
     from qdrant_client import grpc
     from qdrant_client.conversions import common_types
@@ -31,6 +34,14 @@ if TYPE_CHECKING:
     MetadataFilter = Union[DictFilter, common_types.Filter]
 
 
+@dataclass
+class UpsertResult:
+    ids: List[str] = field(default_factory=list)
+    n_new: int = 0  # Texts embedded and added
+    n_updated: int = 0  # Stored texts whose metadata changed
+    n_skipped: int = 0  # Stored texts left unchanged, or duplicates
+
+
 class Qdrant(_Qdrant):
     """Wrapper around Qdrant vector database.
 
@@ -88,11 +99,6 @@ class Qdrant(_Qdrant):
         """
         from itertools import islice
 
-        from qdrant_client import grpc
-        from qdrant_client.conversions.conversion import payload_to_grpc
-
-        grpc_points = self.client.async_grpc_points
-
         ids = []
         texts_iterator = iter(texts)
         metadatas_iterator = iter(metadatas or [])
@@ -101,19 +107,82 @@ class Qdrant(_Qdrant):
             batch_metadatas = (
                 list(islice(metadatas_iterator, batch_size)) or None
             )
+            ids.extend(
+                await self.aadd_embedded_texts(
+                    batch_texts,
+                    embeddings=await self._aembed_texts(batch_texts),
+                    collection_name=collection_name,
+                    metadatas=batch_metadatas,
+                )
+            )
+
+        return ids
+
+    async def aadd_embedded_texts(
+        self,
+        texts: List[str],
+        embeddings: List[List[float]],
+        collection_name: Optional[str] = None,
+        metadatas: Optional[List[dict]] = None,
+    ) -> List[str]:
+        """Add texts, which are already embedded, to the vectorstore in one request.
+
+        Args:
+            texts: List of strings to add to the vectorstore.
+            embeddings: Embedding of each text.
+            metadatas: Optional list of metadatas associated with the texts.
 
+        Returns:
+            List of ids from adding the texts into the vectorstore.
+        """
+        ids = [md5(text.encode("utf-8")).hexdigest() for text in texts]
+        await self._aupsert_points(
+            ids,
+            embeddings,
+            self._build_payloads(
+                texts,
+                metadatas,
+                self.content_payload_key,
+                self.metadata_payload_key,
+            ),
+            collection_name=collection_name,
+        )
+        return ids
+
+    async def aadd_new_texts(
+        self,
+        texts: Iterable[str],
+        collection_name: Optional[str] = None,
+        metadatas: Optional[List[dict]] = None,
+        batch_size: int = 64,
+    ) -> UpsertResult:
+        """Add texts to the vectorstore, embedding only the texts not stored yet.
+        The ids are derived from the texts, so adding the same texts again is idempotent.
+        A stored text is skipped, or its payload is updated with its stored vector if its metadata changed.
+
+        Args:
+            texts: Iterable of strings to add to the vectorstore.
+            metadatas: Optional list of metadatas associated with the texts.
+
+        Returns:
+            The ids of the texts, and the number of new, updated and skipped texts.
+        """
+        from itertools import islice
+
+        result = UpsertResult()
+        texts_iterator = iter(texts)
+        metadatas_iterator = iter(metadatas or [])
+        while batch_texts := list(islice(texts_iterator, batch_size)):
+            batch_metadatas = (
+                list(islice(metadatas_iterator, batch_size)) or None
+            )
             batch_ids = [
                 md5(text.encode("utf-8")).hexdigest() for text in batch_texts
             ]
-            points = [
-                grpc.PointStruct(  # type: ignore
-                    id=grpc.PointId(uuid=id),  # type: ignore
-                    vectors=grpc.Vectors(vector=grpc.Vector(data=vector)),  # type: ignore
-                    payload=payload_to_grpc(payload),
-                )
-                for id, vector, payload in zip(
+            result.ids.extend(batch_ids)
+            payloads: Dict[str, dict] = dict(
+                zip(
                     batch_ids,
-                    await self._aembed_texts(batch_texts),
                     self._build_payloads(
                         batch_texts,
                         batch_metadatas,
@@ -121,18 +190,121 @@ class Qdrant(_Qdrant):
                         self.metadata_payload_key,
                     ),
                 )
+            )
+            stored_payloads: Dict[str, dict] = {
+                id: payload
+                for id, payload, _ in await self._aget_points(
+                    list(payloads), collection_name=collection_name
+                )
+            }
+            new_ids = [id for id in payloads if id not in stored_payloads]
+            updated_ids = [
+                id
+                for id, payload in payloads.items()
+                if id in stored_payloads and stored_payloads[id] != payload
             ]
-            await grpc_points.Upsert(
-                grpc.UpsertPoints(  # type: ignore
-                    collection_name=collection_name
-                    if collection_name is not None
-                    else self.collection_name,
-                    points=points,
+            result.n_new += len(new_ids)
+            result.n_updated += len(updated_ids)
+            result.n_skipped += (
+                len(batch_ids) - len(new_ids) - len(updated_ids)
+            )
+
+            vectors: Dict[str, List[float]] = {}
+            if updated_ids:
+                vectors.update(
+                    (id, vector)
+                    for id, _, vector in await self._aget_points(
+                        updated_ids,
+                        collection_name=collection_name,
+                        with_vectors=True,
+                    )
+                )
+            if new_ids:
+                vectors.update(
+                    zip(
+                        new_ids,
+                        await self._aembed_texts(
+                            [
+                                payloads[id][self.content_payload_key]
+                                for id in new_ids
+                            ]
+                        ),
+                    )
+                )
+            if vectors:
+                # Wait for the points, so that the next batch can find them
+                await self._aupsert_points(
+                    list(vectors),
+                    list(vectors.values()),
+                    [payloads[id] for id in vectors],
+                    collection_name=collection_name,
+                    wait=True,
                 )
+        return result
+
+    async def _aupsert_points(
+        self,
+        ids: List[str],
+        embeddings: List[List[float]],
+        payloads: Iterable[dict],
+        collection_name: Optional[str] = None,
+        wait: bool = False,
+    ) -> None:
+        from qdrant_client import grpc
+        from qdrant_client.conversions.conversion import payload_to_grpc
+
+        grpc_points = self.client.async_grpc_points
+        points = [
+            grpc.PointStruct(  # type: ignore
+                id=grpc.PointId(uuid=id),  # type: ignore
+                vectors=grpc.Vectors(vector=grpc.Vector(data=vector)),  # type: ignore
+                payload=payload_to_grpc(payload),
             )
-            ids.extend(batch_ids)
+            for id, vector, payload in zip(ids, embeddings, payloads)
+        ]
+        await grpc_points.Upsert(
+            grpc.UpsertPoints(  # type: ignore
+                collection_name=collection_name
+                if collection_name is not None
+                else self.collection_name,
+                points=points,
+                wait=wait,
+            )
+        )
 
-        return ids
+    async def _aget_points(
+        self,
+        ids: List[str],
+        collection_name: Optional[str] = None,
+        with_vectors: bool = False,
+    ) -> List[Tuple[str, dict, List[float]]]:
+        """Retrieve the stored points, as their ids, payloads and vectors.
+        Missing ids are left out, and the vectors are empty unless `with_vectors`."""
+        from uuid import UUID
+
+        from qdrant_client import grpc
+        from qdrant_client.conversions.conversion import grpc_to_payload
+
+        grpc_points = self.client.async_grpc_points
+        response = await grpc_points.Get(
+            grpc.GetPoints(  # type: ignore
+                collection_name=collection_name
+                if collection_name is not None
+                else self.collection_name,
+                ids=[grpc.PointId(uuid=id) for id in ids],  # type: ignore
+                with_payload=grpc.WithPayloadSelector(enable=True),  # type: ignore
+                with_vectors=grpc.WithVectorsSelector(enable=with_vectors),  # type: ignore
+            )
+        )
+        # Qdrant returns the ids as hyphenated UUIDs
+        return [
+            (
+                UUID(point.id.uuid).hex,
+                grpc_to_payload(point.payload),
+                list(point.vectors.vector.data) if with_vectors else [],
+            )
+            for point in response.result  # type: ignore
+        ]
 
     async def asimilarity_search_with_score(
         self,
@@ -148,6 +320,31 @@ class Qdrant(_Qdrant):
             k: Number of Documents to return. Defaults to 4.
             filter: Filter by metadata. Defaults to None.
 
+        Returns:
+            List of Documents most similar to the query and score for each.
+        """
+        return await self.asimilarity_search_with_score_by_vector(
+            embedding=await self._aembed_query(query),
+            collection_name=collection_name,
+            k=k,
+            filter=filter,
+        )
+
+    async def asimilarity_search_with_score_by_vector(
+        self,
+        embedding: List[float],
+        collection_name: Optional[str] = None,
+        k: int = 4,
+        filter: Optional["MetadataFilter"] = None,
+    ) -> List[Tuple[Document, float]]:
+        """Return docs most similar to an embedded query.
+        Embed the query once with `_aembed_query` to search several collections.
+
+        Args:
+            embedding: Embedding of the query.
+            k: Number of Documents to return. Defaults to 4.
+            filter: Filter by metadata. Defaults to None.
+
         Returns:
             List of Documents most similar to the query and score for each.
         """
@@ -181,7 +378,7 @@ class Qdrant(_Qdrant):
                 collection_name=self.collection_name
                 if collection_name is None
                 else collection_name,
-                vector=await self._aembed_query(query),
+                vector=embedding,
                 filter=qdrant_filter,
                 with_payload=grpc.WithPayloadSelector(enable=True),  # type: ignore
                 limit=k,
@@ -254,13 +451,30 @@ class Qdrant(_Qdrant):
         Returns:
             List of Documents selected by maximal marginal relevance.
         """
+        return await self.amax_marginal_relevance_search_with_score_by_vector(
+            embedding=await self._aembed_query(query),
+            collection_name=collection_name,
+            k=k,
+            fetch_k=fetch_k,
+            lambda_mult=lambda_mult,
+        )
+
+    async def amax_marginal_relevance_search_with_score_by_vector(
+        self,
+        embedding: List[float],
+        collection_name: Optional[str] = None,
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        **kwargs: Any,
+    ) -> List[tuple[Document, float]]:
+        """Return docs selected using the maximal marginal relevance,
+        for an embedded query. See `amax_marginal_relevance_search_with_score`."""
         from qdrant_client import grpc
         from qdrant_client.conversions.conversion import GrpcToRest
         from qdrant_client.http.models import models as rest
 
         grpc_points = self.client.async_grpc_points
-        embedding = await self._aembed_query(query)
-
         response = await grpc_points.Search(
             grpc.SearchPoints(  # type: ignore
                 collection_name=collection_name
@@ -355,7 +569,9 @@ class Qdrant(_Qdrant):
         Returns:
             List of floats representing the query embedding.
         """
-        if self.embeddings is not None:
+        if isinstance(self.embeddings, CachedEmbeddings):
+            embedding = await self.embeddings.aembed_query(query)
+        elif self.embeddings is not None:
             embedding = await run_in_threadpool(
                 self.embeddings.embed_query, query
             )
@@ -381,7 +597,9 @@ class Qdrant(_Qdrant):
         Returns:
             List of floats representing the texts embedding.
         """
-        if self.embeddings is not None:
+        if isinstance(self.embeddings, CachedEmbeddings):
+            embeddings = await self.embeddings.aembed_documents(list(texts))
+        elif self.embeddings is not None:
             embeddings = await run_in_threadpool(
                 self.embeddings.embed_documents, list(texts)
             )
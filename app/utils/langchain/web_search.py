@@ -13,7 +13,7 @@ from pydantic import (
     validator,
 )
 
-from app.utils.api.duckduckgo import DDGS
+from app.utils.api.duckduckgo import DDGS, get_async_ddgs
 
 
 def _get_default_params() -> dict:
@@ -429,6 +429,32 @@ class DuckDuckGoSearchAPIWrapper(BaseModel):
                 break
         return results
 
+    @staticmethod
+    async def _addg(
+        keywords: str,
+        region: str = "wt-wt",
+        safesearch: str = "moderate",
+        timelimit: Optional[str] = None,
+        backend: str = "api",
+        max_results: Optional[int] = None,
+        pages: Optional[int] = 1,
+        results_per_page: int = 20,
+    ) -> List[Dict]:
+        results = []
+        async for result in get_async_ddgs().text(
+            keywords=keywords,
+            region=region,
+            safesearch=safesearch,
+            timelimit=timelimit,
+            backend=backend,
+        ):
+            results.append(result)
+            if (max_results and len(results) >= max_results) or (
+                pages and len(results) >= results_per_page * pages
+            ):
+                break
+        return results
+
     @staticmethod
     def _get_formatted_result(result: Dict[str, str]) -> str:
         return "# [{link}]\n```{title}\n{snippet}\n```".format(
@@ -467,6 +493,20 @@ class DuckDuckGoSearchAPIWrapper(BaseModel):
             for result in self.results(query)
         }
 
+    async def arun(self, query: str) -> str:
+        return "\n\n".join(
+            self._get_formatted_result(result)
+            for result in await self.aresults(query)
+        )
+
+    async def aformatted_results_with_link(
+        self, query: str
+    ) -> Dict[str, str]:
+        return {
+            result["link"]: self._get_formatted_result(result)
+            for result in await self.aresults(query)
+        }
+
     def results(
         self, query: str, num_results: Optional[int] = None
     ) -> List[Dict[str, str]]:
@@ -501,3 +541,27 @@ class DuckDuckGoSearchAPIWrapper(BaseModel):
             }
             for result in results
         ][:num_results]
+
+    async def aresults(
+        self, query: str, num_results: Optional[int] = None
+    ) -> List[Dict[str, str]]:
+        """Same as `results`, searching on the event loop."""
+        results = await self._addg(
+            query,
+            region=self.region,
+            safesearch=self.safesearch,
+            timelimit=self.time,
+            max_results=self.max_results,
+        )
+
+        if results is None or len(results) == 0:
+            return [{"Result": "No good DuckDuckGo Search Result was found"}]
+
+        return [
+            {
+                "snippet": result["body"],
+                "title": result["title"],
+                "link": result["href"],
+            }
+            for result in results
+        ][:num_results]
@@ -0,0 +1,193 @@
+import asyncio
+from time import perf_counter
+from typing import Any, Optional
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from app.models.function_calling.base import FunctionCall
+from app.utils.function_calling.callbacks import click_link, full_browsing
+from app.utils.function_calling.web_cache import WebCache
+
+N_PAGES: int = 4
+N_CHUNKS_PER_PAGE: int = 5
+WORDS_PER_CHUNK: int = 20
+SECONDS_PER_FUNCTION_CALL: float = 0.05
+
+
+class WordSplitter:
+    def split_text(
+        self,
+        text: str,
+        tokens_per_chunk: Optional[int] = None,
+        chunk_overlap: Optional[int] = None,
+    ) -> list[str]:
+        words = text.split()
+        size = tokens_per_chunk or WORDS_PER_CHUNK
+        return [
+            " ".join(words[idx : idx + size])
+            for idx in range(0, len(words), size)
+        ]
+
+
+class MockSearch:
+    def __init__(self, links: list[str]) -> None:
+        self.links = links
+
+    async def aformatted_results_with_link(
+        self, query: str
+    ) -> dict[str, str]:
+        return {link: f"Snippet of {link}" for link in self.links}
+
+
+class MockShared:
+    token_text_splitter = WordSplitter()
+    duckduckgo: MockSearch
+
+
+class MockWebSocket:
+    def __init__(self) -> None:
+        self.messages: list[dict] = []
+
+    async def send_json(self, data: dict) -> None:
+        self.messages.append(data)
+
+
+class MockBuffer:
+    current_chat_room_id: str = "test"
+
+    def __init__(self) -> None:
+        self.websocket = MockWebSocket()
+
+
+class MockFunctionCallEndpoint:
+    """Clicks the first link, and picks the content with the answer."""
+
+    def __init__(self) -> None:
+        self.n_calls: int = 0
+        self.n_running: int = 0
+        self.max_running: int = 0
+
+    async def __call__(
+        self,
+        messages: list[dict[str, str]],
+        functions: list[FunctionCall],
+        **kwargs: Any,
+    ) -> dict:
+        self.n_calls += 1
+        self.n_running += 1
+        self.max_running = max(self.max_running, self.n_running)
+        try:
+            await asyncio.sleep(SECONDS_PER_FUNCTION_CALL)
+        finally:
+            self.n_running -= 1
+        context: str = messages[0]["content"]
+        if functions[0].name == "control_browser":
+            assert functions[0].parameters is not None
+            link_parameter = functions[0].parameters[1]
+            assert link_parameter.enum is not None
+            return {
+                "name": "control_browser",
+                "arguments": {
+                    "action": "click_link",
+                    "link_to_click": link_parameter.enum[0],
+                },
+            }
+        if "ANSWER" in context.split("Current reading content")[-1]:
+            return {
+                "name": "control_web_page",
+                "arguments": {"action": "pick", "relevance_score": 10},
+            }
+        return {
+            "name": "control_web_page",
+            "arguments": {"action": "scroll_down", "relevance_score": 3},
+        }
+
+
+def make_page(page_idx: int) -> str:
+    paragraphs: list[str] = []
+    for chunk_idx in range(N_CHUNKS_PER_PAGE):
+        words = [
+            f"page{page_idx}chunk{chunk_idx}word{i}"
+            for i in range(WORDS_PER_CHUNK)
+        ]
+        if page_idx == N_PAGES - 2 and chunk_idx == N_CHUNKS_PER_PAGE - 2:
+            words[-1] = "ANSWER"
+        paragraphs.append(f"<p>{' '.join(words)}</p>")
+    return (
+        f"<html><body><article>{''.join(paragraphs)}</article></body></html>"
+    )
+
+
+@pytest.mark.asyncio
+async def test_parallel_browsing(monkeypatch, test_logger):
+    async def handler(request: web.Request) -> web.Response:
+        await asyncio.sleep(0.05)
+        return web.Response(
+            text=make_page(int(request.match_info["page_idx"])),
+            content_type="text/html",
+        )
+
+    app = web.Application()
+    app.router.add_get("/page/{page_idx}", handler)
+    server = TestServer(app)
+    await server.start_server()
+    try:
+        links = [
+            str(server.make_url(f"/page/{page_idx}"))
+            for page_idx in range(N_PAGES)
+        ]
+        MockShared.duckduckgo = MockSearch(links)
+        monkeypatch.setattr(click_link, "Shared", MockShared)
+        monkeypatch.setattr(full_browsing, "Shared", MockShared)
+
+        async def browse(
+            max_links_in_parallel: int, scoring_batch_size: int
+        ) -> tuple[Optional[str], float, int, int]:
+            endpoint = MockFunctionCallEndpoint()
+            web_cache = WebCache(redis_getter=None)  # Browse without cache
+            monkeypatch.setattr(click_link, "web_cache", web_cache)
+            monkeypatch.setattr(full_browsing, "web_cache", web_cache)
+            monkeypatch.setattr(click_link, "request_function_call", endpoint)
+            monkeypatch.setattr(
+                full_browsing, "request_function_call", endpoint
+            )
+            start = perf_counter()
+            result = await full_browsing.full_web_browsing_callback(
+                buffer=MockBuffer(),  # type: ignore
+                query_to_search="Where is the answer?",
+                user_provided_links=[],
+                finish=True,
+                wait_next_query=True,
+                scrolling_chunk_size=WORDS_PER_CHUNK,
+                scrolling_chunk_overlap=0,
+                maximum_scrolls=N_CHUNKS_PER_PAGE,
+                max_links_in_parallel=max_links_in_parallel,
+                scoring_batch_size=scoring_batch_size,
+            )
+            return (
+                result,
+                perf_counter() - start,
+                endpoint.n_calls,
+                endpoint.max_running,
+            )
+
+        sequential, sequential_elapsed, sequential_calls, _ = await browse(
+            max_links_in_parallel=1, scoring_batch_size=1
+        )
+        parallel, elapsed, calls, max_running = await browse(
+            max_links_in_parallel=3, scoring_batch_size=4
+        )
+    finally:
+        await server.close()
+
+    test_logger.info(
+        f"Browsing {N_PAGES} pages: "
+        f"{sequential_elapsed:.2f}s with {sequential_calls} calls -> "
+        f"{elapsed:.2f}s with {calls} calls, {max_running} at once"
+    )
+    assert sequential is not None and "ANSWER" in sequential
+    assert parallel is not None and "ANSWER" in parallel
+    assert max_running > 1
+    assert elapsed < sequential_elapsed
@@ -173,3 +173,198 @@ def test_chat_conversation(client: TestClient, base_websocket_url: str, test_log
 
         # close websocket
         ws_client.close()
+
+
+@pytest.mark.redistest
+@pytest.mark.asyncio
+async def test_chat_redis_pipelined_persistence(
+    cache_manager, monkeypatch, test_logger
+):
+    """Compares round trips and latency of sequential and pipelined context persistence"""
+    from redis.asyncio.client import Pipeline
+
+    from app.database.connection import cache
+
+    user_id: str = "test_user"
+    test_chat_room_id: str = "test_chat_room_pipeline"
+    n_messages: int = 200
+    context: UserChatContext = UserChatContext.construct_default(
+        user_id=user_id, chat_room_id=test_chat_room_id
+    )
+    for i in range(n_messages):
+        context.user_message_histories.append(
+            MessageHistory(
+                role=ChatRoles.USER.value, content=f"message {i}", tokens=3
+            )
+        )
+    await cache_manager.delete_chat_room(
+        user_id=user_id, chat_room_id=test_chat_room_id
+    )
+
+    round_trips: int = 0
+    execute_command = cache.redis.execute_command
+    execute_pipeline = Pipeline.execute
+
+    async def count_command(*args, **kwargs):
+        nonlocal round_trips
+        round_trips += 1
+        return await execute_command(*args, **kwargs)
+
+    async def count_pipeline(self, *args, **kwargs):
+        nonlocal round_trips
+        round_trips += 1
+        return await execute_pipeline(self, *args, **kwargs)
+
+    monkeypatch.setattr(cache.redis, "execute_command", count_command)
+    monkeypatch.setattr(Pipeline, "execute", count_pipeline)
+
+    # Sequential persistence, as one SET per field and one RPUSH per message
+    json_data = context.json()
+    start: float = time.perf_counter()
+    for field, key in cache_manager._get_string_fields(
+        user_id, test_chat_room_id
+    ).items():
+        await cache.redis.set(key, json.dumps(json_data[field]))
+    for field, key in cache_manager._get_list_fields(
+        user_id, test_chat_room_id
+    ).items():
+        await cache.redis.delete(key)
+        for item in json_data[field]:
+            await cache.redis.rpush(key, json.dumps(item))
+    sequential_elapsed: float = time.perf_counter() - start
+    sequential_round_trips: int = round_trips
+
+    # Pipelined persistence
+    round_trips = 0
+    start = time.perf_counter()
+    await cache_manager.update_context(user_chat_context=context)
+    pipelined_elapsed: float = time.perf_counter() - start
+    pipelined_round_trips: int = round_trips
+
+    test_logger.info(
+        f"Sequential: {sequential_round_trips} round trips, {sequential_elapsed * 1000:.2f}ms / "
+        f"Pipelined: {pipelined_round_trips} round trips, {pipelined_elapsed * 1000:.2f}ms"
+    )
+    assert pipelined_round_trips == 1
+    assert sequential_round_trips > n_messages
+    assert (
+        await cache_manager.get_message_history(
+            user_id=user_id, chat_room_id=test_chat_room_id, role=ChatRoles.USER
+        )
+        == context.user_message_histories
+    )
+
+    await cache_manager.delete_chat_room(
+        user_id=user_id, chat_room_id=test_chat_room_id
+    )
+
+
+@pytest.mark.redistest
+@pytest.mark.asyncio
+async def test_chat_room_index_scaling(cache_manager, test_logger):
+    """Compares fetching one user's chat rooms by the index and by SCAN with 10k users"""
+    from app.database.connection import cache
+
+    n_users: int = 10000
+    user_ids: list[str] = [f"test_index_user_{i}" for i in range(n_users)]
+    async with cache.redis.pipeline(transaction=False) as pipe:
+        for user_id in user_ids:
+            profile: UserChatProfile = UserChatProfile(user_id=user_id)
+            pipe.set(
+                cache_manager._generate_key(
+                    user_id, profile.chat_room_id, "user_chat_profile"
+                ),
+                json.dumps(profile.__dict__),
+            )
+        await pipe.execute()
+
+    # legacy keys are not indexed until the migration is run
+    assert await cache_manager.fetch_chat_profiles(user_id=user_ids[0]) == []
+    assert await cache_manager.migrate_chat_room_index(force=True) >= n_users
+
+    start: float = time.perf_counter()
+    indexed: list[UserChatProfile] = await cache_manager.fetch_chat_profiles(
+        user_id=user_ids[0]
+    )
+    indexed_elapsed: float = time.perf_counter() - start
+
+    start = time.perf_counter()
+    scanned: list[bytes] = [
+        key
+        async for key in cache.redis.scan_iter(
+            match=f"chat:{user_ids[0]}:*:user_chat_profile"
+        )
+    ]
+    scanned_elapsed: float = time.perf_counter() - start
+
+    test_logger.info(
+        f"Index: {indexed_elapsed * 1000:.2f}ms / SCAN: {scanned_elapsed * 1000:.2f}ms"
+    )
+    assert len(indexed) == len(scanned) == 1
+
+    # deleting a chat room keeps the index consistent
+    await cache_manager.delete_chat_room(
+        user_id=user_ids[0], chat_room_id=indexed[0].chat_room_id
+    )
+    assert await cache_manager.fetch_chat_profiles(user_id=user_ids[0]) == []
+
+    # a late update of a deleted chat room doesn't list it again
+    context: UserChatContext = UserChatContext.construct_default(
+        user_id=user_ids[0], chat_room_id=indexed[0].chat_room_id
+    )
+    await cache_manager.update_context(user_chat_context=context)
+    assert await cache_manager.fetch_chat_profiles(user_id=user_ids[0]) == []
+    await cache_manager.delete_chat_room(
+        user_id=user_ids[0], chat_room_id=indexed[0].chat_room_id
+    )
+
+    for user_id in user_ids:
+        await cache_manager.delete_user(user_id=user_id)
+
+
+def test_message_history_codec(test_logger):
+    """Compares size and throughput of the compact codec and legacy orjson"""
+    from orjson import dumps as orjson_dumps
+
+    from app.utils.chat.messages.codec import (
+        decode_message_history,
+        encode_message_history,
+    )
+
+    n_messages: int = 1000
+    message_histories: list[MessageHistory] = [
+        MessageHistory(
+            role=ChatRoles.AI.value,
+            content=f"test message {i} " * (1 + i % 200),
+            tokens=i,
+            actual_role=ChatRoles.AI.value,
+            model_name="gpt-3.5-turbo",
+        )
+        for i in range(n_messages)
+    ]
+
+    start: float = time.perf_counter()
+    legacy: list[bytes] = [orjson_dumps(m.__dict__) for m in message_histories]
+    legacy_encode: float = time.perf_counter() - start
+    start = time.perf_counter()
+    compact: list[bytes] = [encode_message_history(m) for m in message_histories]
+    compact_encode: float = time.perf_counter() - start
+
+    start = time.perf_counter()
+    legacy_decoded = [decode_message_history(raw) for raw in legacy]
+    legacy_decode: float = time.perf_counter() - start
+    start = time.perf_counter()
+    compact_decoded = [decode_message_history(raw) for raw in compact]
+    compact_decode: float = time.perf_counter() - start
+
+    legacy_size: int = sum(len(raw) for raw in legacy)
+    compact_size: int = sum(len(raw) for raw in compact)
+    test_logger.info(
+        f"Per {n_messages} messages: legacy {legacy_size} bytes, compact {compact_size} bytes "
+        f"({legacy_size - compact_size} bytes saved)\n"
+        f"Encode: legacy {n_messages / legacy_encode:.0f}/s, compact {n_messages / compact_encode:.0f}/s\n"
+        f"Decode: legacy {n_messages / legacy_decode:.0f}/s, compact {n_messages / compact_decode:.0f}/s"
+    )
+    assert compact_size < legacy_size
+    assert legacy_decoded == message_histories
+    assert compact_decoded == message_histories
@@ -158,3 +158,128 @@ async def test_chat_completion_request(stream: bool) -> None:
             n=n,
         )
         assert chat_completion["choices"][0]["message"]["content"] is not None
+
+
+@pytest.mark.asyncio
+async def test_pooled_session_time_to_first_token(test_logger) -> None:
+    from statistics import median
+    from time import perf_counter
+    from typing import Optional
+
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+    from orjson import dumps
+
+    from app.utils.api.session_pool import session_pool
+
+    n_requests: int = 20
+    peers: set = set()
+
+    async def mock_sse(request: web.Request) -> web.StreamResponse:
+        peers.add(request.transport.get_extra_info("peername"))  # type: ignore
+        response = web.StreamResponse(
+            headers={"Content-Type": "text/event-stream"}
+        )
+        await response.prepare(request)
+        for content in ("Hello", ",", " world"):
+            chunk = {
+                "id": "chatcmpl-mock",
+                "model": "mock",
+                "choices": [{"delta": {"content": content}}],
+            }
+            await response.write(b"data: " + dumps(chunk) + b"\n\n")
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", mock_sse)
+    async with TestServer(app) as server:
+        api_base: str = str(server.make_url("/v1"))
+
+        async def time_to_first_token() -> float:
+            start = perf_counter()
+            elapsed: Optional[float] = None
+            async for _ in acreate_chat_completion(
+                messages=[{"role": "user", "content": "Hi"}],
+                model="mock",
+                api_base=api_base,
+                stream=True,
+            ):
+                # Consume the rest, so that the connection can be reused
+                if elapsed is None:
+                    elapsed = perf_counter() - start
+            assert elapsed is not None
+            return elapsed
+
+        # A new session for every request, like before
+        fresh: list[float] = []
+        for _ in range(n_requests):
+            await session_pool.close()
+            fresh.append(await time_to_first_token())
+        n_fresh_connections: int = len(peers)
+
+        await session_pool.close()
+        peers.clear()
+        pooled: list[float] = [
+            await time_to_first_token() for _ in range(n_requests)
+        ]
+        n_pooled_connections: int = len(peers)
+        await session_pool.close()
+
+    test_logger.info(
+        f"Time to first token (median of {n_requests}): "
+        f"{median(fresh) * 1000:.2f}ms with a new session, "
+        f"{median(pooled) * 1000:.2f}ms with a pooled session"
+    )
+    assert n_fresh_connections == n_requests
+    assert n_pooled_connections == 1
+
+
+@pytest.mark.asyncio
+async def test_session_pool_limits_and_stale_sessions() -> None:
+    import asyncio
+    from threading import Thread
+
+    from aiohttp import ClientSession, web
+    from aiohttp.test_utils import TestServer
+
+    from app.utils.api.session_pool import ClientSessionPool
+
+    async def slow_stream(request: web.Request) -> web.StreamResponse:
+        response = web.StreamResponse()
+        await response.prepare(request)
+        await asyncio.sleep(1.0)
+        return response
+
+    app = web.Application()
+    app.router.add_get("/", slow_stream)
+    async with TestServer(app) as server:
+        url: str = str(server.make_url("/"))
+
+        # With a limit, a request fails instead of waiting forever for a connection
+        pool = ClientSessionPool(limit_per_host=1, connect_timeout=0.2)
+        async with pool.get(url).get(url):
+            with pytest.raises(asyncio.TimeoutError):
+                async with pool.get(url).get(url):
+                    pass
+        await pool.close()
+
+        # Unlimited by default
+        pool = ClientSessionPool(limit=0, limit_per_host=0)
+        async with pool.get(url).get(url), pool.get(url).get(url):
+            pass
+        await pool.close()
+
+        # A session of an event loop which is no longer running is closed
+        pool = ClientSessionPool()
+        sessions: list[ClientSession] = []
+
+        async def open_session() -> None:
+            sessions.append(pool.get(url))
+
+        thread = Thread(target=asyncio.run, args=(open_session(),))
+        thread.start()
+        thread.join()
+        assert pool.get(url) is not sessions[0]
+        assert sessions[0].closed
+        await pool.close()
@@ -0,0 +1,213 @@
+import asyncio
+from time import perf_counter
+from urllib.parse import parse_qs
+
+import httpx
+import pytest
+
+from app.utils.api.duckduckgo import DDGS, AsyncDDGS
+
+KEYWORDS: str = "python asyncio"
+
+# Recorded from duckduckgo.com, trimmed to the parts that are parsed
+VQD_PAGE: bytes = (
+    b"<html><head><script>"
+    b"DDG.deep.initialize('/d.js?q=python+asyncio&l=wt-wt&s=0&dl=en&ct=KR"
+    b"&vqd=4-123456789012345678901234567890&bing_market=wt-WT');"
+    b'</script></head><body><input name="vqd" value="4-1234"></body></html>'
+)
+API_PAGES: dict[str, dict] = {
+    "0": {
+        "results": [
+            {
+                "a": "<b>asyncio</b> is a library to write <b>concurrent</b> code",
+                "t": "asyncio &mdash; Asynchronous I/O",
+                "u": "https://docs.python.org/3/library/asyncio.html",
+            },
+            {
+                "a": "Hands-on Python 3 Concurrency With the asyncio Module",
+                "t": "Async IO in Python: A Complete Walkthrough",
+                "u": "https://realpython.com/async-io-python/",
+            },
+            {
+                "a": "Search for python asyncio on Google",
+                "t": "Google",
+                "u": f"http://www.google.com/search?q={KEYWORDS}",
+            },
+            {"n": "/d.js?q=python+asyncio&s=20"},
+        ]
+    },
+    "20": {
+        "results": [
+            {
+                "a": "Duplicated result",
+                "t": "asyncio",
+                "u": "https://docs.python.org/3/library/asyncio.html",
+            },
+            {
+                "a": "Asyncio tutorial with examples",
+                "t": "Python Asyncio Tutorial",
+                "u": "https://example.com/python%20asyncio",
+            },
+        ]
+    },
+    "70": {"results": []},
+}
+HTML_PAGE: bytes = b"""<html><body><div id="links" class="results">
+<div class="result results_links results_links_deep web-result">
+  <h2 class="result__title">
+    <a rel="nofollow" class="result__a"
+       href="https://docs.python.org/3/library/asyncio.html">asyncio &mdash; Asynchronous I/O</a>
+  </h2>
+  <a class="result__snippet"
+     href="https://docs.python.org/3/library/asyncio.html"><b>asyncio</b> is a library to write concurrent code</a>
+</div>
+<div class="result results_links results_links_deep web-result">
+  <h2 class="result__title">
+    <a rel="nofollow" class="result__a" href="https://realpython.com/async-io-python/">Async IO in Python</a>
+  </h2>
+  <a class="result__snippet" href="https://realpython.com/async-io-python/">Hands-on Python 3 Concurrency</a>
+</div>
+</div></body></html>"""
+LITE_PAGE: bytes = b"""<html><body><table></table><table>
+<tr><td>1.&nbsp;</td><td><a rel="nofollow" class="result-link"
+  href="https://docs.python.org/3/library/asyncio.html">asyncio &mdash; Asynchronous I/O</a></td></tr>
+<tr><td>&nbsp;&nbsp;&nbsp;</td><td class="result-snippet"><b>asyncio</b> is a library to write concurrent code</td></tr>
+<tr><td>&nbsp;&nbsp;&nbsp;</td><td><span class="link-text">docs.python.org/3/library/asyncio.html</span></td></tr>
+<tr><td>&nbsp;</td><td>&nbsp;</td></tr>
+</table></body></html>"""
+
+
+class RecordedDuckDuckGo:
+    """Replays the recorded pages, counting the requests."""
+
+    def __init__(self, seconds_per_request: float = 0.0) -> None:
+        self.seconds_per_request = seconds_per_request
+        self.requests: list[str] = []
+        self.failures_to_make: int = 0
+
+    def respond(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(f"{request.method} {request.url.host}")
+        if self.failures_to_make > 0:
+            self.failures_to_make -= 1
+            return httpx.Response(500, request=request)
+        host = request.url.host
+        if host == "duckduckgo.com":
+            return httpx.Response(200, content=VQD_PAGE)
+        if host == "links.duckduckgo.com":
+            page = API_PAGES.get(request.url.params["s"], {"results": []})
+            return httpx.Response(200, json=page)
+        if host == "html.duckduckgo.com":
+            return httpx.Response(200, content=HTML_PAGE)
+        if host == "lite.duckduckgo.com":
+            if parse_qs(request.content.decode())["s"] != ["0"]:
+                return httpx.Response(200, content=b"No more results.")
+            return httpx.Response(200, content=LITE_PAGE)
+        return httpx.Response(404)
+
+    async def arespond(self, request: httpx.Request) -> httpx.Response:
+        if self.seconds_per_request:
+            await asyncio.sleep(self.seconds_per_request)
+        return self.respond(request)
+
+
+def make_async_ddgs(recorded: RecordedDuckDuckGo, **kwargs) -> AsyncDDGS:
+    ddgs = AsyncDDGS(**kwargs)
+    ddgs._client = httpx.AsyncClient(
+        transport=httpx.MockTransport(recorded.arespond)
+    )
+    return ddgs
+
+
+def make_ddgs(recorded: RecordedDuckDuckGo) -> DDGS:
+    ddgs = DDGS()
+    ddgs._client = httpx.Client(
+        transport=httpx.MockTransport(recorded.respond)
+    )
+    return ddgs
+
+
+@pytest.mark.parametrize("backend", ["api", "html", "lite"])
+@pytest.mark.asyncio
+async def test_async_ddgs_text(backend: str):
+    recorded = RecordedDuckDuckGo()
+    async with make_async_ddgs(recorded) as ddgs:
+        results = [
+            result async for result in ddgs.text(KEYWORDS, backend=backend)
+        ]
+    assert results[0] == {
+        "title": "asyncio — Asynchronous I/O",
+        "href": "https://docs.python.org/3/library/asyncio.html",
+        "body": "asyncio is a library to write concurrent code",
+    }
+    hrefs = [result["href"] for result in results]
+    assert len(hrefs) == len(set(hrefs))
+    assert f"http://www.google.com/search?q={KEYWORDS}" not in hrefs
+    if backend == "api":
+        assert hrefs[-1] == "https://example.com/python+asyncio"
+
+    # Same results as the blocking client
+    with make_ddgs(RecordedDuckDuckGo()) as sync_ddgs:
+        assert list(sync_ddgs.text(KEYWORDS, backend=backend)) == results
+
+
+@pytest.mark.asyncio
+async def test_async_ddgs_vqd_cache_and_retry():
+    recorded = RecordedDuckDuckGo()
+    async with make_async_ddgs(recorded, backoff=0.01) as ddgs:
+        async for _ in ddgs.text(KEYWORDS):
+            break
+        assert recorded.requests.count("POST duckduckgo.com") == 1
+
+        # The vqd is reused, and a failed request is retried
+        recorded.failures_to_make = 1
+        results = [result async for result in ddgs.text(KEYWORDS)]
+        assert len(results) == 3
+        assert recorded.requests.count("POST duckduckgo.com") == 1
+
+        # An expired vqd is requested again
+        ddgs.vqd_ttl = 0
+        async for _ in ddgs.text(KEYWORDS):
+            break
+        assert recorded.requests.count("POST duckduckgo.com") == 2
+
+        recorded.failures_to_make = ddgs.max_retries
+        with pytest.raises(httpx.HTTPStatusError):
+            async for _ in ddgs.text("another query"):
+                pass
+
+
+@pytest.mark.asyncio
+async def test_async_ddgs_concurrent_searches(test_logger):
+    n_searches: int = 20
+    recorded = RecordedDuckDuckGo(seconds_per_request=0.02)
+    async with make_async_ddgs(recorded) as ddgs:
+
+        async def search(query_idx: int) -> int:
+            return len(
+                [
+                    result
+                    async for result in ddgs.text(f"{KEYWORDS} {query_idx}")
+                ]
+            )
+
+        start = perf_counter()
+        sequential = [
+            await search(query_idx) for query_idx in range(n_searches)
+        ]
+        sequential_elapsed = perf_counter() - start
+
+        start = perf_counter()
+        assert (
+            await asyncio.gather(
+                *(search(query_idx) for query_idx in range(n_searches))
+            )
+            == sequential
+        )
+        elapsed = perf_counter() - start
+
+    test_logger.info(
+        f"{n_searches} searches: {sequential_elapsed:.2f}s one by one -> "
+        f"{elapsed:.2f}s at once, on one event loop"
+    )
+    assert elapsed < sequential_elapsed
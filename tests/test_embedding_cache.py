@@ -0,0 +1,108 @@
+from time import perf_counter, sleep
+from uuid import uuid4
+
+import pytest
+from langchain.embeddings.base import Embeddings
+
+from app.database.connection import cache
+from app.utils.langchain.cached_embeddings import CachedEmbeddings
+
+
+class CountingEmbeddings(Embeddings):
+    """Embeds a text into its length and the codes of its first characters."""
+
+    def __init__(
+        self, model: str = "counting", seconds_per_call: float = 0.0
+    ) -> None:
+        self.model = model
+        self.seconds_per_call = seconds_per_call
+        self.embedded_texts: list[str] = []
+
+    def _embed(self, text: str) -> list[float]:
+        self.embedded_texts.append(text)
+        return [float(len(text))] + [float(ord(c)) for c in text[:3].ljust(3)]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        sleep(self.seconds_per_call)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        sleep(self.seconds_per_call)
+        return self._embed(text)
+
+
+def test_embedding_cache():
+    model = CountingEmbeddings()
+    embeddings = CachedEmbeddings(model, max_size=3)
+    texts = ["apple", "banana", "apple"]
+    assert embeddings.embed_documents(texts) == model.embed_documents(texts)
+    model.embedded_texts.clear()
+
+    # Identical texts are embedded once
+    assert embeddings.embed_documents(["banana", "cherry"]) == [
+        model._embed("banana"),
+        model._embed("cherry"),
+    ]
+    model.embedded_texts.clear()
+    embeddings.embed_documents(["banana", "cherry"])
+    assert model.embedded_texts == []
+
+    # Queries and models are cached separately
+    embeddings.embed_query("apple")
+    assert model.embedded_texts == ["apple"]
+    assert CachedEmbeddings(CountingEmbeddings(model="other")).key(
+        "apple"
+    ) != embeddings.key("apple")
+
+    # The least recently used text is evicted first
+    assert embeddings.metrics.evictions == 1
+    model.embedded_texts.clear()
+    embeddings.embed_documents(["apple", "banana"])
+    assert model.embedded_texts == ["apple"]
+    assert embeddings.metrics.to_dict()["misses"] == 5
+
+
+@pytest.mark.asyncio
+async def test_embedding_cache_redis(cache_manager, test_logger):
+    model = CountingEmbeddings(model=f"test-{uuid4().hex}")
+    embeddings = CachedEmbeddings(model, redis_getter=lambda: cache.redis)
+    texts: list[str] = [f"chunk {idx}" for idx in range(10)]
+    expected = await embeddings.aembed_documents(texts)
+    assert len(model.embedded_texts) == 10
+
+    # Another worker finds them in redis, as float32 bytes
+    other_embeddings = CachedEmbeddings(
+        model, redis_getter=lambda: cache.redis
+    )
+    assert await other_embeddings.aembed_documents(texts) == expected
+    assert await other_embeddings.aembed_query("chunk 0") == expected[0]
+    assert len(model.embedded_texts) == 11
+    assert other_embeddings.metrics.redis_hits == 10
+    await cache.redis.delete(*(embeddings.key(text) for text in texts))
+    await cache.redis.delete(embeddings.key("chunk 0", kind="query"))
+
+
+@pytest.mark.asyncio
+async def test_embedding_cache_benchmark(test_logger):
+    queries: list[str] = [f"query {idx % 10}" for idx in range(50)]
+    results: dict[str, float] = {}
+    for name, embeddings in (
+        ("uncached", CountingEmbeddings(seconds_per_call=0.005)),
+        (
+            "cached",
+            CachedEmbeddings(CountingEmbeddings(seconds_per_call=0.005)),
+        ),
+    ):
+        start = perf_counter()
+        for query in queries:
+            if isinstance(embeddings, CachedEmbeddings):
+                await embeddings.aembed_query(query)
+            else:
+                embeddings.embed_query(query)
+        results[name] = perf_counter() - start
+
+    test_logger.info(
+        f"Embedding {len(queries)} queries, 10 unique: "
+        f"{results['uncached'] * 1000:.1f}ms -> {results['cached'] * 1000:.1f}ms"
+    )
+    assert results["cached"] < results["uncached"]
@@ -0,0 +1,172 @@
+from random import Random
+from time import perf_counter, sleep
+from typing import Optional
+
+import pytest
+
+from app.utils.chat.text_generations.pool import (
+    GeneratorPool,
+    GeneratorPoolFullError,
+)
+
+MODEL_SIZES_MB: dict[str, float] = {
+    "completion:llama_7b": 4000,
+    "completion:llama_13b": 8000,
+    "completion:mistral_7b": 4000,
+    "embedding:intfloat/e5-large-v2": 1300,
+}
+
+
+class FakeMemory:
+    """Simulates RAM + VRAM usage of loaded models."""
+
+    def __init__(self) -> None:
+        self.used_mb: float = 0.0
+
+    def usage(self) -> Optional[float]:
+        return self.used_mb
+
+
+class FakeGenerator:
+    def __init__(self, key: str, memory: FakeMemory) -> None:
+        self.key = key
+        self.memory = memory
+        sleep(0.001)  # Simulates loading weights
+        memory.used_mb += MODEL_SIZES_MB[key]
+
+    def __del__(self) -> None:
+        if self.memory is not None:
+            self.memory.used_mb -= MODEL_SIZES_MB[self.key]
+            self.memory = None
+
+
+def make_pool(memory: FakeMemory, **kwargs) -> GeneratorPool[FakeGenerator]:
+    return GeneratorPool(
+        memory_usage_getter=memory.usage,
+        deallocator=lambda item: item.__del__(),
+        **kwargs,
+    )
+
+
+def replay(
+    pool: GeneratorPool[FakeGenerator], memory: FakeMemory, trace: list[str]
+) -> None:
+    for key in trace:
+        generator = pool.get_or_load(
+            key, loader=lambda: FakeGenerator(key, memory)
+        )
+        assert generator.key == key
+
+
+def make_mixed_trace(n_requests: int, seed: int = 0) -> list[str]:
+    """Mostly chat with one model, with embeddings and other models in between."""
+    rng = Random(seed)
+    return rng.choices(
+        list(MODEL_SIZES_MB.keys()), weights=[6, 1, 1, 4], k=n_requests
+    )
+
+
+@pytest.mark.parametrize("n_requests", [1000])
+def test_generator_pool_replay_benchmark(n_requests: int, test_logger):
+    trace = make_mixed_trace(n_requests)
+
+    # Baseline: one resident model, like `deque(maxlen=1)`
+    memory = FakeMemory()
+    single = make_pool(memory, max_items=1)
+    start = perf_counter()
+    replay(single, memory, trace)
+    single_elapsed = perf_counter() - start
+
+    memory = FakeMemory()
+    pooled = make_pool(memory, memory_budget_mb=14000, policy="lfu")
+    start = perf_counter()
+    replay(pooled, memory, trace)
+    pooled_elapsed = perf_counter() - start
+
+    test_logger.info(
+        f"Replayed {n_requests} requests.\n"
+        f"- Single resident model: {single.stats}, {single_elapsed:.3f}s\n"
+        f"- Memory-budgeted pool: {pooled.stats}, {pooled_elapsed:.3f}s"
+    )
+    assert pooled.stats.loads < single.stats.loads / 5
+    assert pooled.used_memory_mb <= 14000
+    assert memory.used_mb == pooled.used_memory_mb
+
+
+def test_generator_pool_eviction():
+    memory = FakeMemory()
+    busy: set[str] = set()
+    pool = make_pool(
+        memory,
+        memory_budget_mb=9000,
+        pinned=["embedding:intfloat/e5-large-v2"],
+        can_evict=lambda key: key not in busy,
+    )
+    replay(pool, memory, ["embedding:intfloat/e5-large-v2", "completion:llama_7b"])
+    assert memory.used_mb == 5300
+
+    # A pinned model is kept, and the least recently used model is evicted
+    replay(pool, memory, ["completion:mistral_7b"])
+    assert pool.keys() == [
+        "embedding:intfloat/e5-large-v2",
+        "completion:mistral_7b",
+    ]
+
+    # The size measured before is used to make room before loading again
+    replay(pool, memory, ["completion:llama_7b"])
+    assert "completion:mistral_7b" not in pool
+    assert memory.used_mb == 5300
+
+    # Models in use are not evicted, so another model is not loaded past the budget
+    busy.add("completion:llama_7b")
+    with pytest.raises(GeneratorPoolFullError):
+        replay(pool, memory, ["completion:mistral_7b"])
+    assert pool.keys() == [
+        "embedding:intfloat/e5-large-v2",
+        "completion:llama_7b",
+    ]
+    assert memory.used_mb == 5300
+    assert pool.stats.loads == 4
+
+    # Loaded once the model in use is released
+    busy.clear()
+    replay(pool, memory, ["completion:mistral_7b"])
+    assert "completion:llama_7b" not in pool
+    assert memory.used_mb == 5300
+    assert pool.stats.loads == 5
+
+
+def test_generator_pool_without_budget():
+    # Keeps one model at a time, like before, as the memory is not checked
+    memory = FakeMemory()
+    pool = make_pool(memory)
+    replay(pool, memory, ["completion:llama_7b", "completion:mistral_7b"])
+    assert pool.keys() == ["completion:mistral_7b"]
+
+    pool = make_pool(memory, max_items=2)
+    replay(pool, memory, ["completion:llama_7b", "completion:mistral_7b"])
+    assert len(pool) == 2
+
+
+def test_generator_pool_waits_for_busy_model():
+    # Model A is streaming in its lane, while model B is requested
+    memory = FakeMemory()
+    busy: set[str] = {"completion:llama_7b"}
+    pool = make_pool(memory, can_evict=lambda key: key not in busy)
+    replay(pool, memory, ["completion:llama_7b"])
+    n_loads: list[int] = []
+
+    def load_mistral() -> FakeGenerator:
+        n_loads.append(1)
+        return FakeGenerator("completion:mistral_7b", memory)
+
+    with pytest.raises(GeneratorPoolFullError):
+        pool.get_or_load("completion:mistral_7b", loader=load_mistral)
+    assert not n_loads
+    assert pool.keys() == ["completion:llama_7b"]
+    assert memory.used_mb == MODEL_SIZES_MB["completion:llama_7b"]
+
+    busy.clear()
+    pool.get_or_load("completion:mistral_7b", loader=load_mistral)
+    assert pool.keys() == ["completion:mistral_7b"]
+    assert memory.used_mb == MODEL_SIZES_MB["completion:mistral_7b"]
@@ -0,0 +1,144 @@
+import asyncio
+from time import perf_counter, sleep
+
+import pytest
+
+from app.utils.chat.ingestion import IngestionPipeline, IngestionProgress
+
+# Stands in for the elements partitioned from a 500-page PDF
+PAGES: list[str] = [
+    f"Page {page_idx}. "
+    + " ".join(f"Sentence {idx} of page {page_idx}." for idx in range(80))
+    for page_idx in range(500)
+]
+
+
+def split_text(text: str, chunk_size: int = 1000) -> list[str]:
+    sleep(len(text) / 5e8)  # Tokenizing takes time, too
+    return [
+        text[start : start + chunk_size]
+        for start in range(0, len(text), chunk_size)
+    ]
+
+
+class FakeVectorstore:
+    """Embeds and upserts with a fixed latency per batch."""
+
+    def __init__(
+        self, seconds_per_embedding: float, seconds_per_upsert: float
+    ) -> None:
+        self.seconds_per_embedding = seconds_per_embedding
+        self.seconds_per_upsert = seconds_per_upsert
+        self.points: dict[str, list[float]] = {}
+        self.n_running: int = 0
+        self.max_running: int = 0
+
+    async def _run(self, seconds: float) -> None:
+        self.n_running += 1
+        self.max_running = max(self.max_running, self.n_running)
+        await asyncio.sleep(seconds)
+        self.n_running -= 1
+
+    async def embed(self, texts: list[str]) -> list[list[float]]:
+        await self._run(self.seconds_per_embedding)
+        return [[float(len(text))] for text in texts]
+
+    async def upsert(
+        self, texts: list[str], embeddings: list[list[float]]
+    ) -> None:
+        await self._run(self.seconds_per_upsert)
+        self.points.update(zip(texts, embeddings))
+
+
+@pytest.mark.asyncio
+async def test_ingestion_pipeline(test_logger):
+    batch_size: int = 64
+    store = FakeVectorstore(
+        seconds_per_embedding=0.02, seconds_per_upsert=0.01
+    )
+
+    # Baseline: split the whole document, then embed and upsert one by one
+    start = perf_counter()
+    chunks: list[str] = split_text("\n\n".join(PAGES))
+    for batch_start in range(0, len(chunks), batch_size):
+        batch = chunks[batch_start : batch_start + batch_size]
+        await store.upsert(batch, await store.embed(batch))
+    sequential_elapsed = perf_counter() - start
+
+    progresses: list[tuple[int, int, bool]] = []
+
+    async def on_progress(progress: IngestionProgress) -> None:
+        progresses.append(
+            (progress.n_upserted, progress.n_chunks, progress.is_split)
+        )
+
+    store = FakeVectorstore(
+        seconds_per_embedding=0.02, seconds_per_upsert=0.01
+    )
+    start = perf_counter()
+    progress = await IngestionPipeline(
+        texts=iter(PAGES),
+        split_text=split_text,
+        embed=store.embed,
+        upsert=store.upsert,
+        on_progress=on_progress,
+        batch_size=batch_size,
+        embed_concurrency=4,
+        upsert_concurrency=2,
+        queue_size=4,
+        progress_interval=0.0,
+    ).run()
+    elapsed = perf_counter() - start
+
+    # Every chunk is upserted once, whatever the order
+    assert progress.is_done
+    assert progress.n_chunks == progress.n_embedded == len(store.points)
+    assert progress.first_chunk is not None
+    assert progress.first_chunk.startswith("Page 0.")
+    assert all(
+        embedding == [float(len(text))]
+        for text, embedding in store.points.items()
+    )
+    assert store.max_running > 1  # Stages overlap
+
+    # Progress is reported as chunks are upserted
+    assert progresses[-1] == (progress.n_chunks, progress.n_chunks, True)
+    assert [n_upserted for n_upserted, _, _ in progresses] == sorted(
+        n_upserted for n_upserted, _, _ in progresses
+    )
+
+    test_logger.info(
+        f"Ingesting {len(PAGES)} pages into {progress.n_chunks} chunks: "
+        f"{sequential_elapsed:.2f}s sequentially -> {elapsed:.2f}s pipelined"
+    )
+    assert elapsed < sequential_elapsed
+
+
+@pytest.mark.asyncio
+async def test_ingestion_pipeline_failure():
+    store = FakeVectorstore(seconds_per_embedding=0.0, seconds_per_upsert=0.0)
+    n_upserts: int = 0
+
+    async def failing_upsert(
+        texts: list[str], embeddings: list[list[float]]
+    ) -> None:
+        nonlocal n_upserts
+        n_upserts += 1
+        if n_upserts == 3:
+            raise RuntimeError("Qdrant is down")
+        await store.upsert(texts, embeddings)
+
+    # A failing stage stops the others, instead of blocking on a full queue
+    with pytest.raises(RuntimeError):
+        await asyncio.wait_for(
+            IngestionPipeline(
+                texts=iter(PAGES),
+                split_text=split_text,
+                embed=store.embed,
+                upsert=failing_upsert,
+                batch_size=8,
+                queue_size=1,
+            ).run(),
+            timeout=10,
+        )
+    assert n_upserts == 3
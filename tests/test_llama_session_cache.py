@@ -0,0 +1,70 @@
+from dataclasses import dataclass
+
+from app.utils.chat.text_generations.session_cache import LlamaSessionCache
+
+
+@dataclass
+class FakeState:
+    name: str
+    llama_state_size: int = 100
+
+
+def test_session_cache_prefix_matching():
+    cache = LlamaSessionCache()
+    cache.save([1, 2, 3, 4], FakeState("a"))
+    cache.save([1, 2, 9], FakeState("b"))
+
+    # Without a session, the state with the longest prefix is loaded
+    state = cache.load([1, 2, 3, 4, 5, 6])
+    assert state is not None and state.name == "a"
+    assert (cache.hits, cache.saved_tokens) == (1, 4)
+
+    # Nothing shares a prefix
+    assert cache.load([7, 8]) is None
+    assert cache.misses == 1
+
+    # The model already evaluated the prefix, so nothing is loaded or counted
+    assert cache.load([1, 2, 3, 4, 5], evaluated_ids=[1, 2, 3, 4]) is None
+    assert (cache.hits, cache.misses, cache.saved_tokens) == (1, 2, 4)
+
+
+def test_session_cache_per_session_lookup():
+    cache = LlamaSessionCache()
+    system_prompt = [1, 2, 3]
+    cache.save(system_prompt + [10, 11], FakeState("alice"), session_id="alice")
+    cache.save(system_prompt + [20, 21, 22], FakeState("bob"), session_id="bob")
+
+    # Sessions sharing the system prompt don't overwrite each other
+    state = cache.load(system_prompt + [10, 11, 12], session_id="alice")
+    assert state is not None and state.name == "alice"
+    state = cache.load(system_prompt + [20, 21, 22, 23], session_id="bob")
+    assert state is not None and state.name == "bob"
+
+    # The own session is preferred, even if another shares a longer prefix
+    state = cache.load(system_prompt + [20, 21, 22], session_id="alice")
+    assert state is not None and state.name == "alice"
+
+    # A new session falls back to the longest prefix
+    state = cache.load(system_prompt + [20, 30], session_id="carol")
+    assert state is not None and state.name == "bob"
+
+    # The follow-up turn replaces the previous state of the session
+    cache.save(system_prompt + [10, 11, 12], FakeState("alice2"), "alice")
+    assert len(cache.cache_state) == 2
+    state = cache.load(system_prompt + [10, 11, 12, 13], session_id="alice")
+    assert state is not None and state.name == "alice2"
+
+
+def test_session_cache_lru_eviction():
+    cache = LlamaSessionCache(capacity_bytes=250)
+    cache.save([1], FakeState("a"), session_id="a")
+    cache.save([2], FakeState("b"), session_id="b")
+    assert cache.load([1, 5], session_id="a") is not None  # `a` is used
+
+    cache.save([3], FakeState("c"), session_id="c")
+    assert list(cache.cache_state) == ["a", "c"]
+    assert cache.cache_size == 200
+
+    # The latest state is kept, even if it exceeds the capacity alone
+    cache.save([4], FakeState("d", llama_state_size=300), session_id="d")
+    assert list(cache.cache_state) == ["d"]
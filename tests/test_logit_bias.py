@@ -0,0 +1,89 @@
+from time import perf_counter
+
+import numpy as np
+import pytest
+
+from app.utils.chat.text_generations.logit_bias import (
+    make_logit_bias_processor,
+)
+
+
+class FakeLlama:
+    model_path: str = "fake-model.bin"
+
+    def __init__(self) -> None:
+        self.n_tokenize_calls: int = 0
+
+    def tokenize(self, text: bytes, add_bos: bool = True) -> list[int]:
+        self.n_tokenize_calls += 1
+        return [byte + 3 for byte in text]
+
+
+def legacy_logit_bias_processor(to_bias: dict[int, float]):
+    """The previous processor, looping over all scores in Python."""
+
+    def logit_bias_processor(
+        input_ids: list[int], scores: list[float]
+    ) -> list[float]:
+        new_scores: list[float] = [0.0] * len(scores)
+        for input_id, score in enumerate(scores):
+            new_scores[input_id] = score + to_bias.get(input_id, 0.0)
+        return new_scores
+
+    return logit_bias_processor
+
+
+def test_logit_bias_processor():
+    llama = FakeLlama()
+    scores = np.random.default_rng(0).standard_normal(32000).astype(np.single)
+
+    processor = make_logit_bias_processor(
+        llama, {"1": 100.0, "31999": -100.0}, "input_ids"  # type: ignore
+    )
+    biased: np.ndarray = processor([], scores.copy())  # type: ignore
+    assert biased[1] == pytest.approx(scores[1] + 100.0)
+    assert biased[31999] == pytest.approx(scores[31999] - 100.0)
+    assert np.array_equal(biased[2:31999], scores[2:31999])
+
+    # Scores given as a list
+    biased_list: list[float] = processor([], scores.tolist())  # type: ignore
+    assert biased_list == pytest.approx(biased.tolist())
+
+    # `tokens` mode is tokenized once per model and bias map
+    bias: dict[str, float] = {"ab": 5.0}
+    for _ in range(3):
+        processor = make_logit_bias_processor(llama, bias, "tokens")  # type: ignore
+    assert llama.n_tokenize_calls == 1
+    biased = processor([], scores.copy())  # type: ignore
+    assert biased[ord("a") + 3] == pytest.approx(scores[ord("a") + 3] + 5.0)
+
+
+@pytest.mark.parametrize("vocab_size", [32000])
+def test_logit_bias_processor_benchmark(vocab_size: int, test_logger):
+    n_tokens: int = 100
+    to_bias: dict[int, float] = {idx: -100.0 for idx in range(0, vocab_size, 100)}
+    scores = np.random.default_rng(0).standard_normal(vocab_size).astype(np.single)
+
+    legacy = legacy_logit_bias_processor(to_bias)
+    scores_list: list[float] = scores.tolist()
+    start = perf_counter()
+    for _ in range(n_tokens):
+        legacy_result = legacy([], scores_list)
+    legacy_latency = (perf_counter() - start) / n_tokens
+
+    processor = make_logit_bias_processor(
+        FakeLlama(),  # type: ignore
+        {str(idx): score for idx, score in to_bias.items()},
+        "input_ids",
+    )
+    start = perf_counter()
+    for _ in range(n_tokens):
+        result = processor([], scores.copy())  # type: ignore
+    latency = (perf_counter() - start) / n_tokens
+
+    test_logger.info(
+        f"Logit bias per token ({vocab_size} vocab, {len(to_bias)} biased): "
+        f"{legacy_latency * 1e6:.0f}us -> {latency * 1e6:.0f}us"
+    )
+    assert result.tolist() == pytest.approx(legacy_result)
+    assert latency * 10 < legacy_latency
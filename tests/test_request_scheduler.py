@@ -0,0 +1,97 @@
+import asyncio
+from time import perf_counter, sleep
+from typing import Iterator
+
+import pytest
+from starlette.concurrency import iterate_in_threadpool
+
+from app.utils.chat.text_generations.scheduler import (
+    RequestScheduler,
+    SchedulerQueueFullError,
+)
+
+
+def fake_generator(n_tokens: int, seconds_per_token: float) -> Iterator[str]:
+    """A fake completion generator, which blocks the thread like a real model."""
+    for token_idx in range(n_tokens):
+        sleep(seconds_per_token)
+        yield f"token{token_idx} "
+
+
+@pytest.mark.asyncio
+async def test_request_scheduler_load(test_logger):
+    n_requests: int = 48
+    scheduler = RequestScheduler(
+        concurrency={"completion": 2, "embedding": 4}, max_queue_size=32
+    )
+
+    async def completion_request(priority: int) -> str:
+        async with scheduler.acquire("completion", priority=priority):
+            return "".join(
+                [
+                    token
+                    async for token in iterate_in_threadpool(
+                        fake_generator(n_tokens=10, seconds_per_token=0.001)
+                    )
+                ]
+            )
+
+    async def embedding_request() -> float:
+        started_at: float = perf_counter()
+        async with scheduler.acquire("embedding"):
+            await asyncio.sleep(0.001)
+        return perf_counter() - started_at
+
+    # Embeddings are requested while completions are queued
+    results, embedding_latencies = await asyncio.gather(
+        asyncio.gather(
+            *[completion_request(priority=i % 2) for i in range(n_requests)],
+            return_exceptions=True,
+        ),
+        asyncio.gather(*[embedding_request() for _ in range(8)]),
+    )
+    metrics = scheduler.metrics
+    test_logger.info(f"Scheduler metrics: {metrics}")
+    test_logger.info(
+        f"Embedding latency: max {max(embedding_latencies):.4f}s"
+    )
+
+    # 2 requests run at once and 32 requests wait, so the rest are rejected
+    rejected = [r for r in results if isinstance(r, SchedulerQueueFullError)]
+    completed = [r for r in results if isinstance(r, str)]
+    assert len(rejected) == n_requests - 2 - 32
+    assert len(completed) == 2 + 32
+    assert metrics["completion"]["rejected"] == len(rejected)
+    assert metrics["completion"]["completed"] == len(completed)
+    assert metrics["completion"]["running"] == 0
+    assert metrics["completion"]["queued"] == 0
+    assert metrics["completion"]["max_wait_time"] > 0
+    assert metrics["embedding"]["completed"] == 8
+    # Embeddings do not wait for the completion queue to drain
+    assert max(embedding_latencies) < metrics["completion"]["max_wait_time"]
+
+
+@pytest.mark.asyncio
+async def test_request_scheduler_priority_and_cancellation():
+    scheduler = RequestScheduler(default_concurrency=1, max_queue_size=8)
+    order: list[str] = []
+
+    async def request(name: str, priority: int) -> None:
+        async with scheduler.acquire("completion", priority=priority):
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    first = asyncio.create_task(request("first", priority=0))
+    await asyncio.sleep(0)
+    low = asyncio.create_task(request("low", priority=1))
+    cancelled = asyncio.create_task(request("cancelled", priority=0))
+    high = asyncio.create_task(request("high", priority=0))
+    await asyncio.sleep(0)
+    cancelled.cancel()
+    await asyncio.gather(first, low, high, cancelled, return_exceptions=True)
+
+    # Higher priority (lower value) first, and cancelled waiters are skipped
+    assert order == ["first", "high", "low"]
+    assert scheduler.metrics["completion"]["running"] == 0
+    assert scheduler.metrics["completion"]["queued"] == 0
+    assert not scheduler.is_busy("completion")
@@ -0,0 +1,125 @@
+from random import Random
+from re import Pattern, compile
+from time import perf_counter
+from typing import Iterator
+
+import pytest
+from orjson import dumps, loads
+
+from app.utils.api.sse import ServerSentEventParser
+
+legacy_pattern: Pattern = compile(r"data:\s*({.+?})\s*\r?\n\s*\r?\n")
+
+
+def record_stream(
+    n_events: int, line_ending: bytes = b"\n"
+) -> tuple[bytes, list[dict]]:
+    """A stream like the ones recorded from OpenAI and llama.cpp servers."""
+    events: list[bytes] = []
+    chunks: list[dict] = []
+    for idx in range(n_events):
+        chunk = {
+            "id": "chatcmpl-7aBcD",
+            "object": "chat.completion.chunk",
+            "created": 1690000000,
+            "model": "gpt-3.5-turbo-0613",
+            "choices": [
+                {
+                    "index": 0,
+                    "delta": {"content": f" token{idx} 가나다"},
+                    "finish_reason": None,
+                }
+            ],
+        }
+        chunks.append(chunk)
+        events.append(b"data: " + dumps(chunk) + line_ending * 2)
+    events.append(b"data: [DONE]" + line_ending * 2)
+    return b"".join(events), chunks
+
+
+def split_into_chunks(stream: bytes, seed: int = 0) -> Iterator[bytes]:
+    """Split at random positions, like TCP segments, even inside multibyte characters."""
+    rng = Random(seed)
+    cursor: int = 0
+    while cursor < len(stream):
+        size = rng.randint(1, 512)
+        yield stream[cursor : cursor + size]
+        cursor += size
+
+
+def legacy_parse(chunks: list[bytes]) -> list[dict]:
+    """The previous parser, decoding and scanning the whole buffer at every chunk.
+    It drops an event whenever a chunk ends in the middle of it."""
+    results: list[dict] = []
+    stream_buffer: bytes = b""
+    for stream in chunks:
+        stream_buffer += stream
+        try:
+            text = stream_buffer.decode("utf-8")
+        except UnicodeDecodeError:
+            continue
+        for match in legacy_pattern.finditer(text):
+            try:
+                results.append(loads(match.group(1)))
+                stream_buffer = b""
+            except Exception:
+                continue
+    return results
+
+
+def parse(chunks: list[bytes]) -> list[dict]:
+    parser = ServerSentEventParser()
+    results: list[dict] = []
+    for chunk in chunks:
+        results.extend(parser.feed(chunk))
+    results.extend(parser.close())
+    return results
+
+
+def test_sse_parser():
+    parser = ServerSentEventParser()
+    assert parser.feed(b": keep-alive comment\n\n") == []
+    assert parser.feed(b'event: message\ndata: {"a":') == []
+    assert parser.feed(b" 1}\r\n\r\n") == [{"a": 1}]
+    # Multi-line data is joined with a newline
+    assert parser.feed(b'data: {"b":\ndata: [1,\ndata: 2]}\n\n') == [
+        {"b": [1, 2]}
+    ]
+    # Malformed data is skipped
+    assert parser.feed(b"data: {oops\n\ndata: {}\n\n") == [{}]
+    assert parser.feed(b"data: [DONE]\n\ndata: {}\n\n") == []
+    assert parser.done
+
+    # The last event without a blank line
+    parser = ServerSentEventParser()
+    assert parser.feed(b'data: {"c": 3}') == []
+    assert parser.close() == [{"c": 3}]
+
+    # A line too long is dropped, and the buffer does not grow
+    parser = ServerSentEventParser(max_line_size=16)
+    assert parser.feed(b"data: " + b"x" * 32) == []
+    assert parser.feed(b"x" * 32 + b"\n\ndata: {}\n\n") == [{}]
+    assert len(parser._buffer) == 0
+
+
+@pytest.mark.parametrize("line_ending", [b"\n", b"\r\n"])
+def test_sse_parser_benchmark(line_ending: bytes, test_logger):
+    n_events: int = 2000
+    stream, expected = record_stream(n_events, line_ending)
+    chunks = list(split_into_chunks(stream))
+
+    start = perf_counter()
+    legacy = legacy_parse(chunks)
+    legacy_elapsed = perf_counter() - start
+
+    start = perf_counter()
+    parsed = parse(chunks)
+    elapsed = perf_counter() - start
+
+    test_logger.info(
+        f"Parsed {n_events} events in {len(chunks)} chunks: "
+        f"{n_events / legacy_elapsed:.0f} events/s (regex) -> "
+        f"{n_events / elapsed:.0f} events/s"
+    )
+    assert parsed == expected
+    assert len(legacy) < n_events
@@ -0,0 +1,132 @@
+from random import Random
+from time import perf_counter
+from typing import Iterator
+
+import pytest
+
+from app.utils.chat.text_generations import BaseCompletionGenerator
+from app.utils.chat.text_generations.streaming import (
+    IncrementalDetokenizer,
+    StopStringMatcher,
+)
+
+# A sentencepiece-like vocabulary: "▁" is a space, and "가" is split into 3 byte tokens
+VOCAB: list[bytes] = [
+    "▁Hello".encode(),
+    "▁world".encode(),
+    ",".encode(),
+    "▁#".encode(),
+    "##".encode(),
+    "▁User".encode(),
+    ":".encode(),
+    "▁the".encode(),
+    "ing".encode(),
+    *[bytes([byte]) for byte in "가".encode()],
+]
+BYTE_TOKENS: list[int] = [9, 10, 11]
+
+
+def decode(token_ids: list[int]) -> str:
+    text = (
+        b"".join(VOCAB[token_id] for token_id in token_ids)
+        .decode("utf-8", errors="replace")
+        .replace("▁", " ")
+    )
+    return text[1:] if text.startswith(" ") else text
+
+
+def random_token_ids(n_tokens: int, seed: int = 0) -> list[int]:
+    """Random text, without `### User:`"""
+    rng = Random(seed)
+    token_ids: list[int] = []
+    while len(token_ids) < n_tokens:
+        if rng.random() < 0.1:
+            token_ids.extend(BYTE_TOKENS)
+        else:
+            token_ids.append(rng.choice([0, 1, 2, 4, 6, 7, 8]))
+    return token_ids[:n_tokens]
+
+
+def legacy_stream(token_ids: list[int], stops: list[str]) -> Iterator[str]:
+    """The previous implementation, decoding the whole completion after every token."""
+    text_cursor: int = 0
+    for n_tokens in range(1, len(token_ids) + 1):
+        decoded_text = decode(token_ids[:n_tokens])
+        if BaseCompletionGenerator.is_possible_to_generate_stops(
+            decoded_text, stops=stops
+        ):
+            for stop in stops:
+                if stop in decoded_text:
+                    return
+            continue
+        text_piece = decoded_text[text_cursor:]
+        if "�" in text_piece:
+            continue
+        yield text_piece
+        text_cursor += len(text_piece)
+
+
+def test_incremental_detokenizer():
+    token_ids = random_token_ids(500)
+    detokenizer = IncrementalDetokenizer(decode)
+    streamed = "".join(detokenizer.push(token_id) for token_id in token_ids)
+    assert streamed + detokenizer.flush() == decode(token_ids)
+    assert "�" not in streamed
+
+
+def test_stop_string_matcher():
+    matcher = StopStringMatcher(["### User:", "User:", "abcd", "bc"])
+    assert matcher.push("Hello ##") == ("Hello ", False)
+    assert matcher.push("# Us") == ("", False)
+    assert matcher.push("er: Hi") == ("", True)
+
+    # Overlapping stops: "bc" is found inside "abcd" first
+    matcher = StopStringMatcher(["abcd", "bc"])
+    assert matcher.push("xab") == ("x", False)
+    assert matcher.push("cd") == ("a", True)
+
+    # Held text is released when it turns out not to be a stop
+    matcher = StopStringMatcher(["### User:"])
+    assert matcher.push("a ###") == ("a ", False)
+    assert matcher.push(" Assistant") == ("### Assistant", False)
+    assert matcher.push(" #") == (" ", False)
+    assert matcher.flush() == "#"
+
+
+def test_stream_text_with_stops():
+    token_ids = random_token_ids(300) + [3, 4, 5, 6] + random_token_ids(50)
+    stops = BaseCompletionGenerator.get_stop_strings("User")
+    streamed = "".join(
+        BaseCompletionGenerator.stream_text_with_stops(
+            token_ids, decode=decode, stops=stops
+        )
+    )
+    full_text = decode(token_ids)
+    assert streamed == full_text[: full_text.index("### User:")]
+
+
+@pytest.mark.parametrize("n_tokens", [2000])
+def test_streaming_benchmark(n_tokens: int, test_logger):
+    token_ids = random_token_ids(n_tokens)
+    stops = BaseCompletionGenerator.get_stop_strings(
+        "User", "System", "Assistant"
+    )
+
+    start = perf_counter()
+    legacy = "".join(legacy_stream(token_ids, stops=stops))
+    legacy_elapsed = perf_counter() - start
+
+    start = perf_counter()
+    streamed = "".join(
+        BaseCompletionGenerator.stream_text_with_stops(
+            token_ids, decode=decode, stops=stops
+        )
+    )
+    elapsed = perf_counter() - start
+
+    test_logger.info(
+        f"Streaming {n_tokens} tokens with {len(stops)} stops: "
+        f"{legacy_elapsed * 1000:.1f}ms -> {elapsed * 1000:.1f}ms"
+    )
+    assert streamed == legacy == decode(token_ids)
+    assert elapsed * 10 < legacy_elapsed
@@ -0,0 +1,136 @@
+import asyncio
+import gc
+from threading import Event, current_thread
+from time import perf_counter, sleep
+from typing import AsyncIterator, Iterator
+
+import pytest
+from starlette.concurrency import iterate_in_threadpool
+
+from app.utils.concurrency import SyncToAsyncIterator
+
+
+def fake_generator(
+    n_tokens: int, seconds_per_token: float = 0.0
+) -> Iterator[str]:
+    for token_idx in range(n_tokens):
+        if seconds_per_token:
+            sleep(seconds_per_token)
+        yield f"token{token_idx}"
+
+
+async def run_in_executor_per_item(
+    iterator: Iterator[str],
+) -> AsyncIterator[str]:
+    """The previous `SyncToAsyncGenerator`, with a thread hop for every item."""
+    loop = asyncio.get_running_loop()
+    sentinel = object()
+    while True:
+        item = await loop.run_in_executor(None, next, iterator, sentinel)
+        if item is sentinel:
+            return
+        yield item  # type: ignore
+
+
+@pytest.mark.asyncio
+async def test_sync_to_async_iterator():
+    assert [
+        token
+        async for token in SyncToAsyncIterator(
+            fake_generator(1000), max_buffer_size=7
+        )
+    ] == list(fake_generator(1000))
+
+    # Exceptions are raised to the consumer
+    def failing_generator() -> Iterator[str]:
+        yield "token0"
+        raise ValueError("Failed")
+
+    tokens: list[str] = []
+    with pytest.raises(ValueError):
+        async for token in SyncToAsyncIterator(failing_generator()):
+            tokens.append(token)
+    assert tokens == ["token0"]
+
+
+@pytest.mark.asyncio
+async def test_sync_to_async_iterator_cancellation():
+    closed_in: list[str] = []
+    is_closed = Event()
+
+    def endless_generator() -> Iterator[str]:
+        try:
+            while True:
+                sleep(0.001)
+                yield "token"
+        finally:
+            closed_in.append(current_thread().name)
+            is_closed.set()
+
+    # Breaking out of the loop, and closing the iterator
+    async_iterator = SyncToAsyncIterator(
+        endless_generator(), thread_name="producer"
+    )
+    async for _ in async_iterator:
+        break
+    async_iterator.close()
+    assert await asyncio.to_thread(is_closed.wait, 1)
+    assert closed_in == ["producer"]
+
+    # Cancelling the consumer
+    is_closed.clear()
+
+    async def consume() -> None:
+        async for _ in SyncToAsyncIterator(endless_generator()):
+            pass
+
+    task = asyncio.create_task(consume())
+    await asyncio.sleep(0.02)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert await asyncio.to_thread(is_closed.wait, 1)
+
+    # Abandoning the iterator while the thread waits on the full buffer
+    is_closed.clear()
+    async_iterator = SyncToAsyncIterator(
+        endless_generator(), max_buffer_size=2
+    )
+    await async_iterator.__anext__()
+    await asyncio.sleep(0.02)
+    del async_iterator
+    gc.collect()
+    assert await asyncio.to_thread(is_closed.wait, 1)
+
+
+@pytest.mark.parametrize(
+    "n_tokens, seconds_per_token", [(20000, 0.0), (500, 0.001)]
+)
+@pytest.mark.asyncio
+async def test_sync_to_async_benchmark(
+    n_tokens: int, seconds_per_token: float, test_logger
+):
+    results: dict[str, float] = {}
+    for name, bridge in (
+        ("run_in_executor", run_in_executor_per_item),
+        ("iterate_in_threadpool", iterate_in_threadpool),
+        ("SyncToAsyncIterator", SyncToAsyncIterator),
+    ):
+        start = perf_counter()
+        tokens = [
+            token
+            async for token in bridge(
+                fake_generator(n_tokens, seconds_per_token)
+            )
+        ]
+        results[name] = n_tokens / (perf_counter() - start)
+        assert len(tokens) == n_tokens
+
+    test_logger.info(
+        f"{n_tokens} tokens, {seconds_per_token * 1000:.0f}ms per token: "
+        + ", ".join(
+            f"{name} {tokens_per_second:.0f} tokens/s"
+            for name, tokens_per_second in results.items()
+        )
+    )
+    assert results["SyncToAsyncIterator"] > results["run_in_executor"]
@@ -0,0 +1,163 @@
+import time
+
+import pytest
+
+from app.models.chat_models import (
+    ChatRoles,
+    MessageHistory,
+    MessageHistoryList,
+    UserChatContext,
+)
+from app.models.llm_tokenizers import BaseTokenizer, TokenizationCache
+from app.utils.chat.tokens import cutoff_message_histories
+
+
+def _make_message_histories(n: int) -> list[MessageHistory]:
+    return [
+        MessageHistory(role=ChatRoles.USER.value, content=f"{i}", tokens=i)
+        for i in range(n)
+    ]
+
+
+def test_incremental_token_accounting():
+    context: UserChatContext = UserChatContext.construct_default(
+        user_id="test_user", chat_room_id="test_chat_room"
+    )
+    assert isinstance(context.user_message_histories, MessageHistoryList)
+
+    histories = context.user_message_histories
+    histories.extend(_make_message_histories(10))
+    assert context.user_message_tokens == sum(range(10))
+    assert histories.tokens_of_last(3) == 7 + 8 + 9
+    assert histories.tokens_of_last(100) == sum(range(10))
+
+    histories.pop()
+    histories.pop(0)
+    del histories[0]
+    histories.insert(0, MessageHistory(role="user", content="x", tokens=100))
+    histories[-1] = MessageHistory(role="user", content="y", tokens=50)
+    assert context.user_message_tokens == sum(m.tokens for m in histories)
+
+    histories[0].tokens = 1
+    histories.recalculate_tokens()
+    assert context.user_message_tokens == sum(m.tokens for m in histories)
+
+    context.user_message_histories = _make_message_histories(5)
+    assert isinstance(context.user_message_histories, MessageHistoryList)
+    assert context.user_message_tokens == sum(range(5))
+    context.user_message_histories.clear()
+    assert context.user_message_tokens == 0
+
+
+def test_token_accounting_benchmark(test_logger):
+    n_messages: int = 10000
+    n_reads: int = 1000
+    plain: list[MessageHistory] = _make_message_histories(n_messages)
+    accounted: MessageHistoryList = MessageHistoryList(plain)
+
+    start: float = time.perf_counter()
+    for _ in range(n_reads):
+        sum([m.tokens for m in plain])
+    summed: float = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(n_reads):
+        accounted.tokens
+    incremental: float = time.perf_counter() - start
+
+    test_logger.info(
+        f"{n_reads} reads of {n_messages} messages: sum {summed * 1000:.2f}ms, "
+        f"incremental {incremental * 1000:.2f}ms"
+    )
+    assert accounted.tokens == sum(m.tokens for m in plain)
+
+
+@pytest.mark.parametrize("n_messages", [100, 1000, 10000])
+def test_cutoff_message_histories_benchmark(n_messages: int, test_logger):
+    context: UserChatContext = UserChatContext.construct_default(
+        user_id="test_user", chat_room_id="test_chat_room"
+    )
+    messages: list[MessageHistory] = [
+        MessageHistory(
+            role=role.value, content=f"{i}", tokens=10, timestamp=i
+        )
+        for i, role in zip(
+            range(n_messages),
+            [ChatRoles.USER, ChatRoles.AI, ChatRoles.SYSTEM] * n_messages,
+        )
+    ]
+    user_message_histories = messages[0::3]
+    ai_message_histories = messages[1::3]
+    system_message_histories = messages[2::3]
+    token_limit: int = 10 * n_messages // 2
+
+    start: float = time.perf_counter()
+    users, ais, systems = cutoff_message_histories(
+        user_chat_context=context,
+        user_message_histories=user_message_histories,
+        ai_message_histories=ai_message_histories,
+        system_message_histories=system_message_histories,
+        token_limit=token_limit,
+    )
+    elapsed: float = time.perf_counter() - start
+    test_logger.info(f"Cutoff of {n_messages} messages: {elapsed * 1000:.3f}ms")
+
+    assert all(m in user_message_histories for m in users)
+    assert all(m in ai_message_histories for m in ais)
+    assert sum(m.tokens for m in users + ais + systems) <= token_limit + sum(
+        m.tokens for m in systems if m.is_prefix or m.is_suffix
+    )
+    selected = sorted(
+        users + ais + [m for m in systems if not m.is_prefix and not m.is_suffix],
+        key=lambda m: m.timestamp,
+    )
+    assert selected == messages[len(messages) - len(selected) :]
+
+
+class WhitespaceTokenizer(BaseTokenizer):
+    """Tokenizer that counts how many times it was called"""
+
+    def __init__(self, model_name: str):
+        self._model_name = model_name
+        self.n_encode_calls: int = 0
+
+    @property
+    def tokenizer(self) -> None:
+        return None
+
+    @property
+    def model_name(self) -> str:
+        return self._model_name
+
+    def encode(self, message: str) -> list[int]:
+        self.n_encode_calls += 1
+        return [len(word) for word in message.split()]
+
+    def decode(self, tokens: list[int]) -> str:
+        return " ".join("x" * token for token in tokens)
+
+
+def test_tokenization_cache(monkeypatch):
+    monkeypatch.setattr(BaseTokenizer, "cache", TokenizationCache(maxsize=3))
+    tokenizer = WhitespaceTokenizer("model_a")
+    other_tokenizer = WhitespaceTokenizer("model_b")
+
+    assert tokenizer.tokens_of("hello world") == 2
+    assert tokenizer.tokens_of("hello world") == 2
+    assert tokenizer.n_encode_calls == 1
+    assert BaseTokenizer.cache.hits == 1 and BaseTokenizer.cache.misses == 1
+
+    # keyed per tokenizer model
+    assert other_tokenizer.tokens_of("hello world") == 2
+    assert other_tokenizer.n_encode_calls == 1
+
+    # least recently used entries are evicted
+    assert tokenizer.tokens_of("hello world") == 2
+    assert tokenizer.tokens_of("a") == 1
+    assert tokenizer.tokens_of("b c") == 2
+    assert tokenizer.n_encode_calls == 3
+    assert len(BaseTokenizer.cache) == 3
+    tokenizer.tokens_of("hello world")
+    assert tokenizer.n_encode_calls == 3
+    other_tokenizer.tokens_of("hello world")
+    assert other_tokenizer.n_encode_calls == 2
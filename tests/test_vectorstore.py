@@ -1,10 +1,13 @@
-from asyncio import gather
+from asyncio import gather, sleep
+from time import perf_counter
+from types import SimpleNamespace
 from uuid import uuid4
 
 import pytest
 from langchain.docstore.document import Document
 from app.database.connection import cache
-from app.utils.chat.managers.vectorstore import VectorStoreManager
+from app.utils.chat.managers import vectorstore
+from app.utils.chat.managers.vectorstore import CollectionRegistry, VectorStoreManager
 
 
 @pytest.mark.asyncio
@@ -161,3 +164,235 @@ async def test_embedding_multiple_index_2(config, test_logger):
         for doc, score in query_results:
             test_logger.info(f"\n\n\n\nQuery={query}\nScore={score}\nContent={doc.page_content}")
     test_logger.info(f"\n\n\n\n\n\nTesting embedding: {queries_results}")
+
+
+
+@pytest.mark.asyncio
+async def test_upsert_documents(config, test_logger):
+    cache.start(config=config)
+    collection_name: str = uuid4().hex
+    texts = ["Monkey loves banana", "Apple is red", "Banana is yellow"]
+
+    result = await VectorStoreManager.upsert_documents("\n\n".join(texts), collection_name=collection_name)
+    assert result.n_new > 0 and result.n_updated == result.n_skipped == 0
+
+    # Embedding the same text again embeds nothing
+    same_result = await VectorStoreManager.upsert_documents("\n\n".join(texts), collection_name=collection_name)
+    assert same_result.ids == result.ids
+    assert same_result.n_skipped == result.n_new and same_result.n_new == same_result.n_updated == 0
+
+    # Only the new texts are embedded, and the changed metadata is updated
+    result = await cache.vectorstore.aadd_new_texts(
+        texts + texts[:1],
+        collection_name=collection_name,
+        metadatas=[{}, {}, {"source": "test"}, {}],
+    )
+    test_logger.info(f"Upsert result: {result}")
+    assert (result.n_new, result.n_updated, result.n_skipped) == (3, 0, 1)
+    result = await cache.vectorstore.aadd_new_texts(
+        texts, collection_name=collection_name, metadatas=[{}, {"source": "test"}, {"source": "test"}]
+    )
+    assert (result.n_new, result.n_updated, result.n_skipped) == (0, 1, 2)
+    await VectorStoreManager.delete_collection(collection_name)
+
+
+class InMemoryQdrant:
+    """Stands in for the gRPC collections API and the vectorstore, with a latency per call."""
+
+    def __init__(self, seconds_per_call: float = 0.002, seconds_per_embedding: float = 0.0) -> None:
+        self.seconds_per_call = seconds_per_call
+        self.seconds_per_embedding = seconds_per_embedding
+        self.collection_names: set[str] = set()
+        self.documents: dict[str, list[tuple[Document, float]]] = {}
+        self.n_calls: int = 0
+        self.n_embeddings: int = 0
+        self.client = SimpleNamespace(async_grpc_collections=self)
+
+    async def _call(self) -> None:
+        self.n_calls += 1
+        await sleep(self.seconds_per_call)
+
+    async def List(self, request) -> SimpleNamespace:
+        await self._call()
+        return SimpleNamespace(collections=[SimpleNamespace(name=name) for name in self.collection_names])
+
+    async def Create(self, request) -> None:
+        await self._call()
+        self.collection_names.add(request.collection_name)
+
+    async def Delete(self, request) -> SimpleNamespace:
+        await self._call()
+        self.collection_names.discard(request.collection_name)
+        return SimpleNamespace(result=True)
+
+    async def aadd_texts(self, texts: list[str], collection_name: str) -> list[str]:
+        await self._call()
+        if collection_name not in self.collection_names:
+            raise ValueError(f"Collection {collection_name} not found")
+        self.documents.setdefault(collection_name, []).extend((Document(page_content=text), 0.0) for text in texts)
+        return texts
+
+    async def _aembed_query(self, text: str) -> list[float]:
+        self.n_embeddings += 1
+        await sleep(self.seconds_per_embedding)
+        return [0.0] * 4
+
+    async def asimilarity_search(self, query: str, collection_name: str, k: int = 1) -> list[Document]:
+        await self._call()
+        if collection_name not in self.collection_names:
+            raise ValueError(f"Collection {collection_name} not found")
+        return [Document(page_content=f"{collection_name}: {query}")][:k]
+
+    async def asimilarity_search_with_score(
+        self, query: str, collection_name: str, k: int = 4
+    ) -> list[tuple[Document, float]]:
+        return await self.asimilarity_search_with_score_by_vector(
+            await self._aembed_query(query), collection_name=collection_name, k=k
+        )
+
+    async def asimilarity_search_with_score_by_vector(
+        self, embedding: list[float], collection_name: str, k: int = 4, **kwargs
+    ) -> list[tuple[Document, float]]:
+        await self._call()
+        return sorted(self.documents[collection_name], key=lambda x: x[1], reverse=True)[:k]
+
+    amax_marginal_relevance_search_with_score_by_vector = asimilarity_search_with_score_by_vector
+
+
+@pytest.mark.asyncio
+async def test_collection_registry(monkeypatch, test_logger):
+    qdrant = InMemoryQdrant()
+    monkeypatch.setattr(vectorstore, "cache", SimpleNamespace(vectorstore=qdrant))
+
+    async def query_latency(collections: CollectionRegistry, n_queries: int = 50) -> tuple[float, float]:
+        monkeypatch.setattr(VectorStoreManager, "collections", collections)
+        n_calls = qdrant.n_calls
+        start = perf_counter()
+        for _ in range(n_queries):
+            assert await VectorStoreManager.asimilarity_search("query", collection_name="a")
+        return (perf_counter() - start) / n_queries, (qdrant.n_calls - n_calls) / n_queries
+
+    collections = CollectionRegistry(ttl=30, missing_ttl=5)
+    monkeypatch.setattr(VectorStoreManager, "collections", collections)
+
+    # A missing collection is listed once, then cached
+    assert await VectorStoreManager.asimilarity_search("query", collection_name="a") == []
+    assert await VectorStoreManager.asimilarity_search("query", collection_name="a") == []
+    assert qdrant.n_calls == 1
+
+    # Creating and deleting collections updates the registry without listing them
+    await VectorStoreManager.create_collection(collection_name="a")
+    await VectorStoreManager.create_collection(collection_name="b")
+    assert await VectorStoreManager.delete_collection(collection_name="b")
+    assert qdrant.n_calls == 4
+    assert await collections.filter_existing(["a", "b"]) == ["a"]
+    assert qdrant.n_calls == 4
+
+    uncached_latency, uncached_calls = await query_latency(CollectionRegistry(ttl=0, missing_ttl=0))
+    cached_latency, cached_calls = await query_latency(collections)
+    test_logger.info(
+        f"Query latency: {uncached_latency * 1000:.2f}ms with {uncached_calls:.0f} calls -> "
+        f"{cached_latency * 1000:.2f}ms with {cached_calls:.0f} call"
+    )
+    assert uncached_calls == 2 and cached_calls == 1
+    assert cached_latency < uncached_latency
+
+    # Changes made by another process
+    qdrant.collection_names.discard("a")
+    assert await VectorStoreManager.asimilarity_search("query", collection_name="a") == []
+    qdrant.collection_names.add("c")
+    assert await VectorStoreManager.asimilarity_search("query", collection_name="c") == []
+    collections.missing_ttl = 0
+    assert await VectorStoreManager.asimilarity_search("query", collection_name="c")
+
+
+@pytest.mark.asyncio
+async def test_write_to_dropped_collection(monkeypatch):
+    qdrant = InMemoryQdrant()
+    monkeypatch.setattr(vectorstore, "cache", SimpleNamespace(vectorstore=qdrant))
+    collections = CollectionRegistry(ttl=30, missing_ttl=5)
+    monkeypatch.setattr(VectorStoreManager, "collections", collections)
+    await VectorStoreManager.create_collection(collection_name="a")
+    assert await collections.exists("a")
+
+    # Another process drops the collection, while it is still cached as existing
+    qdrant.collection_names.discard("a")
+    results = await gather(
+        *[
+            collections.write_unless_dropped(
+                lambda text=text: qdrant.aadd_texts([text], collection_name="a"), collection_name="a"
+            )
+            for text in ("text0", "text1")
+        ]
+    )
+    assert results == [["text0"], ["text1"]]
+    assert "a" in qdrant.collection_names
+    assert sorted(document.page_content for document, _ in qdrant.documents["a"]) == ["text0", "text1"]
+
+    # Other errors are raised
+    async def failing_write() -> None:
+        raise ConnectionError("Qdrant is down")
+
+    with pytest.raises(ConnectionError):
+        await collections.write_unless_dropped(failing_write, collection_name="a")
+
+
+@pytest.mark.asyncio
+async def test_multiple_collections_search(monkeypatch, test_logger):
+    qdrant = InMemoryQdrant(seconds_per_call=0.002, seconds_per_embedding=0.02)
+    monkeypatch.setattr(vectorstore, "cache", SimpleNamespace(vectorstore=qdrant))
+    monkeypatch.setattr(VectorStoreManager, "collections", CollectionRegistry())
+    collection_names: list[str] = ["user", "shared", "missing"]
+    for collection_idx, collection_name in enumerate(collection_names[:2]):
+        qdrant.collection_names.add(collection_name)
+        qdrant.documents[collection_name] = [
+            (Document(page_content=f"{collection_name}{doc_idx}"), (doc_idx * 2 + collection_idx) / 10)
+            for doc_idx in range(5)
+        ]
+    await VectorStoreManager.collections.refresh()
+
+    async def search_each_collection(k: int) -> list[tuple[Document, float]]:
+        """The previous search, embedding the query for every collection"""
+        results = await gather(
+            *[
+                qdrant.asimilarity_search_with_score("query", collection_name=collection_name, k=k)
+                for collection_name in collection_names[:2]
+            ]
+        )
+        return sorted([item for sublist in results for item in sublist], key=lambda x: x[1], reverse=True)[:k]
+
+    n_embeddings = qdrant.n_embeddings
+    start = perf_counter()
+    expected = await search_each_collection(k=3)
+    previous_elapsed = perf_counter() - start
+    previous_embeddings = qdrant.n_embeddings - n_embeddings
+
+    n_embeddings = qdrant.n_embeddings
+    start = perf_counter()
+    results = await VectorStoreManager.asimilarity_search_multiple_collections_with_score(
+        "query", collection_names=collection_names, k=3
+    )
+    elapsed = perf_counter() - start
+    embeddings = qdrant.n_embeddings - n_embeddings
+
+    test_logger.info(
+        f"Searching {len(collection_names)} collections: {previous_embeddings} embeddings in "
+        f"{previous_elapsed * 1000:.1f}ms -> {embeddings} embedding in {elapsed * 1000:.1f}ms"
+    )
+    assert results == expected
+    assert [document.page_content for document, _ in results] == ["shared4", "user4", "shared3"]
+    assert previous_embeddings == 2 and embeddings == 1
+
+    n_embeddings = qdrant.n_embeddings
+    assert len(
+        await VectorStoreManager.amax_marginal_relevance_search_multiple_collections_with_score(
+            "query", collection_names=collection_names, k=4
+        )
+    ) == 4
+    assert len(
+        await VectorStoreManager.asimilarity_search_multiple_collections(
+            "query", collection_names=collection_names, k=2
+        )
+    ) == 4
+    assert await VectorStoreManager.asimilarity_search_multiple_collections("query", collection_names=["missing"]) == []
+    assert qdrant.n_embeddings - n_embeddings == 2
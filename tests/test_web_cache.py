@@ -0,0 +1,141 @@
+from time import time
+from uuid import uuid4
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from requests_html import AsyncHTMLSession
+
+from app.database.connection import cache
+from app.utils.function_calling.callbacks import click_link
+from app.utils.function_calling.web_cache import WebCache
+
+PAGE: str = (
+    "<html><body><article>"
+    + " ".join(f"word{idx}" for idx in range(100))
+    + "</article></body></html>"
+)
+
+
+class WordSplitter:
+    def split_text(
+        self, text: str, tokens_per_chunk: int, chunk_overlap: int
+    ) -> list[str]:
+        words = text.split()
+        return [
+            " ".join(words[idx : idx + tokens_per_chunk])
+            for idx in range(0, len(words), tokens_per_chunk)
+        ]
+
+
+class MockShared:
+    token_text_splitter = WordSplitter()
+
+
+def test_web_cache_keys():
+    assert WebCache.normalize_url(
+        "HTTPS://Example.com:443/a/b/?z=1&a=2#section"
+    ) == WebCache.normalize_url("https://example.com/a/b?a=2&z=1")
+    assert WebCache.normalize_url(
+        "http://example.com:8080"
+    ) == WebCache.normalize_url("http://example.com:8080/")
+    assert WebCache.search_key("  What is   LLM? ") == WebCache.search_key(
+        "what is llm?"
+    )
+
+
+@pytest.mark.asyncio
+async def test_web_cache_ttl_and_lru():
+    web_cache = WebCache(max_size=2, ttl=60, stale_ttl=120)
+    await web_cache.set("a", 1)
+    await web_cache.set("b", 2, etag='"b"')
+    assert (await web_cache.get("a")).value == 1  # type: ignore
+    await web_cache.set("c", 3)  # "b" is the least recently used
+    assert await web_cache.get("b") is None
+    assert web_cache.metrics.evictions == 1
+
+    # A stale entry is kept only if it can be revalidated
+    await web_cache.set("d", 4, last_modified="Mon, 01 Jan 2024 00:00:00 GMT")
+    web_cache._entries["c"].stored_at = web_cache._entries[
+        "d"
+    ].stored_at = (time() - 90)
+    assert await web_cache.get("c") is None
+    stale = await web_cache.get("d")
+    assert stale is not None and not web_cache.is_fresh(stale)
+    assert stale.validators == {
+        "If-Modified-Since": "Mon, 01 Jan 2024 00:00:00 GMT"
+    }
+
+    async def factory() -> str:
+        return "searched"
+
+    assert await web_cache.get_or_set("e", factory) == "searched"
+    assert await web_cache.get_or_set("e", factory) == "searched"
+    assert web_cache.metrics.to_dict()["hits"] == 2
+
+
+@pytest.mark.asyncio
+async def test_web_cache_revalidation(monkeypatch, test_logger):
+    status_codes: list[int] = []
+    etag: str = '"v1"'
+
+    async def handler(request: web.Request) -> web.Response:
+        if request.headers.get("If-None-Match") == etag:
+            status_codes.append(304)
+            return web.Response(status=304, headers={"ETag": etag})
+        status_codes.append(200)
+        return web.Response(
+            text=PAGE, content_type="text/html", headers={"ETag": etag}
+        )
+
+    app = web.Application()
+    app.router.add_get("/page", handler)
+    server = TestServer(app)
+    await server.start_server()
+    web_cache = WebCache(ttl=60)
+    monkeypatch.setattr(click_link, "Shared", MockShared)
+    monkeypatch.setattr(click_link, "web_cache", web_cache)
+    asession = AsyncHTMLSession()
+    try:
+        url = str(server.make_url("/page"))
+
+        async def parse(url: str) -> list[str]:
+            return await click_link._parse_text_content(
+                url=url,
+                asession=asession,
+                tokens_per_chunk=10,
+                chunk_overlap=0,
+            )
+
+        chunks = await parse(url)
+        assert len(chunks) == 10
+        assert await parse(url + "#fragment") == chunks
+        assert status_codes == [200]
+
+        # Stale, but not modified
+        web_cache.ttl = 0
+        assert await parse(url) == chunks
+        assert status_codes == [200, 304]
+    finally:
+        await asession.close()
+        await server.close()
+
+    metrics = web_cache.metrics
+    test_logger.info(f"Web cache metrics: {metrics.to_dict()}")
+    assert metrics.hits == 1
+    assert metrics.revalidations == 1
+
+
+@pytest.mark.asyncio
+async def test_web_cache_redis(cache_manager):
+    key: str = f"search:test:{uuid4().hex}"
+    web_cache = WebCache(redis_getter=lambda: cache.redis)
+    await web_cache.set(key, {"https://example.com": "Example"})
+
+    # Another worker finds it in redis
+    other_web_cache = WebCache(redis_getter=lambda: cache.redis)
+    entry = await other_web_cache.get(key)
+    assert entry is not None
+    assert entry.value == {"https://example.com": "Example"}
+    assert other_web_cache.metrics.redis_hits == 1
+    await cache.redis.delete(web_cache.key_prefix + key)
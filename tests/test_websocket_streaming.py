@@ -0,0 +1,178 @@
+import asyncio
+from json import dumps, loads
+from time import perf_counter, process_time
+from typing import AsyncIterator, Optional
+
+import pytest
+
+from app.models.base_models import StreamProgress
+from app.utils.chat.managers.websocket import (
+    SendToWebsocket,
+    StreamFrameTemplate,
+)
+
+
+class MockWebSocket:
+    """Keeps text frames, encoding JSON like `starlette.websockets.WebSocket` does."""
+
+    def __init__(self) -> None:
+        self.texts: list[str] = []
+
+    async def send_text(self, data: str) -> None:
+        self.texts.append(data)
+
+    async def send_json(self, data: dict) -> None:
+        self.texts.append(
+            dumps(data, separators=(",", ":"), ensure_ascii=False)
+        )
+
+    @property
+    def frames(self) -> list[dict]:
+        return [loads(text) for text in self.texts]
+
+
+async def token_stream(
+    n_tokens: int, seconds_per_token: float
+) -> AsyncIterator[str]:
+    for token_idx in range(n_tokens):
+        await asyncio.sleep(seconds_per_token)
+        yield f" 토큰{token_idx}"
+
+
+async def legacy_stream(
+    websocket: MockWebSocket,
+    async_stream: AsyncIterator,
+    stream_progress: StreamProgress,
+    actual_role: Optional[str] = None,
+) -> None:
+    """The previous consumer, sending a frame for every delta."""
+    async for delta in async_stream:
+        stream_progress.buffer += delta
+        stream_progress.response += stream_progress.buffer
+        await SendToWebsocket.message(
+            websocket=websocket,  # type: ignore
+            msg=stream_progress.buffer,
+            chat_room_id=None,
+            finish=False,
+            actual_role=actual_role,
+            model_name=None,
+        )
+        stream_progress.buffer = ""
+
+
+@pytest.mark.parametrize("actual_role", [None, "assistant"])
+@pytest.mark.asyncio
+async def test_stream_frame_template(actual_role: Optional[str]):
+    legacy_websocket, websocket = MockWebSocket(), MockWebSocket()
+    msg: str = 'Hello, "world"\n\\ 안녕 \x00'
+    await SendToWebsocket.message(
+        websocket=legacy_websocket,  # type: ignore
+        msg=msg,
+        finish=False,
+        actual_role=actual_role,
+    )
+    await websocket.send_text(
+        StreamFrameTemplate(actual_role=actual_role).format(msg)
+    )
+    assert websocket.texts == legacy_websocket.texts
+
+
+@pytest.mark.asyncio
+async def test_coalesced_stream():
+    websocket, stream_progress = MockWebSocket(), StreamProgress()
+    await SendToWebsocket.coalesced_stream(
+        websocket=websocket,  # type: ignore
+        async_stream=token_stream(n_tokens=100, seconds_per_token=0.001),
+        stream_progress=stream_progress,
+        flush_interval=0.02,
+        flush_size=10**6,
+    )
+    expected: str = "".join(f" 토큰{token_idx}" for token_idx in range(100))
+    assert "".join(frame["msg"] for frame in websocket.frames) == expected
+    assert stream_progress.response == expected
+    assert stream_progress.buffer == ""
+    # The first token is sent at once, and the rest are coalesced
+    assert websocket.frames[0]["msg"] == " 토큰0"
+    assert len(websocket.frames) < 20
+
+    # Frames are sent at once when the buffer is full
+    websocket, stream_progress = MockWebSocket(), StreamProgress()
+    await SendToWebsocket.coalesced_stream(
+        websocket=websocket,  # type: ignore
+        async_stream=token_stream(n_tokens=100, seconds_per_token=0),
+        stream_progress=stream_progress,
+        flush_interval=60,
+        flush_size=64,
+    )
+    assert stream_progress.response == expected
+    assert all(
+        len(frame["msg"].encode("utf-8")) < 64 + 16
+        for frame in websocket.frames
+    )
+
+    # Text is flushed when the stream pauses, without waiting for the next token
+    async def pausing_stream() -> AsyncIterator[str]:
+        yield "a"
+        yield "b"
+        await asyncio.sleep(0.2)
+        yield "c"
+
+    websocket, stream_progress = MockWebSocket(), StreamProgress()
+    await SendToWebsocket.coalesced_stream(
+        websocket=websocket,  # type: ignore
+        async_stream=pausing_stream(),
+        stream_progress=stream_progress,
+        flush_interval=0.02,
+    )
+    assert [frame["msg"] for frame in websocket.frames] == ["a", "b", "c"]
+
+
+@pytest.mark.parametrize("n_sockets", [500])
+@pytest.mark.asyncio
+async def test_coalesced_stream_benchmark(n_sockets: int, test_logger):
+    n_tokens: int = 100
+
+    async def consume(async_stream: AsyncIterator) -> None:
+        async for _ in async_stream:
+            pass
+
+    async def run(coalesce: Optional[bool]) -> tuple[float, float, int]:
+        websockets = [MockWebSocket() for _ in range(n_sockets)]
+        streams = [
+            token_stream(n_tokens=n_tokens, seconds_per_token=0.002)
+            for _ in range(n_sockets)
+        ]
+        start, cpu_start = perf_counter(), process_time()
+        if coalesce is None:  # Only consume the token streams
+            await asyncio.gather(*[consume(stream) for stream in streams])
+        else:
+            await asyncio.gather(
+                *[
+                    (
+                        SendToWebsocket.coalesced_stream
+                        if coalesce
+                        else legacy_stream
+                    )(
+                        websocket=websocket,  # type: ignore
+                        async_stream=stream,
+                        stream_progress=StreamProgress(),
+                    )
+                    for websocket, stream in zip(websockets, streams)
+                ]
+            )
+        n_frames = sum(len(websocket.texts) for websocket in websockets)
+        return perf_counter() - start, process_time() - cpu_start, n_frames
+
+    _, base_cpu, _ = await run(coalesce=None)
+    legacy_elapsed, legacy_cpu, legacy_frames = await run(coalesce=False)
+    elapsed, cpu, frames = await run(coalesce=True)
+    test_logger.info(
+        f"{n_sockets} sockets x {n_tokens} tokens: "
+        f"{legacy_frames / legacy_elapsed:.0f} -> {frames / elapsed:.0f} frames/s, "
+        f"{legacy_frames / n_sockets:.0f} -> {frames / n_sockets:.1f} frames per stream, "
+        f"{(legacy_cpu - base_cpu) / n_sockets * 1000:.2f}ms -> "
+        f"{(cpu - base_cpu) / n_sockets * 1000:.2f}ms CPU per stream to send"
+    )
+    assert legacy_frames == n_sockets * n_tokens
+    assert frames < legacy_frames
+    assert cpu < legacy_cpu